@@ -1,277 +1,371 @@
 import os
 import csv
-from collections import defaultdict
+from operator import itemgetter
 
+from profiling import NO_PROFILE
+from sketches import ROW_COLUMNS as SKETCH_COLUMNS
+from sketches import ReportSketches
 
-def registrations_by_country(sorted_data, output_folder):
-    country_count = defaultdict(int)
-    for row in sorted_data:
-        country = row.get("Country", "").strip()
-        country_count[country] += 1
-    sorted_country = sorted(country_count.items(), key=lambda x: x[1], reverse=True)
-    total = sum(count for _, count in sorted_country)
-    with open(
-        os.path.join(output_folder, "all_registrations_by_country.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["Country", "Count"])
-        for country, count in sorted_country:
-            writer.writerow([country, count])
-        writer.writerow(["TOTAL", total])
-
-
-def us_registrations_by_state(sorted_data, output_folder):
-    us_state_count = defaultdict(int)
-    for row in sorted_data:
-        if row.get("Country", "").strip() == "United States":
-            state = row.get("State", "").strip()
-            us_state_count[state] += 1
-    sorted_us_state = sorted(us_state_count.items(), key=lambda x: x[1], reverse=True)
-    total = sum(count for _, count in sorted_us_state)
-    with open(
-        os.path.join(output_folder, "US_registrations_by_state.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["State", "Count"])
-        for state, count in sorted_us_state:
-            writer.writerow([state, count])
-        writer.writerow(["TOTAL", total])
-
-
-def registrations_by_role(sorted_data, output_folder):
-    role_count = defaultdict(int)
-    for row in sorted_data:
-        role = row.get("I am a...", "").strip()
-        role_count[role] += 1
-    sorted_role = sorted(role_count.items(), key=lambda x: x[1], reverse=True)
-    total = sum(count for _, count in sorted_role)
-    with open(
-        os.path.join(output_folder, "all_registrations_by_role.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["Role", "Count"])
-        for role, count in sorted_role:
-            writer.writerow([role, count])
-        writer.writerow(["TOTAL", total])
-
-
-def registrations_computed_grade_bands(sorted_data, output_folder):
-    grade_band_count = defaultdict(int)
-    for row in sorted_data:
-        grade = row.get("Computed Grade Band", "").strip()
-        grade_band_count[grade] += 1
-    sorted_grade = sorted(grade_band_count.items(), key=lambda x: x[1], reverse=True)
-    total = sum(count for _, count in sorted_grade)
-    with open(
-        os.path.join(output_folder, "all_registrations_computed_grade_bands.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["Computed Grade Band", "Count"])
-        for grade, count in sorted_grade:
-            writer.writerow([grade, count])
-        writer.writerow(["TOTAL", total])
-
-
-def registrations_computed_subject_categories(sorted_data, output_folder):
-    subject_count = defaultdict(int)
-    for row in sorted_data:
-        subj = row.get("Computed STEM/Tech/Non-STEM", "").strip()
-        subject_count[subj] += 1
-    sorted_subject = sorted(subject_count.items(), key=lambda x: x[1], reverse=True)
-    total = sum(count for _, count in sorted_subject)
-    with open(
-        os.path.join(
-            output_folder, "all_registrations_computed_subject_categories.csv"
-        ),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["Computed STEM/Tech/Non-STEM", "Count"])
-        for subj, count in sorted_subject:
-            writer.writerow([subj, count])
-        writer.writerow(["TOTAL", total])
-
-
-def us_teachers_by_state(sorted_data, output_folder):
-    us_teacher_rows = [
-        row
-        for row in sorted_data
-        if row.get("Country", "").strip() == "United States"
-        and row.get("I am a...", "").strip() == "Teacher / Educator"
-    ]
-    us_teacher_state_count = defaultdict(int)
-    for row in us_teacher_rows:
-        state = row.get("State", "").strip()
-        us_teacher_state_count[state] += 1
-    sorted_teacher_state = sorted(
-        us_teacher_state_count.items(), key=lambda x: x[1], reverse=True
-    )
-    total = sum(count for _, count in sorted_teacher_state)
-    with open(
-        os.path.join(output_folder, "US_teachers_by_state.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["State", "Count"])
-        for state, count in sorted_teacher_state:
-            writer.writerow([state, count])
-        writer.writerow(["TOTAL", total])
-
-
-def us_teachers_computed_grade_bands(sorted_data, output_folder):
-    us_teacher_rows = [
-        row
-        for row in sorted_data
-        if row.get("Country", "").strip() == "United States"
-        and row.get("I am a...", "").strip() == "Teacher / Educator"
-    ]
-    us_teacher_grade_count = defaultdict(int)
-    for row in us_teacher_rows:
-        grade = row.get("Computed Grade Band", "").strip()
-        us_teacher_grade_count[grade] += 1
-    sorted_teacher_grade = sorted(
-        us_teacher_grade_count.items(), key=lambda x: x[1], reverse=True
-    )
-    total = sum(count for _, count in sorted_teacher_grade)
-    with open(
-        os.path.join(output_folder, "US_teachers_computed_grade_bands.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["Computed Grade Band", "Count"])
-        for grade, count in sorted_teacher_grade:
-            writer.writerow([grade, count])
-        writer.writerow(["TOTAL", total])
-
-
-def us_teachers_computed_subject_categories(sorted_data, output_folder):
-    us_teacher_rows = [
-        row
-        for row in sorted_data
-        if row.get("Country", "").strip() == "United States"
-        and row.get("I am a...", "").strip() == "Teacher / Educator"
-    ]
-    us_teacher_subject_count = defaultdict(int)
-    for row in us_teacher_rows:
-        subj = row.get("Computed STEM/Tech/Non-STEM", "").strip()
-        us_teacher_subject_count[subj] += 1
-    sorted_teacher_subject = sorted(
-        us_teacher_subject_count.items(), key=lambda x: x[1], reverse=True
+# Each report is one spec entry; run_all_analyses evaluates every spec in a
+# single traversal of the rows.
+#
+# Spec keys:
+#   filename   output file in the output folder
+#   column     column to group by (values are stripped)
+#   label      header for the group column in the output file
+#   filter     optional predicate selecting the rows the report counts
+#   categories optional fixed list of values to report, in that order; other
+#              values are ignored and blanks are counted as "(Blank)"
+#   kind       "count" (default) or "first_seen", which keeps the first
+#              value_columns seen for each distinct column value
+
+
+# Rows are lists; ``columns`` maps a column name to its index in the row.
+
+
+def column_value(row, columns, column):
+    value = row[columns[column]]
+    return value.strip() if value else ""
+
+
+def is_us(row, columns):
+    return column_value(row, columns, "Country") == "United States"
+
+
+def is_us_teacher(row, columns):
+    return (
+        is_us(row, columns)
+        and column_value(row, columns, "I am a...") == "Teacher / Educator"
     )
-    total = sum(count for _, count in sorted_teacher_subject)
+
+
+REFERRAL_SOURCE_CATEGORIES = [
+    "Social Media (e.g., LinkedIn, X, Instagram)",
+    "Email",
+    "Internet Search (e.g., Google, Bing)",
+    "Word of Mouth (e.g., a friend or colleague)",
+]
+
+REPORT_SPECS = [
+    {
+        "filename": "all_registrations_by_country.csv",
+        "column": "Country",
+        "label": "Country",
+    },
+    {
+        "filename": "US_registrations_by_state.csv",
+        "column": "State",
+        "label": "State",
+        "filter": is_us,
+    },
+    {
+        "filename": "all_registrations_by_role.csv",
+        "column": "I am a...",
+        "label": "Role",
+    },
+    {
+        "filename": "all_registrations_computed_grade_bands.csv",
+        "column": "Computed Grade Band",
+        "label": "Computed Grade Band",
+    },
+    {
+        "filename": "all_registrations_computed_subject_categories.csv",
+        "column": "Computed STEM/Tech/Non-STEM",
+        "label": "Computed STEM/Tech/Non-STEM",
+    },
+    {
+        "filename": "US_teachers_by_state.csv",
+        "column": "State",
+        "label": "State",
+        "filter": is_us_teacher,
+    },
+    {
+        "filename": "US_teachers_computed_grade_bands.csv",
+        "column": "Computed Grade Band",
+        "label": "Computed Grade Band",
+        "filter": is_us_teacher,
+    },
+    {
+        "filename": "US_teachers_computed_subject_categories.csv",
+        "column": "Computed STEM/Tech/Non-STEM",
+        "label": "Computed STEM/Tech/Non-STEM",
+        "filter": is_us_teacher,
+    },
+    {
+        "filename": "all_schools_locations.csv",
+        "kind": "first_seen",
+        "column": "School / Company Name",
+        "label": "School / Company Name",
+        "value_columns": ["Country", "City/Town", "State"],
+    },
+    {
+        "filename": "US_registrations_by_role.csv",
+        "column": "I am a...",
+        "label": "Role",
+        "filter": is_us,
+    },
+    {
+        "filename": "referral_source_analysis.csv",
+        "column": "Referral Source",
+        "label": "Referral Source Category",
+        "categories": REFERRAL_SOURCE_CATEGORIES,
+    },
+]
+
+
+# Count reports only look at a few low-cardinality columns.  Rows are tallied
+# in a count cube, once per distinct combination of their raw values in
+# CUBE_COLUMNS and the month of their sort date, and every count report is
+# rolled up from the cube when it is written, so filters and stripping run
+# once per combination instead of once per row and report.  Count-report
+# columns and filters may only use CUBE_DIMENSIONS.  The cube is also written
+# to count_cube.csv, from which count_cube.py answers other breakdowns.
+CUBE_COLUMNS = [
+    "Country",
+    "State",
+    "I am a...",
+    "Computed Grade Band",
+    "Computed STEM/Tech/Non-STEM",
+    "Referral Source",
+]
+MONTH_DIMENSION = "Month"
+CUBE_DIMENSIONS = CUBE_COLUMNS + [MONTH_DIMENSION]
+CUBE_KEY_COLUMNS = {column: i for i, column in enumerate(CUBE_DIMENSIONS)}
+CUBE_FILENAME = "count_cube.csv"
+
+# Counter entries are [count, first_key], where first_key is the position of
+# the first row that produced them.  Reports list values in first-seen order
+# before sorting, so keeping the smallest key when merging makes
+# merge_counters associative and lets partial counts from separate chunks
+# reproduce a serial count exactly.  first_seen reports keep their own
+# {value: [info, first_key]} entries.
+
+
+def _is_first_seen(spec):
+    return spec.get("kind") == "first_seen"
+
+
+def new_counters(specs=REPORT_SPECS, sketch_options=None):
+    """Return empty counters; ``sketch_options`` adds ``ReportSketches``."""
+    counters = {"cube": {}}
+    for spec in specs:
+        if _is_first_seen(spec):
+            counters[spec["filename"]] = {}
+    if sketch_options is not None:
+        counters["sketches"] = ReportSketches(**sketch_options)
+    return counters
+
+
+def row_counter(columns, specs=REPORT_SPECS, date_column=None):
+    """Return ``count(counters, row, order_key)`` for rows indexed by ``columns``.
+
+    The month comes from ``date_column``, which holds canonical sort dates
+    (see ``timestamps.parse_sort_date``); without it the month is blank.
+    """
+    cube_values = itemgetter(*[columns[column] for column in CUBE_COLUMNS])
+    date_index = columns[date_column] if date_column is not None else None
+    first_seen_specs = [spec for spec in specs if _is_first_seen(spec)]
+    sketch_values = itemgetter(*[columns[column] for column in SKETCH_COLUMNS])
+
+    def count(counters, row, order_key):
+        cube = counters["cube"]
+        month = row[date_index][:7] if date_index is not None else ""
+        key = (*cube_values(row), month)
+        entry = cube.get(key)
+        if entry is None:
+            cube[key] = [1, order_key]
+        else:
+            entry[0] += 1
+        for spec in first_seen_specs:
+            row_filter = spec.get("filter")
+            if row_filter is not None and not row_filter(row, columns):
+                continue
+            counts = counters[spec["filename"]]
+            value = column_value(row, columns, spec["column"])
+            if value and value not in counts:
+                counts[value] = [
+                    tuple(
+                        column_value(row, columns, column)
+                        for column in spec["value_columns"]
+                    ),
+                    order_key,
+                ]
+        sketches = counters.get("sketches")
+        if sketches is not None:
+            sketches.add_row(*sketch_values(row))
+
+    return count
+
+
+def count_rows(
+    rows, columns, specs=REPORT_SPECS, date_column=None, sketch_options=None
+):
+    counters = new_counters(specs, sketch_options)
+    count = row_counter(columns, specs, date_column)
+    for position, row in enumerate(rows):
+        count(counters, row, position)
+    return counters
+
+
+def merge_counters(target, other):
+    """Merge ``other`` into ``target`` in place and return ``target``."""
+    for name, other_counts in other.items():
+        if name == "sketches":
+            target[name].merge(other_counts)
+            continue
+        counts = target[name]
+        add = name == "cube"
+        for value, (payload, order_key) in other_counts.items():
+            current = counts.get(value)
+            if current is None:
+                counts[value] = [payload, order_key]
+                continue
+            if add:
+                current[0] += payload
+            if order_key < current[1]:
+                if not add:
+                    current[0] = payload
+                current[1] = order_key
+    return target
+
+
+def report_counts(counters, specs=REPORT_SPECS, profile=NO_PROFILE):
+    """Roll the counters up into ``{filename: {value: [payload, first_key]}}``."""
+    reports = {}
+    cube = counters["cube"].items()
+    for spec in specs:
+        if _is_first_seen(spec):
+            reports[spec["filename"]] = counters[spec["filename"]]
+            continue
+        with profile.stage(f"report {spec['filename']}"):
+            counts = reports[spec["filename"]] = {}
+            row_filter = spec.get("filter")
+            for key, (count, first_key) in cube:
+                if row_filter is not None and not row_filter(key, CUBE_KEY_COLUMNS):
+                    continue
+                value = column_value(key, CUBE_KEY_COLUMNS, spec["column"])
+                current = counts.get(value)
+                if current is None:
+                    counts[value] = [count, first_key]
+                else:
+                    current[0] += count
+                    if first_key < current[1]:
+                        current[1] = first_key
+    return reports
+
+
+def _first_seen_order(counts):
+    return sorted(counts.items(), key=lambda x: x[1][1])
+
+
+def write_report(spec, counts, output_folder):
     with open(
-        os.path.join(output_folder, "US_teachers_computed_subject_categories.csv"),
+        os.path.join(output_folder, spec["filename"]),
         "w",
         newline="",
         encoding="utf-8",
     ) as f:
         writer = csv.writer(f)
-        writer.writerow(["Computed STEM/Tech/Non-STEM", "Count"])
-        for subj, count in sorted_teacher_subject:
-            writer.writerow([subj, count])
-        writer.writerow(["TOTAL", total])
-
-
-def all_schools_locations(sorted_data, output_folder):
-    schools = {}
-    for row in sorted_data:
-        school = row.get("School / Company Name", "").strip()
-        if school and school not in schools:
-            schools[school] = (
-                row.get("Country", "").strip(),
-                row.get("City/Town", "").strip(),
-                row.get("State", "").strip(),
+        if spec.get("kind") == "first_seen":
+            writer.writerow([spec["label"]] + spec["value_columns"])
+            for value, (info, _) in sorted(
+                _first_seen_order(counts), key=lambda x: x[1][0][0].lower()
+            ):
+                writer.writerow([value] + list(info))
+            return
+
+        writer.writerow([spec["label"], "Count"])
+        if "categories" in spec:
+            rows = [(cat, counts.get(cat, [0])[0]) for cat in spec["categories"]]
+            rows.append(("(Blank)", counts.get("", [0])[0]))
+        else:
+            rows = sorted(
+                ((value, count) for value, (count, _) in _first_seen_order(counts)),
+                key=lambda x: x[1],
+                reverse=True,
             )
-    sorted_schools = sorted(schools.items(), key=lambda x: x[1][0].lower())
-    with open(
-        os.path.join(output_folder, "all_schools_locations.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["School / Company Name", "Country", "City/Town", "State"])
-        for school, info in sorted_schools:
-            writer.writerow([school] + list(info))
-
-
-def us_registrations_by_role(sorted_data, output_folder):
-    us_role_count = defaultdict(int)
-    for row in sorted_data:
-        if row.get("Country", "").strip() == "United States":
-            role = row.get("I am a...", "").strip()
-            us_role_count[role] += 1
-    sorted_us_role = sorted(us_role_count.items(), key=lambda x: x[1], reverse=True)
-    total = sum(count for _, count in sorted_us_role)
-    with open(
-        os.path.join(output_folder, "US_registrations_by_role.csv"),
-        "w",
-        newline="",
-        encoding="utf-8",
-    ) as f:
-        writer = csv.writer(f)
-        writer.writerow(["Role", "Count"])
-        for role, count in sorted_us_role:
-            writer.writerow([role, count])
-        writer.writerow(["TOTAL", total])
-
-
-def referral_source_analysis(sorted_data, output_folder):
-    REFERRAL_SOURCE_CATEGORIES = [
-        "Social Media (e.g., LinkedIn, X, Instagram)",
-        "Email",
-        "Internet Search (e.g., Google, Bing)",
-        "Word of Mouth (e.g., a friend or colleague)",
+        for value, count in rows:
+            writer.writerow([value, count])
+        writer.writerow(["TOTAL", sum(count for _, count in rows)])
+
+
+def write_reports(reports, output_folder, specs=REPORT_SPECS, profile=NO_PROFILE):
+    """Write every report from ``report_counts``-shaped ``reports``.
+
+    Writing a report is timed as stage "report <filename>", together with its
+    roll-up in ``report_counts``.
+    """
+    for spec in specs:
+        with profile.stage(f"report {spec['filename']}"):
+            write_report(spec, reports[spec["filename"]], output_folder)
+
+
+def cube_rows(counters):
+    """Return the cube as (stripped dimension values, count) in first-seen order.
+
+    Combinations that only differed by surrounding whitespace are merged.
+    """
+    merged = {}
+    for key, (count, first_key) in counters["cube"].items():
+        values = tuple(value.strip() if value else "" for value in key)
+        current = merged.get(values)
+        if current is None:
+            merged[values] = [count, first_key]
+        else:
+            current[0] += count
+            if first_key < current[1]:
+                current[1] = first_key
+    return [
+        (values, count)
+        for values, (count, _) in sorted(merged.items(), key=lambda x: x[1][1])
     ]
-    referral_source_count = {cat: 0 for cat in REFERRAL_SOURCE_CATEGORIES}
-    referral_source_count["(Blank)"] = 0
-    for row in sorted_data:
-        val = row.get("Referral Source", "")
-        val_stripped = val.strip() if val else ""
-        if val_stripped in REFERRAL_SOURCE_CATEGORIES:
-            referral_source_count[val_stripped] += 1
-        elif val_stripped == "":
-            referral_source_count["(Blank)"] += 1
+
+
+def write_cube(counters, output_folder):
     with open(
-        os.path.join(output_folder, "referral_source_analysis.csv"),
+        os.path.join(output_folder, CUBE_FILENAME),
         "w",
         newline="",
         encoding="utf-8",
     ) as f:
         writer = csv.writer(f)
-        writer.writerow(["Referral Source Category", "Count"])
-        for cat in REFERRAL_SOURCE_CATEGORIES + ["(Blank)"]:
-            writer.writerow([cat, referral_source_count[cat]])
-        writer.writerow(["TOTAL", sum(referral_source_count.values())])
-
-
-def run_all_analyses(sorted_data, output_folder):
-    registrations_by_country(sorted_data, output_folder)
-    us_registrations_by_state(sorted_data, output_folder)
-    registrations_by_role(sorted_data, output_folder)
-    registrations_computed_grade_bands(sorted_data, output_folder)
-    registrations_computed_subject_categories(sorted_data, output_folder)
-    us_teachers_by_state(sorted_data, output_folder)
-    us_teachers_computed_grade_bands(sorted_data, output_folder)
-    us_teachers_computed_subject_categories(sorted_data, output_folder)
-    all_schools_locations(sorted_data, output_folder)
-    us_registrations_by_role(sorted_data, output_folder)
-    referral_source_analysis(sorted_data, output_folder)
+        writer.writerow(CUBE_DIMENSIONS + ["Count"])
+        for values, count in cube_rows(counters):
+            writer.writerow(list(values) + [count])
+
+
+def write_analyses(counters, output_folder, profile=NO_PROFILE, reports=None):
+    """Write every report and the count cube from ``counters``.
+
+    ``reports`` are the counters rolled up by ``report_counts``, computed here
+    when not given.
+    """
+    if reports is None:
+        reports = report_counts(counters, profile=profile)
+    write_reports(reports, output_folder, profile=profile)
+    with profile.stage(f"report {CUBE_FILENAME}"):
+        write_cube(counters, output_folder)
+    sketches = counters.get("sketches")
+    if sketches is not None:
+        with profile.stage("report sketches"):
+            sketches.write(output_folder)
+
+
+def run_all_analyses(
+    sorted_data,
+    output_folder,
+    columns,
+    profile=NO_PROFILE,
+    date_column=None,
+    sketch_options=None,
+):
+    with profile.stage("count reports") as record:
+        counters = count_rows(
+            sorted_data,
+            columns,
+            date_column=date_column,
+            sketch_options=sketch_options,
+        )
+        record["rows"] += sum(count for count, _ in counters["cube"].values())
+    write_analyses(counters, output_folder, profile)
+    return counters
@@ -0,0 +1,489 @@
+"""Benchmark ``main.py`` on synthetic Mailchimp exports.
+
+Run ``python benchmark.py --rows 10000 100000`` from the project folder.  For
+each size a synthetic export with the real header layout is generated once
+(and reused afterwards) into the data folder, then ``main.py`` is run on it
+in a fresh process.  Any options the benchmark does not know, such as
+``--backend columnar`` or ``--workers 4``, are passed on to ``main.py``.
+
+The values are drawn from the project's own reference data, so the cleaning
+rules see the mix they see in production: country names and aliases from
+``country_codes.csv`` and ``country_mappings.json``, cities from
+``city_to_country.json`` and ``city_corrections.json``, states from
+``state_mappings.json``, entries from the bad_* lists, @qq.com addresses,
+unparseable dates, and ticked grade and subject checkboxes.  The same seed
+always gives the same file.
+
+``main.py`` runs in a reference folder inside the data folder that holds a
+copy of the mapping files and a small synthetic gazetteer of the generated
+cities, so a fresh checkout without ``all_cities.csv`` can be benchmarked.
+``--gazetteer all_cities.csv`` uses a real gazetteer instead.  Paths passed
+on to ``main.py`` are relative to that folder.
+
+Stage timings come from the run's ``run_report.json`` (see ``profiling.py``):
+
+- load: reading the reference data and reading and parsing the CSV;
+- clean: the cleaning rules (part of load with ``--workers``, where the pool
+  cleans);
+- sort: sorting in memory (with ``--memory-budget-mb`` the runs are sorted
+  during load and merged during write);
+- write: the master and split files;
+- analyze: counting and writing the reports.
+
+``--save-baseline`` stores the results; later runs compare against them and
+exit with status 1 when a stage got slower than the tolerance allows.
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+from cleaning_rules import DELETION_SET, DESIRED_ORDER, NON_TEACHING_CLEAR_COLUMNS
+from profiling import RUN_REPORT_FILENAME
+from reference_data import GAZETTEER_FILE, REFERENCE_FILES
+
+DEFAULT_ROWS = [10000, 100000]
+DATA_FOLDER = "benchmark-data"
+REFERENCE_FOLDER = "reference"
+BASELINE_FILENAME = "baseline.json"
+BLOCK_ROWS = 10000
+STAGES = ["load", "clean", "sort", "write", "analyze"]
+# A stage is a regression when it is this much slower than the baseline and
+# the difference is above the noise floor.
+DEFAULT_TOLERANCE = 0.25
+NOISE_FLOOR_SECONDS = 0.05
+
+# Input columns in export order; the checkbox columns sit between "I don't
+# teach at the moment" and "Notes", as the cleaning rules expect.
+_CHECKBOX_COLUMNS = DESIRED_ORDER[
+    DESIRED_ORDER.index("Preschool") : DESIRED_ORDER.index("Cultural education") + 1
+]
+EXPORT_HEADER = (
+    [
+        "Email Address",
+        "Name (First)",
+        "Name (Last)",
+        "I am a...",
+        "School / Company Name",
+        "Country",
+        "City/Town",
+        "State",
+        "Zip Code",
+        "Number of Students",
+        "I don't teach at the moment",
+    ]
+    + _CHECKBOX_COLUMNS
+    + [
+        "Notes",
+        "Full Name",
+        "Referral Source",
+        "City",
+        "Ages Taught",
+        "Primary Subject",
+        "Day of AI",
+        "MIT RAISE",
+        "Interested in research participation",
+        "Entry Date",
+        "OPTIN_TIME",
+    ]
+    + sorted(DELETION_SET)
+)
+
+FIRST_NAMES = ["Maria", "James", "Wei", "Priya", "José", "Ann", "Chloé", "", "Olu"]
+LAST_NAMES = ["Smith", "Garcia", "Li", "Patel", "Núñez", "Okafor", "", "Müller"]
+ROLES = [
+    ("Teacher / Educator", 60),
+    ("Student", 10),
+    ("Parent", 5),
+    ("Administrator", 8),
+    ("Other", 7),
+    ("", 10),
+]
+EMAIL_DOMAINS = [
+    ("gmail.com", 45),
+    ("yahoo.com", 8),
+    ("outlook.com", 6),
+    ("qq.com", 3),
+    ("QQ.com", 0.3),
+    ("163.com", 2),
+    ("schools.nyc.gov", 10),
+    ("k12.ca.us", 10),
+    ("school.edu", 15),
+]
+US_CITIES = ["New York", "Boston", "Chicago", "Austin", "Houston", "Seattle"]
+SCHOOLS = ["Lincoln High School", "MIT", "Roosevelt Elementary", "Home", "École"]
+REFERRAL_SOURCES = [
+    ("Social Media (e.g., LinkedIn, X, Instagram)", 20),
+    ("Email", 25),
+    ("Internet Search (e.g., Google, Bing)", 15),
+    ("Word of Mouth (e.g., a friend or colleague)", 20),
+    ("Other", 5),
+    ("", 15),
+]
+NOTES = [("", 95), ("Looking forward to it", 3), ('Line one\nline "two", three', 2)]
+FIRST_DATE = datetime(2024, 1, 1)
+DATE_SPAN_SECONDS = 2 * 365 * 24 * 3600
+
+
+def _load_json(base_dir, filename):
+    with open(os.path.join(base_dir, filename), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _spread(values, total_weight):
+    # Give a list of values ``total_weight`` between them.
+    values = list(values)
+    return [(value, total_weight / len(values)) for value in values]
+
+
+def value_pools(base_dir="."):
+    """Return ``{column: (values, cum_weights)}`` for the generated columns."""
+    with open(
+        os.path.join(base_dir, "country_codes.csv"), newline="", encoding="utf-8"
+    ) as f:
+        country_names = [row["Name"] for row in csv.DictReader(f)]
+    country_mappings = _load_json(base_dir, "country_mappings.json")
+    city_to_country = _load_json(base_dir, "city_to_country.json")
+    city_corrections = _load_json(base_dir, "city_corrections.json")
+    state_mappings = _load_json(base_dir, "state_mappings.json")
+
+    weighted = {
+        "I am a...": ROLES,
+        "Country": [
+            ("United States", 55),
+            ("", 8),
+            ("United States of America", 3),
+            ("Other - Non-US", 1),
+            ("China", 3),
+            ("India", 4),
+            ("Canada", 3),
+        ]
+        + _spread(country_mappings, 6)
+        + _spread(country_names, 17),
+        "City/Town": [("", 10), ("12345", 0.5)]
+        + _spread(US_CITIES, 40)
+        + _spread((city.title() for city in city_to_country), 25)
+        + _spread(city_corrections, 10)
+        + _spread(_load_json(base_dir, "bad_city_entries.json"), 3)
+        + _spread((state.title() for state in state_mappings.values()), 1.5),
+        "State": [("", 20), ("Other - Non-US", 2), ("Ontario", 2)]
+        + _spread((abbr.upper() for abbr in state_mappings), 45)
+        + _spread((state.title() for state in state_mappings.values()), 25)
+        + _spread(_load_json(base_dir, "bad_state_entries.json"), 3),
+        "School / Company Name": [("", 20)]
+        + _spread(SCHOOLS, 75)
+        + _spread(_load_json(base_dir, "bad_school_entries.json"), 5),
+        "Referral Source": REFERRAL_SOURCES,
+        "Notes": NOTES,
+        "email domain": EMAIL_DOMAINS,
+    }
+    pools = {}
+    for column, pairs in weighted.items():
+        values = [value for value, _ in pairs]
+        cum_weights = []
+        total = 0
+        for _, weight in pairs:
+            total += weight
+            cum_weights.append(total)
+        pools[column] = (values, cum_weights)
+    return pools
+
+
+def _tick_rate(column):
+    if column in ("Computer science", "Mathematics", "Science"):
+        return 0.2
+    if column in NON_TEACHING_CLEAR_COLUMNS:  # grade levels
+        return 0.15
+    return 0.05
+
+
+def _randoms(rng, count):
+    return [rng.random() for _ in range(count)]
+
+
+def _export_block(rng, pools, first_row, count, total_rows):
+    def draw(column):
+        values, cum_weights = pools[column]
+        return rng.choices(values, cum_weights=cum_weights, k=count)
+
+    columns = {column: draw(column) for column in pools}
+    # Some people sign up more than once.
+    people = int(total_rows * 0.95) or 1
+    columns["Email Address"] = [
+        f"user{rng.randrange(people)}@{domain}" for domain in columns["email domain"]
+    ]
+    columns["Name (First)"] = rng.choices(FIRST_NAMES, k=count)
+    columns["Name (Last)"] = rng.choices(LAST_NAMES, k=count)
+    columns["Zip Code"] = [f"{rng.randrange(100000):05d}" for _ in range(count)]
+    columns["Number of Students"] = rng.choices(["", "25", "120", "30"], k=count)
+    columns["I don't teach at the moment"] = [
+        "I don't teach at the moment" if r < 0.1 else "" for r in _randoms(rng, count)
+    ]
+    for column in _CHECKBOX_COLUMNS:
+        rate = _tick_rate(column)
+        columns[column] = [column if r < rate else "" for r in _randoms(rng, count)]
+
+    optin_times = []
+    entry_dates = []
+    for r, kind in zip(_randoms(rng, count), _randoms(rng, count)):
+        when = FIRST_DATE + timedelta(seconds=int(r * DATE_SPAN_SECONDS))
+        optin_times.append(f"{when:%Y-%m-%d %H:%M:%S}")
+        if kind < 0.2:
+            entry_dates.append(f"{when:%Y-%m-%d}")
+        elif kind < 0.205:
+            entry_dates.append(f"{when:%Y/%m/%d}")  # unparseable
+        else:
+            entry_dates.append("")
+    columns["OPTIN_TIME"] = optin_times
+    columns["Entry Date"] = entry_dates
+    columns["Entry Id"] = [str(first_row + n) for n in range(count)]
+    columns["OPTIN_IP"] = [f"10.0.{n % 256}.{n // 256 % 256}" for n in range(count)]
+    columns["User Agent"] = ["Mozilla/5.0"] * count
+
+    blank = [""] * count
+    return zip(*(columns.get(column, blank) for column in EXPORT_HEADER))
+
+
+def generate_export(path, rows, seed=0, base_dir="."):
+    """Write a synthetic export of ``rows`` rows to ``path``."""
+    rng = random.Random(seed)
+    pools = value_pools(base_dir)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_HEADER)
+        for first_row in range(0, rows, BLOCK_ROWS):
+            count = min(BLOCK_ROWS, rows - first_row)
+            writer.writerows(_export_block(rng, pools, first_row, count, rows))
+
+
+def generate_gazetteer(path, base_dir="."):
+    """Write an all_cities.csv of the cities ``generate_export`` draws."""
+    states = sorted(set(_load_json(base_dir, "state_mappings.json").values()))
+    city_to_country = _load_json(base_dir, "city_to_country.json")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["geonameid", "name", "asciiname", "alternatenames", "country", "state(s)"]
+        )
+        geonameid = 0
+        for n, city in enumerate(US_CITIES):
+            geonameid += 1
+            # Each city is in a few states, so some city/state pairs match.
+            in_states = "|".join(states[n :: len(US_CITIES)][:3])
+            writer.writerow([geonameid, city, city, "", "United States", in_states])
+        for city, country in city_to_country.items():
+            geonameid += 1
+            writer.writerow([geonameid, city.title(), city, "", country, ""])
+
+
+def reference_folder(data_folder, gazetteer=None):
+    """Return a folder with the mapping files and a gazetteer to run main.py in.
+
+    ``gazetteer`` is the path of an all_cities.csv to use; a synthetic one is
+    generated when None.
+    """
+    folder = os.path.join(data_folder, REFERENCE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    for filename in REFERENCE_FILES:
+        shutil.copyfile(filename, os.path.join(folder, filename))
+    target = os.path.join(folder, GAZETTEER_FILE)
+    if gazetteer is None:
+        generate_gazetteer(target + ".tmp")
+        # Keep the file, and so its compiled index, when it is unchanged.
+        if os.path.exists(target) and _same_contents(target, target + ".tmp"):
+            os.remove(target + ".tmp")
+        else:
+            os.replace(target + ".tmp", target)
+    else:
+        if not os.path.isfile(gazetteer):
+            raise FileNotFoundError(f"Gazetteer '{gazetteer}' not found")
+        shutil.copy2(gazetteer, target)
+    return folder
+
+
+def _same_contents(path, other):
+    with open(path, "rb") as f, open(other, "rb") as g:
+        return f.read() == g.read()
+
+
+def export_path(data_folder, rows, seed):
+    return os.path.join(data_folder, f"export-{rows}-seed{seed}.csv")
+
+
+def stage_seconds(report):
+    """Map a run report's stages onto ``STAGES``."""
+    stages = {stage["name"]: stage["wall_seconds"] for stage in report["stages"]}
+    clean = stages.get("clean", 0.0)
+    return {
+        "load": stages.get("load reference data", 0.0)
+        + stages.get("read and clean", 0.0)
+        - clean,
+        "clean": clean,
+        "sort": stages.get("sort", 0.0),
+        "write": stages.get("write", 0.0),
+        "analyze": stages.get("count reports", 0.0)
+        + sum(
+            seconds for name, seconds in stages.items() if name.startswith("report ")
+        ),
+    }
+
+
+def run_benchmark(rows, seed, data_folder, main_args, reference_dir):
+    """Run ``main.py`` on the export of ``rows`` rows and return its results.
+
+    ``main.py`` runs in ``reference_dir`` (see ``reference_folder``).
+    """
+    path = export_path(data_folder, rows, seed)
+    if not os.path.exists(path):
+        print(f"Generating {rows} rows into '{path}'...")
+        generate_export(path + ".tmp", rows, seed)
+        os.replace(path + ".tmp", path)
+    output_folder = os.path.abspath(os.path.join(data_folder, f"outputs-{rows}"))
+    os.makedirs(output_folder, exist_ok=True)
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    subprocess.run(
+        [
+            sys.executable,
+            main_py,
+            os.path.abspath(path),
+            "--output-folder",
+            output_folder,
+        ]
+        + main_args,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        cwd=reference_dir,
+    )
+    with open(os.path.join(output_folder, RUN_REPORT_FILENAME), encoding="utf-8") as f:
+        report = json.load(f)
+    total = report["total_seconds"]
+    return {
+        "rows": report.get("rows_read", rows),
+        "total_seconds": total,
+        "rows_per_second": report.get("rows_read", rows) / total if total else None,
+        "peak_rss_mb": report["peak_rss_mb"],
+        "stages": stage_seconds(report),
+    }
+
+
+def print_results(results):
+    print(
+        f"{'rows':>10} {'total s':>9} {'rows/s':>10} {'RSS MB':>8} "
+        + " ".join(f"{stage:>8}" for stage in STAGES)
+    )
+    for rows, result in results.items():
+        rate = result["rows_per_second"]
+        rss = result["peak_rss_mb"]
+        print(
+            f"{rows:>10} {result['total_seconds']:>9.2f} "
+            f"{rate and round(rate):>10} {rss and round(rss):>8} "
+            + " ".join(f"{result['stages'][stage]:>8.2f}" for stage in STAGES)
+        )
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a message for every stage slower than its baseline allows."""
+    regressions = []
+    for rows, result in results.items():
+        before = baseline["results"].get(str(rows))
+        if before is None:
+            continue
+        timings = dict(result["stages"], total=result["total_seconds"])
+        old_timings = dict(before["stages"], total=before["total_seconds"])
+        for stage, seconds in timings.items():
+            old = old_timings.get(stage)
+            if old is None:
+                continue
+            if seconds > old * (1 + tolerance) and seconds - old > NOISE_FLOOR_SECONDS:
+                change = f"+{(seconds / old - 1) * 100:.0f}%" if old else "new"
+                regressions.append(
+                    f"{rows} rows: {stage} took {seconds:.2f}s, "
+                    f"baseline {old:.2f}s ({change})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark main.py on synthetic exports; other options are "
+        "passed on to main.py."
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-folder", default=DATA_FOLDER)
+    parser.add_argument(
+        "--gazetteer",
+        default=None,
+        metavar="PATH",
+        help="all_cities.csv to clean against (default: a synthetic one)",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help=f"baseline file (default: {BASELINE_FILENAME} in the data folder)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="flag stages slower than the baseline by more than this fraction",
+    )
+    args, main_args = parser.parse_known_args()
+    os.makedirs(args.data_folder, exist_ok=True)
+    baseline_path = args.baseline or os.path.join(args.data_folder, BASELINE_FILENAME)
+    try:
+        reference_dir = reference_folder(args.data_folder, args.gazetteer)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    results = {
+        rows: run_benchmark(rows, args.seed, args.data_folder, main_args, reference_dir)
+        for rows in args.rows
+    }
+    print_results(results)
+
+    if args.save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "seed": args.seed,
+                    "gazetteer": args.gazetteer,
+                    "main_args": main_args,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"Baseline saved to '{baseline_path}'")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (
+            baseline["seed"] != args.seed
+            or baseline.get("gazetteer") != args.gazetteer
+            or baseline["main_args"] != main_args
+        ):
+            print(
+                f"Warning: the baseline was run with seed {baseline['seed']}, "
+                f"gazetteer {baseline.get('gazetteer')} and options "
+                f"{baseline['main_args']}"
+            )
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against '{baseline_path}'")
@@ -0,0 +1,665 @@
+from location_cache import LocationCache
+from normalization import fold_case, normalize_key, remove_accents
+from reference_data import load_reference_data
+from row_schema import RowSchema
+
+
+# Rules run in registration order; clean_row applies all of them to one row so
+# the whole cleaning chain costs a single traversal of the data.
+CLEANING_RULES = []
+
+
+def cleaning_rule(func):
+    CLEANING_RULES.append(func)
+    return func
+
+
+# The location rules run, in registration order, inside clean_location, once
+# per distinct (country, state, city, qq.com email) combination.
+LOCATION_RULES = []
+
+
+def location_rule(func):
+    LOCATION_RULES.append(func)
+    return func
+
+
+NON_TEACHING_CLEAR_COLUMNS = [
+    "Preschool",
+    "Early elementary K - 2 (5 - 7 years)",
+    "Upper elementary 3 - 5 (8 - 10 years)",
+    "Middle school 6 - 8 (11 - 13 years)",
+    "High school 9 - 12 (14 - 17 years)",
+    "Post-secondary school/community college (18+)",
+    "College or university",
+    "Adult or vocational education",
+]
+
+COMPUTED_GRADE_HEADER = "Computed Grade Band"
+COMPUTED_STEM_HEADER = "Computed STEM/Tech/Non-STEM"
+
+# Internal slot holding a bitmask of the ticked grade and subject checkboxes;
+# it is not an output column.
+CHECKBOX_MASK_COLUMN = "(checkbox mask)"
+
+# STEP 9: Remove unwanted columns.  Rows keep every input column; the writers
+# only emit DESIRED_ORDER, which leaves these out.
+DELETION_SET = {
+    "Created By (User Id)",
+    "Entry Id",
+    "Date Updated",
+    "Transaction Id",
+    "Payment Amount",
+    "Payment Date",
+    "Payment Status",
+    "Post Id",
+    "User Agent",
+    "User IP",
+    "Name (Prefix)",
+    "Name (Middle)",
+    "MEMBER_RATING",
+    "OPTIN_IP",
+    "CONFIRM_TIME",
+    "CONFIRM_IP",
+    "LATITUDE",
+    "LONGITUDE",
+    "GMTOFF",
+    "DSTOFF",
+    "TIMEZONE",
+    "CC",
+    "REGION",
+    "LAST_CHANGED",
+    "LEID",
+    "EUID",
+    "TAGS",
+    "NOTES",  # Keep only "Notes", remove "NOTES"
+}
+
+DESIRED_ORDER = [
+    "Email Address",
+    "Name (First)",
+    "Name (Last)",
+    "Full Name",
+    "I am a...",
+    "Referral Source",
+    "School / Company Name",
+    "Country",
+    "City/Town",
+    "City",
+    "State",
+    "Zip Code",
+    "Number of Students",
+    "I don't teach at the moment",
+    "Computed Grade Band",
+    "Ages Taught",
+    "Computed STEM/Tech/Non-STEM",
+    "Primary Subject",
+    "Notes",
+    "Preschool",
+    "Early elementary K - 2 (5 - 7 years)",
+    "Upper elementary 3 - 5 (8 - 10 years)",
+    "Middle school 6 - 8 (11 - 13 years)",
+    "High school 9 - 12 (14 - 17 years)",
+    "Post-secondary school/community college (18+)",
+    "College or university",
+    "Adult or vocational education",
+    "Computer science",
+    "Robotics",
+    "Chemistry",
+    "Mathematics",
+    "Physics",
+    "Biology",
+    "Science",
+    "Engineering",
+    "Environmental",
+    "Social studies",
+    "Business",
+    "Economics",
+    "Journalism",
+    "Humanities",
+    "Art",
+    "Dance",
+    "Music",
+    "English",
+    "Language (other than English)",
+    "Foreign languages",
+    "Literature",
+    "Performing arts",
+    "Physical education",
+    "Civics education",
+    "Health education",
+    "Vocational education",
+    "Agricultural education",
+    "Career and technical education",
+    "Legal education",
+    "Maritime education",
+    "Military education and training",
+    "Teacher education",
+    "Library Media",
+    "Librarian",
+    "Digital/Information Literacy",
+    "Special education",
+    "Deaf education",
+    "Cultural education",
+    "Day of AI",
+    "MIT RAISE",
+    "Interested in research participation",
+    "Entry Date",
+    "OPTIN_TIME",
+]
+
+
+# Every column a rule reads or writes by name; the row schema gives each one a
+# slot even when the export lacks it, so rules can index rows directly.
+# The grade and subject checkbox columns come from grade_and_subject_columns.json
+# and are added per run.
+RULE_COLUMNS = DESIRED_ORDER + NON_TEACHING_CLEAR_COLUMNS + [CHECKBOX_MASK_COLUMN]
+
+# Low-cardinality input columns whose values the row schema interns, on top
+# of the checkbox columns.
+CATEGORICAL_COLUMNS = [
+    "I am a...",
+    "Country",
+    "State",
+    "Referral Source",
+    "I don't teach at the moment",
+] + NON_TEACHING_CLEAR_COLUMNS
+
+# The rules find these columns by position (see build_cleaning_context).
+POSITIONAL_COLUMNS = 9
+
+
+def _checkbox_columns(reference):
+    # Grade columns come first so that they hold the lowest mask bits.
+    return list(
+        dict.fromkeys(
+            [column for column, _ in reference["grade_bands"]]
+            + [
+                column
+                for _, columns in reference["subject_categories"]
+                for column in columns
+            ]
+        )
+    )
+
+
+def input_columns(fieldnames, sort_column, reference):
+    """Return the columns of ``fieldnames`` the pipeline reads, in input order.
+
+    Cleaning, sorting, writing and counting use no other column, so the
+    rest, such as the DELETION_SET columns, can be dropped while the input
+    is parsed (see ``inputs.py``).
+    """
+    used = set(RULE_COLUMNS + _checkbox_columns(reference))
+    used.update(["Entry Date", sort_column])
+    return [
+        column
+        for position, column in enumerate(fieldnames)
+        if position < POSITIONAL_COLUMNS or column in used
+    ]
+
+
+def build_cleaning_context(fieldnames, reference=None):
+    """Resolve the column indexes the rules use on top of the reference data.
+
+    ``reference`` is the result of ``load_reference_data``; it is loaded from
+    the working directory when not given.  ``ctx["schema"]`` is the
+    ``RowSchema`` rows must be built with.  Raises ValueError for a header
+    too short to hold the columns the rules find by position.
+    """
+    if len(fieldnames) < POSITIONAL_COLUMNS:
+        raise ValueError(
+            f"Expected at least {POSITIONAL_COLUMNS} columns, Email Address to "
+            f"Zip Code in the export's order; got {len(fieldnames)}"
+        )
+    ctx = dict(reference if reference is not None else load_reference_data())
+    grade_bands = ctx["grade_bands"]
+    subject_categories = ctx["subject_categories"]
+    checkbox_columns = _checkbox_columns(ctx)
+    schema = RowSchema(fieldnames, RULE_COLUMNS + checkbox_columns)
+    schema.intern_columns(CATEGORICAL_COLUMNS + checkbox_columns)
+    index = schema.index
+    ctx["schema"] = schema
+
+    ctx["email_index"] = index[fieldnames[0]]  # Email Address
+    ctx["role_index"] = index[fieldnames[3]]  # "I am a..."
+    ctx["school_index"] = index[fieldnames[4]]
+    ctx["country_index"] = index[fieldnames[5]]  # Country
+    ctx["city_index"] = index[fieldnames[6]]  # City/Town
+    ctx["state_index"] = index[fieldnames[7]]  # State
+    ctx["zip_index"] = index[fieldnames[8]]  # Zip Code
+
+    try:
+        start_index = fieldnames.index("Number of Students")
+    except ValueError:
+        raise ValueError("Header 'Number of Students' not found.")
+    # Clear student/parent school-related fields
+    # Find the end column - "Cultural education" is the last subject column before Notes
+    try:
+        end_index = fieldnames.index("Cultural education")
+    except ValueError:
+        # Fallback if Cultural education not found
+        end_index = start_index + 47  # Approximate range
+    ctx["student_clear_indexes"] = sorted(
+        {index[col] for col in fieldnames[start_index : end_index + 1]}
+    )
+
+    if "High school 9 - 12 (14 - 17 years)" not in fieldnames:
+        raise ValueError("Header 'High school 9 - 12 (14 - 17 years)' not found.")
+    if "Cultural education" not in fieldnames:
+        raise ValueError("Header 'Cultural education' not found.")
+
+    ctx["non_teaching_clear_indexes"] = [
+        index[col] for col in NON_TEACHING_CLEAR_COLUMNS
+    ]
+
+    # Each checkbox column gets one bit of the row's checkbox mask.  Grade
+    # bands and subject categories are then table lookups on the mask.
+    bits = {column: 1 << n for n, column in enumerate(checkbox_columns)}
+    ctx["checkbox_bits"] = [(index[column], bit) for column, bit in bits.items()]
+    student_clear = set(ctx["student_clear_indexes"])
+    ctx["student_clear_keep_bits"] = ~sum(
+        bit for column, bit in bits.items() if index[column] in student_clear
+    )
+    ctx["non_teaching_keep_bits"] = ~sum(
+        bits[column] for column in NON_TEACHING_CLEAR_COLUMNS if column in bits
+    )
+    ctx["grade_band_bits"] = (1 << len(grade_bands)) - 1
+    ctx["grade_band_table"] = [
+        ", ".join(label for n, (_, label) in enumerate(grade_bands) if code >> n & 1)
+        for code in range(1 << len(grade_bands))
+    ]
+    ctx["subject_category_bits"] = [
+        sum(bits[column] for column in columns) for _, columns in subject_categories
+    ]
+    ctx["subject_category_table"] = [
+        ", ".join(
+            label for n, (label, _) in enumerate(subject_categories) if code >> n & 1
+        )
+        for code in range(1 << len(subject_categories))
+    ]
+    for key, column in [
+        ("teach_status_index", "I don't teach at the moment"),
+        ("role_named_index", "I am a..."),
+        ("country_named_index", "Country"),
+        ("city_named_index", "City/Town"),
+        ("state_named_index", "State"),
+        ("first_name_index", "Name (First)"),
+        ("last_name_index", "Name (Last)"),
+        ("full_name_index", "Full Name"),
+        ("merged_city_index", "City"),
+        ("primary_subject_index", "Primary Subject"),
+        ("ages_taught_index", "Ages Taught"),
+        ("grade_band_index", COMPUTED_GRADE_HEADER),
+        ("stem_index", COMPUTED_STEM_HEADER),
+        ("checkbox_mask_index", CHECKBOX_MASK_COLUMN),
+    ]:
+        ctx[key] = index[column]
+    # A fuzzy_cities.CityMatcher when --fuzzy-cities is on.
+    ctx["city_matcher"] = None
+    # The rules clean_location runs; --profile-rules swaps in timed ones.
+    ctx["location_rules"] = LOCATION_RULES
+    # Memoizing the location rules needs them all to read the same columns.
+    ctx["location_cache"] = None
+    if [ctx["country_index"], ctx["state_index"], ctx["city_index"]] == [
+        ctx["country_named_index"],
+        ctx["state_named_index"],
+        ctx["city_named_index"],
+    ]:
+        ctx["location_cache"] = LocationCache(resolve_location)
+    return ctx
+
+
+def clean_row(row, ctx):
+    for rule in CLEANING_RULES:
+        rule(row, ctx)
+    return row
+
+
+def clean_rows(rows, ctx):
+    for row in rows:
+        clean_row(row, ctx)
+    return rows
+
+
+def take_learned(ctx):
+    """Return what this process's caches learned since the last call."""
+    matcher = ctx["city_matcher"]
+    cache = ctx["location_cache"]
+    return {
+        "city_matches": matcher.take_matches() if matcher is not None else {},
+        "locations": cache.take_learned() if cache is not None else None,
+    }
+
+
+def add_learned(ctx, learned):
+    """Record what another process's caches learned (see ``parallel.py``)."""
+    matcher = ctx["city_matcher"]
+    if matcher is not None:
+        matcher.add_matches(learned["city_matches"])
+    if learned["locations"] is not None:
+        ctx["location_cache"].add_learned(learned["locations"])
+
+
+@cleaning_rule
+def pack_checkbox_mask(row, ctx):
+    mask = 0
+    for i, bit in ctx["checkbox_bits"]:
+        value = row[i]
+        if value and value.strip():
+            mask |= bit
+    row[ctx["checkbox_mask_index"]] = mask
+
+
+@cleaning_rule
+def clear_student_parent_fields(row, ctx):
+    if row[ctx["role_index"]].strip() in ["Student", "Parent"]:
+        for i in ctx["student_clear_indexes"]:
+            row[i] = ""
+        row[ctx["checkbox_mask_index"]] &= ctx["student_clear_keep_bits"]
+
+
+def is_qq_email(email):
+    return "@qq.com" in email.strip().lower()
+
+
+def resolve_location(ctx, country, state, city, qq):
+    """Run the location rules on a row holding only these values.
+
+    Returns the new (country, state, city, whether Zip is cleared).
+    """
+    row = [""] * len(ctx["schema"].columns)
+    row[ctx["country_index"]] = country
+    row[ctx["state_index"]] = state
+    row[ctx["city_index"]] = city
+    row[ctx["zip_index"]] = None
+    row[ctx["email_index"]] = "@qq.com" if qq else ""
+    for rule in ctx["location_rules"]:
+        rule(row, ctx)
+    return (
+        row[ctx["country_index"]],
+        row[ctx["state_index"]],
+        row[ctx["city_index"]],
+        row[ctx["zip_index"]] == "",
+    )
+
+
+@cleaning_rule
+def clean_location(row, ctx):
+    cache = ctx["location_cache"]
+    if cache is None:
+        for rule in ctx["location_rules"]:
+            rule(row, ctx)
+        return
+    country_index = ctx["country_index"]
+    state_index = ctx["state_index"]
+    city_index = ctx["city_index"]
+    key = (
+        row[country_index],
+        row[state_index],
+        row[city_index],
+        is_qq_email(row[ctx["email_index"]]),
+    )
+    country, state, city, clear_zip = cache.get(key, ctx)
+    row[country_index] = country
+    row[state_index] = state
+    row[city_index] = city
+    if clear_zip:
+        row[ctx["zip_index"]] = ""
+
+
+@location_rule
+def map_country(row, ctx):
+    country_index = ctx["country_index"]
+    found_mapping = ctx["country_mappings"].get(normalize_key(row[country_index]))
+    if found_mapping is not None:
+        row[country_index] = found_mapping
+
+
+@location_rule
+def map_city_to_country(row, ctx):
+    city = row[ctx["city_index"]].strip()
+    if city:
+        country = ctx["city_to_country"].get(normalize_key(city))
+        if country is not None:
+            row[ctx["country_index"]] = country
+
+
+@location_rule
+def normalize_us_state(row, ctx):
+    country_index = ctx["country_index"]
+    state_index = ctx["state_index"]
+    country_val = row[country_index].strip()
+    state_val = fold_case(row[state_index])
+    state_key = normalize_key(state_val)
+    if country_val == "United States" or (
+        country_val == "" and state_key in ctx["valid_states_all"]
+    ):
+        if country_val == "":
+            row[country_index] = "United States"
+        normalized_state = ctx["state_mappings"].get(state_key, state_val)
+        if fold_case(normalized_state) == "other - non-us":
+            normalized_state = ""
+            row[country_index] = ""
+        else:
+            normalized_state = normalized_state.title()
+        row[state_index] = normalized_state
+
+
+@location_rule
+def clear_bad_state(row, ctx):
+    if row[ctx["state_index"]].strip() in ctx["bad_state_entries"]:
+        row[ctx["state_index"]] = ""
+
+
+@location_rule
+def clear_bad_city(row, ctx):
+    if normalize_key(row[ctx["city_index"]]) in ctx["bad_city_entries"]:
+        row[ctx["city_index"]] = ""
+
+
+@location_rule
+def clear_numeric_city(row, ctx):
+    city = row[ctx["city_index"]].strip()
+    if city.isdigit():
+        row[ctx["city_index"]] = ""
+
+
+@location_rule
+def strip_city_accents(row, ctx):
+    city = row[ctx["city_index"]].strip()
+    if city:
+        row[ctx["city_index"]] = remove_accents(city)
+
+
+@location_rule
+def correct_city(row, ctx):
+    corrected = ctx["city_corrections"].get(normalize_key(row[ctx["city_index"]]))
+    if corrected is not None:
+        row[ctx["city_index"]] = corrected
+
+
+@location_rule
+def fuzzy_correct_city(row, ctx):
+    matcher = ctx["city_matcher"]
+    if matcher is None:
+        return
+    corrected = matcher.correct(
+        row[ctx["country_index"]], row[ctx["state_index"]], row[ctx["city_index"]]
+    )
+    if corrected is not None:
+        row[ctx["city_index"]] = corrected
+
+
+@cleaning_rule
+def clear_bad_school(row, ctx):
+    school = row[ctx["school_index"]].strip()
+    if school.isdigit():
+        row[ctx["school_index"]] = ""
+    elif normalize_key(school) in ctx["bad_school_entries"]:
+        row[ctx["school_index"]] = ""
+
+
+@location_rule
+def clear_state_matching_city_without_country(row, ctx):
+    if row[ctx["country_index"]].strip() == "":
+        city = row[ctx["city_index"]].strip()
+        state = row[ctx["state_index"]].strip()
+        if city and state and fold_case(city) == fold_case(state):
+            row[ctx["state_index"]] = ""
+
+
+@location_rule
+def clear_state_matching_city_non_us(row, ctx):
+    country_val = row[ctx["country_index"]].strip()
+    if country_val and country_val != "United States":
+        city = row[ctx["city_index"]].strip()
+        state = row[ctx["state_index"]].strip()
+        if city and state and fold_case(city) == fold_case(state):
+            row[ctx["state_index"]] = ""
+
+
+@location_rule
+def clear_us_state_for_non_us_country(row, ctx):
+    country_val = row[ctx["country_index"]].strip()
+    if (
+        country_val
+        and country_val != "United States"
+        and normalize_key(row[ctx["state_index"]]) in ctx["valid_states_all"]
+    ):
+        row[ctx["state_index"]] = ""
+
+
+@location_rule
+def fix_new_york(row, ctx):
+    if row[ctx["country_index"]].strip() == "United States":
+        city = row[ctx["city_index"]].strip()
+        state = row[ctx["state_index"]].strip()
+        if fold_case(city) == "new york" and fold_case(state) == "new york":
+            row[ctx["state_index"]] = "New York"
+
+
+# Note: Website column no longer exists in the CSV, dayofai.org check removed
+@location_rule
+def clear_qq_state(row, ctx):
+    if is_qq_email(row[ctx["email_index"]]):
+        row[ctx["state_index"]] = ""
+
+
+@location_rule
+def clear_china_state(row, ctx):
+    if row[ctx["country_index"]].strip() == "China":
+        row[ctx["state_index"]] = ""
+
+
+@location_rule
+def move_qq_us_to_china(row, ctx):
+    if (
+        is_qq_email(row[ctx["email_index"]])
+        and row[ctx["country_index"]].strip() == "United States"
+        and row[ctx["state_index"]].strip() == ""
+    ):
+        row[ctx["country_index"]] = "China"
+        row[ctx["city_index"]] = ""
+        row[ctx["zip_index"]] = ""
+
+
+@location_rule
+def clear_other_non_us_state(row, ctx):
+    if fold_case(row[ctx["state_index"]]) == "other - non-us":
+        row[ctx["state_index"]] = ""
+
+
+@cleaning_rule
+def clear_non_teaching_grades(row, ctx):
+    if (
+        row[ctx["role_index"]].strip() == "Teacher / Educator"
+        and row[ctx["teach_status_index"]].strip() == "I don't teach at the moment"
+    ):
+        for i in ctx["non_teaching_clear_indexes"]:
+            row[i] = ""
+        row[ctx["checkbox_mask_index"]] &= ctx["non_teaching_keep_bits"]
+
+
+def compute_grade_band(row, ctx):
+    mask = row[ctx["checkbox_mask_index"]]
+    return ctx["grade_band_table"][mask & ctx["grade_band_bits"]]
+
+
+def compute_stem_tech_nonstem(row, ctx):
+    if row[ctx["role_named_index"]].strip() and row[ctx["teach_status_index"]].strip():
+        return ""
+    mask = row[ctx["checkbox_mask_index"]]
+    code = 0
+    for n, category_bits in enumerate(ctx["subject_category_bits"]):
+        if mask & category_bits:
+            code |= 1 << n
+    return ctx["subject_category_table"][code]
+
+
+@cleaning_rule
+def set_computed_grade_band(row, ctx):
+    row[ctx["grade_band_index"]] = compute_grade_band(row, ctx)
+
+
+@cleaning_rule
+def set_computed_stem(row, ctx):
+    row[ctx["stem_index"]] = compute_stem_tech_nonstem(row, ctx)
+
+
+@location_rule
+def clear_gazetteer_locations(row, ctx):
+    country = row[ctx["country_named_index"]].strip()
+    city = normalize_key(row[ctx["city_named_index"]])
+    state = normalize_key(row[ctx["state_named_index"]])
+    if not country or not city:
+        return
+    if country == "United States":
+        if ctx["gazetteer"].has_us_city(state, city):
+            row[ctx["city_named_index"]] = ""
+    else:
+        if ctx["gazetteer"].has_intl_city(country, city):
+            row[ctx["city_named_index"]] = ""
+            row[ctx["state_named_index"]] = ""
+
+
+# STEP 8: Merge old columns into new data source columns
+@cleaning_rule
+def merge_full_name(row, ctx):
+    # Combine "Name (First)" + "Name (Last)" into "Full Name" if Full Name is empty
+    full_name = row[ctx["full_name_index"]].strip()
+    if not full_name:
+        first = row[ctx["first_name_index"]].strip()
+        last = row[ctx["last_name_index"]].strip()
+        if first or last:
+            row[ctx["full_name_index"]] = f"{first} {last}".strip()
+
+
+@cleaning_rule
+def merge_city(row, ctx):
+    # Merge "City/Town" into "City" if City is empty
+    city = row[ctx["merged_city_index"]].strip()
+    if not city:
+        city_town = row[ctx["city_named_index"]].strip()
+        if city_town:
+            row[ctx["merged_city_index"]] = city_town
+
+
+@cleaning_rule
+def merge_primary_subject(row, ctx):
+    # Merge "Computed STEM/Tech/Non-STEM" into "Primary Subject" if Primary Subject is empty
+    primary_subject = row[ctx["primary_subject_index"]].strip()
+    if not primary_subject:
+        computed = row[ctx["stem_index"]].strip()
+        if computed:
+            row[ctx["primary_subject_index"]] = computed
+
+
+@cleaning_rule
+def merge_ages_taught(row, ctx):
+    # Merge "Computed Grade Band" into "Ages Taught" if Ages Taught is empty
+    ages_taught = row[ctx["ages_taught_index"]].strip()
+    if not ages_taught:
+        grade_band = row[ctx["grade_band_index"]].strip()
+        if grade_band:
+            row[ctx["ages_taught_index"]] = grade_band
@@ -0,0 +1,206 @@
+"""Columnar backend for the cleaning rules (``--backend columnar``).
+
+Rows are cleaned in batches.  The columns the rules use are transposed into
+one list per column, and each rule is applied to whole columns at a time.
+Every rule declares below which columns it reads and which it writes.  Within a
+batch the rule then runs once per distinct combination of the values it
+reads (dictionary encoding), on a scratch row, and its result is copied to
+every row with that combination.  Low-cardinality columns such as Country,
+State or the checkbox columns therefore cost one rule call per distinct value
+instead of one per row, and the output is identical to ``clean_row`` because
+the same rule functions produce it.
+
+A rule can also read a column through a projection that maps every value to
+a representative the rule treats the same way.  clean_location reads the
+Email Address only to tell qq.com addresses apart, so it runs once per
+distinct location and qq.com flag, like the location cache, rather than once
+per email.  The cache is then looked up once per distinct location in each
+batch, so its hit rate counts batches rather than rows.
+
+A rule without a declared footprint still works: it runs row by row.
+"""
+
+from cleaning_rules import CLEANING_RULES, clean_rows, is_qq_email
+
+BATCH_ROWS = 10000
+
+# Rule name -> (ctx keys of the columns it reads, ctx keys of those it writes).
+# A column a rule writes without reading keeps its value unless the rule
+# assigns it.
+RULE_FOOTPRINTS = {
+    "pack_checkbox_mask": (["checkbox_bits"], ["checkbox_mask_index"]),
+    "clear_student_parent_fields": (
+        ["role_index", "checkbox_mask_index"],
+        ["student_clear_indexes", "checkbox_mask_index"],
+    ),
+    # The named indexes are the same columns unless the header is unusual, in
+    # which case the location rules run without the cache and read both.
+    "clean_location": (
+        [
+            "country_index",
+            "state_index",
+            "city_index",
+            "country_named_index",
+            "state_named_index",
+            "city_named_index",
+            "email_index",
+        ],
+        [
+            "country_index",
+            "state_index",
+            "city_index",
+            "country_named_index",
+            "state_named_index",
+            "city_named_index",
+            "zip_index",
+        ],
+    ),
+    "clear_bad_school": (["school_index"], ["school_index"]),
+    "clear_non_teaching_grades": (
+        ["role_index", "teach_status_index", "checkbox_mask_index"],
+        ["non_teaching_clear_indexes", "checkbox_mask_index"],
+    ),
+    "set_computed_grade_band": (["checkbox_mask_index"], ["grade_band_index"]),
+    "set_computed_stem": (
+        ["role_named_index", "teach_status_index", "checkbox_mask_index"],
+        ["stem_index"],
+    ),
+    "merge_full_name": (
+        ["full_name_index", "first_name_index", "last_name_index"],
+        ["full_name_index"],
+    ),
+    "merge_city": (["merged_city_index", "city_named_index"], ["merged_city_index"]),
+    "merge_primary_subject": (
+        ["primary_subject_index", "stem_index"],
+        ["primary_subject_index"],
+    ),
+    "merge_ages_taught": (
+        ["ages_taught_index", "grade_band_index"],
+        ["ages_taught_index"],
+    ),
+}
+
+
+
+def _qq_email(email):
+    return "@qq.com" if is_qq_email(email) else ""
+
+
+# Rule name -> {ctx key of a column it reads: projection of that column}.
+READ_PROJECTIONS = {"clean_location": {"email_index": _qq_email}}
+
+# Scratch-row cells a rule must not depend on.  Reading one fails loudly
+# (it has no ``strip``), so a wrong footprint cannot go unnoticed.
+_UNSET = object()
+
+
+def footprint_indexes(ctx, keys):
+    # ctx entries are single indexes, lists of indexes or (index, label) pairs.
+    indexes = []
+    for key in keys:
+        value = ctx[key]
+        if isinstance(value, int):
+            indexes.append(value)
+        else:
+            indexes.extend(v[0] if isinstance(v, tuple) else v for v in value)
+    return list(dict.fromkeys(indexes))
+
+
+class _ColumnBatch:
+    """The columns of a batch of rows, transposed on first use.
+
+    Rules write to the rows and to any column already transposed, so the two
+    never disagree and columns that are only written are never transposed.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.columns = {}
+
+    def column(self, index):
+        column = self.columns.get(index)
+        if column is None:
+            column = self.columns[index] = [row[index] for row in self.rows]
+        return column
+
+    def assign(self, positions, index, value):
+        rows = self.rows
+        for position in positions:
+            rows[position][index] = value
+        column = self.columns.get(index)
+        if column is not None:
+            for position in positions:
+                column[position] = value
+
+    def reset(self):
+        self.columns = {}
+
+
+def _apply_rule(rule, batch, reads, writes, width, ctx, projections):
+    read_columns = [
+        list(map(projections[i], batch.column(i)))
+        if i in projections
+        else batch.column(i)
+        for i in reads
+    ]
+    single = len(reads) == 1
+    keys = read_columns[0] if single else list(zip(*read_columns))
+    read_position = {index: position for position, index in enumerate(reads)}
+
+    # Run the rule once per distinct key and keep the cells it changes.
+    scratch = [_UNSET] * width
+    changes = {}
+    for key in dict.fromkeys(keys):
+        values = (key,) if single else key
+        for index in writes:
+            scratch[index] = _UNSET
+        for index, value in zip(reads, values):
+            scratch[index] = value
+        rule(scratch, ctx)
+        result = []
+        for index in writes:
+            value = scratch[index]
+            if index in read_position:
+                if value != values[read_position[index]]:
+                    result.append((index, value))
+            elif value is not _UNSET:
+                result.append((index, value))
+        if result:
+            changes[key] = tuple(result)
+    if not changes:
+        return
+
+    # Copy each change to every row with that key.
+    positions_by_key = {}
+    for position, key in enumerate(keys):
+        if key in changes:
+            positions_by_key.setdefault(key, []).append(position)
+    for key, positions in positions_by_key.items():
+        for index, value in changes[key]:
+            batch.assign(positions, index, value)
+
+
+def clean_batch(rows, ctx):
+    """Clean ``rows`` in place, column by column, and return them."""
+    if not rows:
+        return rows
+    width = len(ctx["schema"].columns)
+    batch = _ColumnBatch(rows)
+    for rule in CLEANING_RULES:
+        footprint = RULE_FOOTPRINTS.get(rule.__name__)
+        if footprint is None:
+            batch.reset()
+            for row in rows:
+                rule(row, ctx)
+            continue
+        reads, writes = (footprint_indexes(ctx, keys) for keys in footprint)
+        projections = {
+            ctx[key]: project
+            for key, project in READ_PROJECTIONS.get(rule.__name__, {}).items()
+        }
+        _apply_rule(rule, batch, reads, writes, width, ctx, projections)
+    return rows
+
+
+# Functions cleaning a list of rows in place, by ``--backend`` name.
+CLEANING_BACKENDS = {"rows": clean_rows, "columnar": clean_batch}
@@ -0,0 +1,76 @@
+"""Parquet output for the cleaned data (``--output-format parquet``).
+
+Each output file is written as zstd-compressed Parquet in row groups, so BI
+jobs can read just the columns they need.  Every column is a string except
+the sort column, which is stored as a timestamp.  pyarrow is an optional
+dependency and is only needed when Parquet output is requested.
+"""
+
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for Parquet output
+    pa = None
+    pq = None
+
+ROW_GROUP_ROWS = 65536
+COMPRESSION = "zstd"
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError(
+            "Parquet output needs pyarrow; install it with `pip install pyarrow`"
+        )
+
+
+def parquet_schema(header, timestamp_column=None):
+    return pa.schema(
+        [
+            pa.field(
+                name,
+                pa.timestamp("s") if name == timestamp_column else pa.string(),
+            )
+            for name in header
+        ]
+    )
+
+
+class ParquetFile:
+    """Buffer rows of output values and write them as Parquet row groups."""
+
+    def __init__(self, path, header, timestamp_column=None):
+        require_pyarrow()
+        self.schema = parquet_schema(header, timestamp_column)
+        self.timestamp_position = (
+            header.index(timestamp_column) if timestamp_column in header else None
+        )
+        self.writer = pq.ParquetWriter(path, self.schema, compression=COMPRESSION)
+        self.rows = []
+
+    def write(self, values, line=None):
+        self.rows.append(values)
+        if len(self.rows) >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = [list(column) for column in zip(*self.rows)]
+        if self.timestamp_position is not None:
+            columns[self.timestamp_position] = [
+                datetime.fromisoformat(value)
+                for value in columns[self.timestamp_position]
+            ]
+        arrays = [
+            pa.array(column, type=field.type)
+            for column, field in zip(columns, self.schema)
+        ]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,151 @@
+"""Breakdowns from the count cube a run writes (``count_cube.csv``).
+
+Every run counts its rows by Country, State, I am a..., Computed Grade Band,
+Computed STEM/Tech/Non-STEM, Referral Source and month of the sort date, and
+writes one line per combination that occurs (see ``analysis_outputs.py``).
+Any breakdown over those dimensions is a sum over the cube's lines, so it
+needs neither the cleaned CSV nor another run:
+
+    python count_cube.py outputs/count_cube.csv --by Month Country \\
+        --where "I am a...=Teacher / Educator"
+
+``--where`` can be repeated; values given for the same dimension are
+alternatives.  ``--reports FOLDER`` writes the count reports of a run from
+the cube instead.
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+from analysis_outputs import (
+    CUBE_DIMENSIONS,
+    CUBE_FILENAME,
+    REPORT_SPECS,
+    report_counts,
+    write_reports,
+)
+
+COUNT_REPORT_SPECS = [
+    spec for spec in REPORT_SPECS if spec.get("kind") != "first_seen"
+]
+
+
+def read_cube(path):
+    """Return the cube in ``path`` as ``analysis_outputs`` counters.
+
+    Lines are in first-seen order, so their line number serves as the first
+    key and roll-ups list values with equal counts as the run did.
+    """
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != CUBE_DIMENSIONS + ["Count"]:
+            raise ValueError(f"'{path}' is not a count cube")
+        return {
+            "cube": {
+                tuple(line[:-1]): [int(line[-1]), number]
+                for number, line in enumerate(reader)
+            }
+        }
+
+
+def slice_cube(counters, by, where=None):
+    """Return [(values of ``by``, count)] over the cells matching ``where``.
+
+    ``where`` maps a dimension to the values it may take.  Groups are
+    listed by count, largest first, and by first appearance on ties.
+    """
+    where = where or {}
+    group_indexes = [CUBE_DIMENSIONS.index(dimension) for dimension in by]
+    conditions = [
+        (CUBE_DIMENSIONS.index(dimension), values)
+        for dimension, values in where.items()
+    ]
+    groups = {}
+    for key, (count, _) in counters["cube"].items():
+        if any(key[i] not in values for i, values in conditions):
+            continue
+        group = tuple(key[i] for i in group_indexes)
+        groups[group] = groups.get(group, 0) + count
+    return sorted(groups.items(), key=lambda item: item[1], reverse=True)
+
+
+def parse_where(conditions):
+    where = {}
+    for condition in conditions:
+        dimension, separator, value = condition.partition("=")
+        if not separator or dimension not in CUBE_DIMENSIONS:
+            raise ValueError(
+                f"Expected DIMENSION=VALUE with one of {CUBE_DIMENSIONS}, "
+                f"got '{condition}'"
+            )
+        where.setdefault(dimension, set()).add(value)
+    return where
+
+
+def write_slice(groups, by, out):
+    writer = csv.writer(out)
+    writer.writerow(by + ["Count"])
+    if by:
+        for group, count in groups:
+            writer.writerow(list(group) + [count])
+        total = sum(count for _, count in groups)
+        writer.writerow(["TOTAL"] + [""] * (len(by) - 1) + [total])
+    else:
+        writer.writerow([sum(count for _, count in groups)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Answer breakdowns from a run's count_cube.csv."
+    )
+    parser.add_argument(
+        "cube", nargs="?", default=os.path.join("outputs", CUBE_FILENAME)
+    )
+    parser.add_argument(
+        "--by",
+        nargs="*",
+        default=[],
+        choices=CUBE_DIMENSIONS,
+        metavar="DIMENSION",
+        help=f"dimensions to group by, from: {', '.join(CUBE_DIMENSIONS)}",
+    )
+    parser.add_argument(
+        "--where",
+        action="append",
+        default=[],
+        metavar="DIMENSION=VALUE",
+        help="only count combinations with this value; can be repeated",
+    )
+    parser.add_argument(
+        "--reports",
+        default=None,
+        metavar="FOLDER",
+        help="write the run's count reports from the cube into FOLDER",
+    )
+    args = parser.parse_args()
+    try:
+        counters = read_cube(args.cube)
+        where = parse_where(args.where)
+    except FileNotFoundError:
+        sys.exit(f"Error: Count cube '{args.cube}' not found.")
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+    if args.reports:
+        os.makedirs(args.reports, exist_ok=True)
+        reports = report_counts(counters, COUNT_REPORT_SPECS)
+        write_reports(reports, args.reports, COUNT_REPORT_SPECS)
+        print(f"Count reports written to '{args.reports}'")
+    else:
+        try:
+            write_slice(slice_cube(counters, args.by, where), args.by, sys.stdout)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader (e.g. head) stopped early.  Send what is still
+            # buffered to devnull so that exiting does not fail again.
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            sys.exit(1)
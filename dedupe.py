@@ -0,0 +1,145 @@
+"""Merge rows of the same subscriber (``--dedupe``).
+
+Exports overlap: one person can be in the subscribed, unsubscribed and
+cleaned exports and in the form entries.  Rows are grouped by their
+normalized Email Address; each group becomes one row, the newest by sort date
+(Entry Date, else the sort column; the later row on a tie) with each of its
+blank fields filled from the newest other row that has it.  Entry Date and
+the sort column are never filled: they are what dated the merged row, and
+borrowing an older row's date would move it into that row's split file.  Rows without an
+email or with an unparseable date are passed through unchanged.
+
+By default the groups are kept in a dict of every row, which the in-memory
+sort holds anyway.  For bounded-memory runs, a first pass over the file runs
+every email through a Bloom filter, and the emails that hit it are the only
+ones that can repeat.  The second pass streams every other row straight
+through and keeps only the candidates' rows, so memory grows with the
+number of duplicated addresses (plus a few false positives), not with the
+export.
+
+Merged rows come after the rows passed through, in the order their emails
+first appeared.  Rows with the same sort date can therefore be ordered
+differently with and without the prefilter.
+"""
+
+import hashlib
+
+from timestamps import parse_sort_date
+
+BLOOM_HASHES = 7
+# Bloom filter bits per byte of input: about 12 bits per row for a typical
+# 200-byte row, which keeps false positives under 1%.
+BLOOM_BITS_PER_BYTE = 1 / 16
+MIN_BLOOM_BITS = 1 << 20
+
+
+def normalize_email(email):
+    return email.strip().casefold()
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes=BLOOM_HASHES):
+        self.bits = max(int(bits), 8)
+        self.hashes = hashes
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def add(self, key):
+        """Add ``key`` and return whether it may have been added before."""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        array = self.array
+        seen = True
+        for n in range(self.hashes):
+            position = (h1 + n * h2) % self.bits
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not array[byte] & bit:
+                seen = False
+                array[byte] |= bit
+        return seen
+
+
+def bloom_bits(file_size):
+    return max(int(file_size * BLOOM_BITS_PER_BYTE), MIN_BLOOM_BITS)
+
+
+def duplicate_candidates(records, email_index, bits):
+    """Return the normalized emails that may occur more than once."""
+    bloom = BloomFilter(bits)
+    candidates = set()
+    for record in records:
+        if email_index < len(record):
+            email = normalize_email(record[email_index])
+            if email and bloom.add(email):
+                candidates.add(email)
+    return candidates
+
+
+def merge_group(group, entry_date_index, sort_index):
+    """Merge (sort date, position, record) entries into one record.
+
+    The newest record keeps its own Entry Date and sort column values.
+    """
+    group.sort(key=lambda entry: entry[:2], reverse=True)
+    merged = list(group[0][2])
+    own_dates = (entry_date_index, sort_index)
+    for _, _, record in group[1:]:
+        if len(record) > len(merged):
+            merged.extend([""] * (len(record) - len(merged)))
+        for i, value in enumerate(record):
+            if value.strip() and not merged[i].strip() and i not in own_dates:
+                merged[i] = value
+    return merged
+
+
+def new_dedupe_stats():
+    return {"rows": 0, "duplicates": 0, "subscribers": 0}
+
+
+def dedupe_records(
+    records, email_index, entry_date_index, sort_index, candidates=None, stats=None
+):
+    """Yield ``records`` with one merged record per normalized email.
+
+    ``candidates`` are the only emails that can repeat (see
+    ``duplicate_candidates``); None keeps every row until the end.
+    ``stats`` is updated with ``new_dedupe_stats`` counts.
+    """
+    stats = stats if stats is not None else new_dedupe_stats()
+    width = max(email_index, entry_date_index, sort_index) + 1
+    groups = {}
+    for position, record in enumerate(records):
+        stats["rows"] += 1
+        email = ""
+        if email_index < len(record):
+            email = normalize_email(record[email_index])
+        if not email or (candidates is not None and email not in candidates):
+            yield record
+            continue
+        padded = record if len(record) >= width else record + [""] * width
+        try:
+            sort_date = parse_sort_date(padded, entry_date_index, sort_index)
+        except ValueError:
+            yield record  # skipped and reported later
+            continue
+        group = groups.get(email)
+        if group is None:
+            groups[email] = [(sort_date, position, record)]
+        else:
+            group.append((sort_date, position, record))
+    for email in list(groups):
+        group = groups.pop(email)
+        if len(group) > 1:
+            stats["duplicates"] += len(group) - 1
+            stats["subscribers"] += 1
+            yield merge_group(group, entry_date_index, sort_index)
+        else:
+            yield group[0][2]
+
+
+def print_dedupe_stats(stats):
+    if stats["duplicates"]:
+        print(
+            f"Merged {stats['duplicates']} duplicate rows into "
+            f"{stats['subscribers']} subscribers"
+        )
@@ -0,0 +1,122 @@
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+# Run files open at once in a merge; more runs are first merged in groups.
+MAX_MERGE_RUNS = 64
+
+
+def estimate_row_bytes(row):
+    # Rough in-memory footprint of a parsed row: the list itself plus its values.
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+class ExternalSorter:
+    """Sort rows under a memory budget by spilling sorted runs to temp files.
+
+    Rows are buffered until their estimated size reaches the budget, then the
+    buffer is sorted and pickled to a run file.  Iterating the sorter k-way
+    merges the runs (plus whatever is still buffered) back into one stream.
+    Runs are merged in the order they were written, so rows with equal keys
+    keep their input order, exactly like ``sorted``.  At most
+    ``max_merge_runs`` run files are open at once: with more runs, groups of
+    consecutive runs are first merged into longer runs until one merge
+    suffices.  The sorter can be iterated more than once; each pass re-reads
+    the run files.
+    """
+
+    def __init__(
+        self, key, memory_budget_bytes, tmp_dir=None, max_merge_runs=MAX_MERGE_RUNS
+    ):
+        self.key = key
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_merge_runs = max(max_merge_runs, 2)
+        self.tmp_dir = tempfile.mkdtemp(prefix="mailchimp-sort-", dir=tmp_dir)
+        self.run_paths = []
+        self.runs_written = 0
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.row_count = 0
+
+    def add(self, row):
+        self.buffer.append(row)
+        self.buffer_bytes += estimate_row_bytes(row)
+        self.row_count += 1
+        if self.buffer_bytes >= self.memory_budget_bytes:
+            self._spill()
+
+    def add_sorted_run(self, rows):
+        """Spill rows that are already sorted as a run of their own."""
+        if self.buffer:
+            self._spill()
+        self.buffer = rows
+        self.row_count += len(rows)
+        self._spill()
+
+    def _spill(self):
+        self.buffer.sort(key=self.key)
+        self.run_paths.append(self._write_run(self.buffer))
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    def _write_run(self, rows):
+        run_path = os.path.join(self.tmp_dir, f"run-{self.runs_written:05d}.pickle")
+        self.runs_written += 1
+        with open(run_path, "wb") as run_file:
+            for row in rows:
+                pickle.dump(row, run_file, pickle.HIGHEST_PROTOCOL)
+        return run_path
+
+    def _merge_passes(self):
+        # The buffer is merged without a file, so it does not count.
+        while len(self.run_paths) > self.max_merge_runs:
+            merged = []
+            for start in range(0, len(self.run_paths), self.max_merge_runs):
+                group = self.run_paths[start : start + self.max_merge_runs]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                merged.append(
+                    self._write_run(
+                        heapq.merge(
+                            *[self._read_run(path) for path in group], key=self.key
+                        )
+                    )
+                )
+                for path in group:
+                    os.remove(path)
+            self.run_paths = merged
+
+    @staticmethod
+    def _read_run(run_path):
+        with open(run_path, "rb") as run_file:
+            while True:
+                try:
+                    yield pickle.load(run_file)
+                except EOFError:
+                    return
+
+    def __iter__(self):
+        self.buffer.sort(key=self.key)
+        self._merge_passes()
+        runs = [self._read_run(run_path) for run_path in self.run_paths]
+        # The buffer holds the most recently read rows, so it merges last.
+        runs.append(iter(self.buffer))
+        return heapq.merge(*runs, key=self.key)
+
+    def __len__(self):
+        return self.row_count
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.run_paths = []
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,177 @@
+"""Fuzzy correction of misspelled City/Town values (``--fuzzy-cities``).
+
+``city_corrections.json`` only fixes the misspellings someone has entered.
+The matcher looks a city up among the gazetteer names of its own scope, the
+row's US state or non-US country, and scores the closest ones.  For each
+scope a trigram index over the names is built on first use; the candidates
+sharing the most trigrams with the value are then scored with
+``difflib.SequenceMatcher``.  A candidate at or above the threshold is a
+match, unless another city scores the same.  Values without a scope, short
+values and values the gazetteer already knows are left alone.
+
+Results are cached per distinct (scope, city), so a run costs one search per
+distinct misspelling, not one per row.  In "propose" mode matches are only
+listed in ``fuzzy_city_matches.csv``; in "apply" mode they also replace the
+value.
+"""
+
+import csv
+import heapq
+import os
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+from normalization import normalize_key, remove_accents
+
+FUZZY_MODES = ["off", "propose", "apply"]
+DEFAULT_THRESHOLD = 0.85
+MIN_LENGTH = 4
+CANDIDATES = 10
+MATCHES_FILENAME = "fuzzy_city_matches.csv"
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Names of one scope, searchable by shared trigrams."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for position, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(position)
+
+    def candidates(self, text, limit=CANDIDATES):
+        """Return the ``limit`` names with the highest trigram Dice score."""
+        grams = trigrams(text)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        best = heapq.nlargest(
+            limit,
+            shared.items(),
+            key=lambda item: 2 * item[1] / (len(grams) + self.sizes[item[0]]),
+        )
+        return [self.names[position] for position, _ in best]
+
+
+class CityMatcher:
+    def __init__(self, gazetteer, threshold=DEFAULT_THRESHOLD, apply=False):
+        self.gazetteer = gazetteer
+        self.threshold = threshold
+        self.apply = apply
+        self.indexes = {}
+        # (scope, folded city) -> (display name, score), or None for no match.
+        self.results = {}
+        self.new_matches = {}
+
+    def settings(self):
+        return {"threshold": self.threshold, "apply": self.apply}
+
+    def _index(self, scope):
+        index = self.indexes.get(scope)
+        if index is None:
+            kind, name = scope
+            if kind == "us":
+                names = self.gazetteer.us_state_cities(name)
+            else:
+                names = self.gazetteer.country_cities(name)
+            index = self.indexes[scope] = TrigramIndex(names)
+        return index
+
+    def _display_name(self, candidate):
+        # Cities are written without accents (see strip_city_accents).
+        return remove_accents(self.gazetteer.display_name(candidate) or candidate)
+
+    def _search(self, scope, city):
+        kind, name = scope
+        if kind == "us":
+            known = self.gazetteer.has_us_city(name, city)
+        else:
+            known = self.gazetteer.has_intl_city(name, city)
+        if known:
+            return None
+        scored = []
+        for candidate in self._index(scope).candidates(city):
+            score = SequenceMatcher(None, city, candidate).ratio()
+            if score >= self.threshold:
+                scored.append((score, self._display_name(candidate)))
+        if not scored:
+            return None
+        scored.sort(key=lambda match: match[0], reverse=True)
+        best_score, best_name = scored[0]
+        if any(s == best_score and n != best_name for s, n in scored[1:]):
+            return None  # ambiguous
+        return best_name, best_score
+
+    def match(self, country, state, city):
+        """Return (display name, score) for a misspelled city, or None."""
+        country = country.strip()
+        city = normalize_key(city)
+        if not country or len(city) < MIN_LENGTH:
+            return None
+        if country == "United States":
+            state = normalize_key(state)
+            if not state:
+                return None
+            scope = ("us", state)
+        else:
+            scope = ("intl", country)
+        key = (scope, city)
+        if key in self.results:
+            return self.results[key]
+        result = self.results[key] = self._search(scope, city)
+        if result is not None:
+            self.new_matches[key] = result
+        return result
+
+    def correct(self, country, state, city):
+        """Return the corrected city when matches are applied, else None."""
+        result = self.match(country, state, city)
+        if result is not None and self.apply:
+            return result[0]
+        return None
+
+    def take_matches(self):
+        """Return the matches found since the last call and forget them."""
+        matches = self.new_matches
+        self.new_matches = {}
+        return matches
+
+    def add_matches(self, matches):
+        """Record matches found by another process (see ``parallel.py``)."""
+        for key, result in matches.items():
+            self.results.setdefault(key, result)
+
+    def matches(self):
+        return {key: result for key, result in self.results.items() if result}
+
+
+def write_matches(matcher, output_folder):
+    with open(
+        os.path.join(output_folder, MATCHES_FILENAME),
+        "w",
+        newline="",
+        encoding="utf-8",
+    ) as f:
+        writer = csv.writer(f)
+        writer.writerow(["City/Town", "Scope", "Suggestion", "Score", "Applied"])
+        for ((kind, scope), city), (name, score) in sorted(
+            matcher.matches().items()
+        ):
+            writer.writerow(
+                [
+                    city,
+                    f"US state {scope}" if kind == "us" else scope,
+                    name,
+                    f"{score:.2f}",
+                    "yes" if matcher.apply else "no",
+                ]
+            )
@@ -0,0 +1,283 @@
+"""Compiled, cached index of the all_cities.csv gazetteer.
+
+Normalizing every name, asciiname and alternatename in all_cities.csv is slow,
+so the normalized (state, city) and (country, city) keys are compiled once into
+a SQLite file next to the CSV.  The index records the size, mtime and SHA-256
+of the CSV it was built from and is rebuilt only when the source changes.  The
+database is opened read-only with SQLite's memory-mapped I/O, and up to
+``LOOKUP_CACHE_SIZE`` lookups are cached per key because the same locations
+repeat across many rows.  Each
+normalized name also maps to the city's display name, for corrections that
+need to write one (see ``fuzzy_cities.py``).
+
+Run ``python gazetteer.py [all_cities.csv]`` to build the index ahead of time.
+"""
+
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+
+from normalization import normalize_key
+
+INDEX_SUFFIX = ".index.sqlite"
+INDEX_FORMAT_VERSION = "3"
+MMAP_SIZE = 256 * 1024 * 1024
+# Lookups cached per kind before the cache starts over.
+LOOKUP_CACHE_SIZE = 65536
+
+
+def default_index_path(source_path):
+    return os.path.splitext(source_path)[0] + INDEX_SUFFIX
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_gazetteer_entries(path):
+    # ==== US/International city+state clearing logic (name, asciiname, alternatenames) ====
+    us_city_state_set = set()
+    intl_city_country_set = set()
+    display_names = {}
+    with open(path, "r", encoding="utf-8") as acf:
+        ac_reader = csv.DictReader(acf)
+        for city_row in ac_reader:
+            country = city_row["country"].strip()
+            states = city_row.get("state(s)", "").strip()
+            # Gather all possible normalized city names (name, asciiname, alternatenames)
+            city_names = set()
+            for col in ["name", "asciiname", "alternatenames"]:
+                value = city_row.get(col, "")
+                if value:
+                    if col == "alternatenames":
+                        for alt in value.split(","):
+                            city_names.add(normalize_key(alt))
+                    else:
+                        city_names.add(normalize_key(value))
+            name = city_row.get("name", "").strip()
+            if name:
+                for city_name in city_names:
+                    if city_name:
+                        display_names.setdefault(city_name, name)
+
+            if country == "United States":
+                if states:
+                    for st in states.split("|"):
+                        state_clean = normalize_key(st)
+                        for city_name in city_names:
+                            if city_name:
+                                us_city_state_set.add((state_clean, city_name))
+            else:
+                for city_name in city_names:
+                    if city_name:
+                        intl_city_country_set.add((country, city_name))
+    return us_city_state_set, intl_city_country_set, display_names
+
+
+def _read_meta(index_path):
+    try:
+        conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return {}
+    try:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+
+
+def build_index(source_path, index_path=None, source_hash=None):
+    index_path = index_path or default_index_path(source_path)
+    stat = os.stat(source_path)
+    source_hash = source_hash or file_sha256(source_path)
+    us_city_state_set, intl_city_country_set, display_names = read_gazetteer_entries(
+        source_path
+    )
+
+    # Build next to the final file and swap it in so readers never see a
+    # half-written index.
+    tmp_path = f"{index_path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+            CREATE TABLE us_cities (
+                state TEXT, city TEXT, PRIMARY KEY (state, city)
+            ) WITHOUT ROWID;
+            CREATE TABLE intl_cities (
+                country TEXT, city TEXT, PRIMARY KEY (country, city)
+            ) WITHOUT ROWID;
+            CREATE TABLE city_names (city TEXT PRIMARY KEY, name TEXT) WITHOUT ROWID;
+            """
+        )
+        conn.executemany(
+            "INSERT INTO us_cities VALUES (?, ?)", sorted(us_city_state_set)
+        )
+        conn.executemany(
+            "INSERT INTO intl_cities VALUES (?, ?)", sorted(intl_city_country_set)
+        )
+        conn.executemany(
+            "INSERT INTO city_names VALUES (?, ?)", sorted(display_names.items())
+        )
+        conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [
+                ("format_version", INDEX_FORMAT_VERSION),
+                ("source_sha256", source_hash),
+                ("source_size", str(stat.st_size)),
+                ("source_mtime_ns", str(stat.st_mtime_ns)),
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def ensure_index(source_path, index_path=None):
+    """Return the path of an up-to-date index for ``source_path``."""
+    index_path = index_path or default_index_path(source_path)
+    meta = _read_meta(index_path) if os.path.exists(index_path) else {}
+    if meta.get("format_version") != INDEX_FORMAT_VERSION:
+        return build_index(source_path, index_path)
+
+    stat = os.stat(source_path)
+    if meta.get("source_size") == str(stat.st_size) and meta.get(
+        "source_mtime_ns"
+    ) == str(stat.st_mtime_ns):
+        return index_path
+    # Size or mtime changed (e.g. the file was copied); only the content hash
+    # decides whether a rebuild is needed.
+    source_hash = file_sha256(source_path)
+    if meta.get("source_sha256") != source_hash:
+        return build_index(source_path, index_path, source_hash)
+    conn = sqlite3.connect(index_path)
+    try:
+        conn.executemany(
+            "UPDATE meta SET value = ? WHERE key = ?",
+            [
+                (str(stat.st_size), "source_size"),
+                (str(stat.st_mtime_ns), "source_mtime_ns"),
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return index_path
+
+
+class GazetteerIndex:
+    """Read-only lookups against a compiled index.
+
+    SQLite connections must not cross a fork, so each process opens its own
+    connection on first use; pickling keeps only the index path.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._conn = None
+        self._pid = None
+        self._us_cache = {}
+        self._intl_cache = {}
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(
+                f"file:{self.index_path}?mode=ro", uri=True, check_same_thread=False
+            )
+            self._conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self):
+        return {"index_path": self.index_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["index_path"])
+
+    def has_us_city(self, state, city):
+        key = (state, city)
+        found = self._us_cache.get(key)
+        if found is None:
+            found = (
+                self.conn.execute(
+                    "SELECT 1 FROM us_cities WHERE state = ? AND city = ?", key
+                ).fetchone()
+                is not None
+            )
+            if len(self._us_cache) >= LOOKUP_CACHE_SIZE:
+                self._us_cache.clear()
+            self._us_cache[key] = found
+        return found
+
+    def has_intl_city(self, country, city):
+        key = (country, city)
+        found = self._intl_cache.get(key)
+        if found is None:
+            found = (
+                self.conn.execute(
+                    "SELECT 1 FROM intl_cities WHERE country = ? AND city = ?", key
+                ).fetchone()
+                is not None
+            )
+            if len(self._intl_cache) >= LOOKUP_CACHE_SIZE:
+                self._intl_cache.clear()
+            self._intl_cache[key] = found
+        return found
+
+    def us_state_cities(self, state):
+        """Normalized names of every city in the (normalized) US ``state``."""
+        return [
+            city
+            for (city,) in self.conn.execute(
+                "SELECT city FROM us_cities WHERE state = ?", (state,)
+            )
+        ]
+
+    def country_cities(self, country):
+        """Normalized names of every city in a non-US ``country``."""
+        return [
+            city
+            for (city,) in self.conn.execute(
+                "SELECT city FROM intl_cities WHERE country = ?", (country,)
+            )
+        ]
+
+    def display_name(self, city):
+        found = self.conn.execute(
+            "SELECT name FROM city_names WHERE city = ?", (city,)
+        ).fetchone()
+        return found[0] if found is not None else None
+
+    def clear_caches(self):
+        self._us_cache.clear()
+        self._intl_cache.clear()
+
+    def source_hash(self):
+        return _read_meta(self.index_path).get("source_sha256")
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+
+def load_gazetteer(source_path="all_cities.csv", index_path=None):
+    return GazetteerIndex(ensure_index(source_path, index_path))
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else "all_cities.csv"
+    print(f"Gazetteer index ready at '{ensure_index(source)}'")
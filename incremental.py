@@ -0,0 +1,451 @@
+"""Incremental runs for daily re-exports of the same audience.
+
+A SQLite state store in the output folder remembers every cleaned row under
+(Email Address, content hash of the raw row).  On each run only rows whose
+key is not in the store are parsed and cleaned; rows missing from the new
+export are dropped.  Only the split files whose date range gained or lost
+rows are rewritten, ``0-sorted-and-cleaned.csv`` is rebuilt by concatenating
+the split files, and the analysis counts are kept in the store and adjusted
+by the added and removed rows instead of being recounted.
+
+The rewritten files are written to a staging folder that the caller moves
+into the output folder (see ``run_incremental``); the store is committed
+only after that, so a failed run leaves the old outputs and the old store.
+
+Rows inside a split file are ordered exactly as a full run orders them.  The
+reports list values with equal counts alphabetically, and the count cube its
+combinations alphabetically, since first-seen order cannot be maintained
+under deletions.  The store is reset whenever the
+mapping files, the gazetteer or the cleaning rules change.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+from collections import defaultdict
+from contextlib import contextmanager
+
+from analysis_outputs import (
+    CUBE_COLUMNS,
+    REPORT_SPECS,
+    column_value,
+    report_counts,
+    write_analyses,
+)
+from cleaning_rules import DESIRED_ORDER
+from columnar_cleaning import CLEANING_BACKENDS
+from reference_data import REFERENCE_FILES
+from split_writer import MASTER_FILENAME, open_output
+from timestamps import (
+    DEFAULT_SPLIT_RANGES,
+    date_range_filename,
+    new_skipped,
+    parse_sort_date,
+    print_skipped,
+    record_skipped,
+)
+
+STATE_FILENAME = ".incremental_state.sqlite"
+# Stored rows and the rows the reports see are in DESIRED_ORDER.
+OUTPUT_COLUMNS = {name: i for i, name in enumerate(DESIRED_ORDER)}
+RULE_MODULES = [
+    "cleaning_rules.py",
+    "normalization.py",
+    "timestamps.py",
+    "fuzzy_cities.py",
+    "gazetteer.py",
+    "location_cache.py",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS rows (
+    email TEXT,
+    content_hash TEXT,
+    copies INTEGER,
+    sort_ts TEXT,
+    range_key TEXT,
+    cleaned TEXT,
+    PRIMARY KEY (email, content_hash)
+);
+CREATE INDEX IF NOT EXISTS rows_by_range ON rows (range_key);
+CREATE TABLE IF NOT EXISTS cube_counts (key TEXT PRIMARY KEY, count INTEGER);
+CREATE TABLE IF NOT EXISTS report_first_seen (
+    report TEXT,
+    value TEXT,
+    rows INTEGER,
+    first_ts TEXT,
+    first_key TEXT,
+    info TEXT,
+    PRIMARY KEY (report, value)
+);
+"""
+
+
+def reference_fingerprint(ctx):
+    digest = hashlib.sha256()
+    for filename in REFERENCE_FILES:
+        with open(os.path.join(ctx["base_dir"], filename), "rb") as f:
+            digest.update(f.read())
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    for filename in RULE_MODULES:
+        with open(os.path.join(module_dir, filename), "rb") as f:
+            digest.update(f.read())
+    digest.update((ctx["gazetteer"].source_hash() or "").encode())
+    matcher = ctx["city_matcher"]
+    digest.update(repr(matcher and matcher.settings()).encode())
+    return digest.hexdigest()
+
+
+def row_identity(record, email_index):
+    raw = "\x1f".join(record)
+    content_hash = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    email = record[email_index] if email_index < len(record) else ""
+    return (email.strip(), content_hash)
+
+
+def open_state(output_folder, fingerprint, sort_column, ranges):
+    conn = sqlite3.connect(os.path.join(output_folder, STATE_FILENAME))
+    conn.executescript(SCHEMA)
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    expected = {
+        "fingerprint": fingerprint,
+        "sort_column": sort_column,
+        "split_ranges": json.dumps(ranges),
+        "counts": "cube",
+    }
+    if any(meta.get(key) != value for key, value in expected.items()):
+        # Cleaned rows are only valid for the reference data, rules and split
+        # dates that produced them; start over when any of them changed.  The
+        # list of split files written is kept so that they are replaced.  The
+        # reset is committed with the rest of the run.
+        for statement in [
+            "DELETE FROM rows",
+            "DELETE FROM cube_counts",
+            "DELETE FROM report_first_seen",
+            "DELETE FROM meta WHERE key != 'range_files'",
+        ]:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)", expected.items()
+        )
+    return conn
+
+
+def _first_seen_values(row):
+    # Yield (spec, value) for every first-seen report the row contributes to.
+    filter_results = {}
+    for spec in REPORT_SPECS:
+        if spec.get("kind") != "first_seen":
+            continue
+        row_filter = spec.get("filter")
+        if row_filter is not None:
+            if row_filter not in filter_results:
+                filter_results[row_filter] = row_filter(row, OUTPUT_COLUMNS)
+            if not filter_results[row_filter]:
+                continue
+        yield spec, column_value(row, OUTPUT_COLUMNS, spec["column"])
+
+
+def cube_key(row, sort_ts):
+    values = [column_value(row, OUTPUT_COLUMNS, column) for column in CUBE_COLUMNS]
+    return json.dumps(values + [sort_ts[:7]])
+
+
+def apply_report_delta(conn, row, delta, order_key, count_deltas, stale):
+    """Add ``delta`` copies of ``row`` to the report counts.
+
+    Count cube cells accumulate in ``count_deltas`` and are written by
+    ``flush_count_deltas``; first-seen entries are updated in place.
+    """
+    count_deltas[cube_key(row, order_key[0])] += delta
+    for spec, value in _first_seen_values(row):
+        report = spec["filename"]
+        if not value:
+            continue
+        current = conn.execute(
+            "SELECT rows, first_ts, first_key FROM report_first_seen "
+            "WHERE report = ? AND value = ?",
+            (report, value),
+        ).fetchone()
+        info = json.dumps(
+            [column_value(row, OUTPUT_COLUMNS, c) for c in spec["value_columns"]]
+        )
+        if current is None:
+            if delta > 0:
+                conn.execute(
+                    "INSERT INTO report_first_seen VALUES (?, ?, ?, ?, ?, ?)",
+                    (report, value, delta, order_key[0], order_key[1], info),
+                )
+            continue
+        rows = current[0] + delta
+        current_key = (current[1], current[2])
+        if rows <= 0:
+            conn.execute(
+                "DELETE FROM report_first_seen WHERE report = ? AND value = ?",
+                (report, value),
+            )
+            stale.discard((report, value))
+        elif delta > 0 and order_key < current_key:
+            conn.execute(
+                "UPDATE report_first_seen SET rows = ?, first_ts = ?, "
+                "first_key = ?, info = ? WHERE report = ? AND value = ?",
+                (rows, order_key[0], order_key[1], info, report, value),
+            )
+        else:
+            conn.execute(
+                "UPDATE report_first_seen SET rows = ? WHERE report = ? AND value = ?",
+                (rows, report, value),
+            )
+            if delta < 0 and order_key == current_key:
+                # The row that supplied this value's details is gone.
+                stale.add((report, value))
+
+
+def flush_count_deltas(conn, count_deltas):
+    conn.executemany(
+        "INSERT INTO cube_counts VALUES (?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET count = count + excluded.count",
+        [(key, delta) for key, delta in count_deltas.items() if delta],
+    )
+    conn.execute("DELETE FROM cube_counts WHERE count <= 0")
+
+
+def refresh_first_seen(conn, stale):
+    """Re-pick the earliest remaining row for first-seen values whose row left."""
+    if not stale:
+        return
+    best = {}
+    specs = {spec["filename"]: spec for spec in REPORT_SPECS}
+    for email, content_hash, sort_ts, cleaned in conn.execute(
+        "SELECT email, content_hash, sort_ts, cleaned FROM rows"
+    ):
+        row = json.loads(cleaned)
+        order_key = (sort_ts, f"{email}\x1f{content_hash}")
+        for spec, value in _first_seen_values(row):
+            pair = (spec["filename"], value)
+            if pair in stale and (pair not in best or order_key < best[pair][0]):
+                best[pair] = (order_key, row)
+    for (report, value), (order_key, row) in best.items():
+        info = [
+            column_value(row, OUTPUT_COLUMNS, c)
+            for c in specs[report]["value_columns"]
+        ]
+        conn.execute(
+            "UPDATE report_first_seen SET first_ts = ?, first_key = ?, info = ? "
+            "WHERE report = ? AND value = ?",
+            (order_key[0], order_key[1], json.dumps(info), report, value),
+        )
+
+
+def range_filenames(conn, ranges):
+    range_keys = {key for (key,) in conn.execute("SELECT DISTINCT range_key FROM rows")}
+    fixed = [filename for _, filename in ranges]
+    filenames = {key: key for key in fixed if key in range_keys}
+    months = sorted(key for key in range_keys if key not in fixed)
+    for index, month_key in enumerate(months, start=len(fixed) + 1):
+        filenames[month_key] = f"{index}-{month_key}.csv"
+    return filenames
+
+
+def write_range_file(conn, range_key, path, positions, fieldnames):
+    entries = []
+    for email, content_hash, sort_ts, cleaned in conn.execute(
+        "SELECT email, content_hash, sort_ts, cleaned FROM rows WHERE range_key = ?",
+        (range_key,),
+    ):
+        # Identical rows are stored once but written at every input position,
+        # which reproduces the stable sort of a full run.
+        for position in positions[(email, content_hash)]:
+            entries.append((sort_ts, position, cleaned))
+    entries.sort(key=lambda entry: (entry[0], entry[1]))
+    with open_output(path) as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(fieldnames)
+        for _, _, cleaned in entries:
+            writer.writerow(json.loads(cleaned))
+
+
+def concatenate_ranges(master_path, range_paths, fieldnames):
+    with open_output(master_path) as outfile:
+        csv.writer(outfile).writerow(fieldnames)
+        for path in range_paths:
+            with open(path, "r", newline="", encoding="utf-8") as range_file:
+                range_file.readline()  # header
+                for chunk in iter(lambda: range_file.read(1024 * 1024), ""):
+                    outfile.write(chunk)
+
+
+def report_counters(conn):
+    """Return the stored counts as ``analysis_outputs`` counters."""
+    counters = {"cube": {}}
+    for spec in REPORT_SPECS:
+        if spec.get("kind") == "first_seen":
+            counters[spec["filename"]] = {}
+    for key, count in conn.execute("SELECT key, count FROM cube_counts"):
+        key = tuple(json.loads(key))
+        counters["cube"][key] = [count, key]
+    for report, value, first_ts, first_key, info in conn.execute(
+        "SELECT report, value, first_ts, first_key, info FROM report_first_seen"
+    ):
+        counters[report][value] = [tuple(json.loads(info)), (first_ts, first_key)]
+    return counters
+
+
+def write_incremental_reports(conn, output_folder):
+    counters = report_counters(conn)
+    reports = report_counts(counters)
+    for spec in REPORT_SPECS:
+        if spec.get("kind") != "first_seen":
+            # List values with equal counts alphabetically.
+            for value, entry in reports[spec["filename"]].items():
+                entry[1] = value
+    write_analyses(counters, output_folder, reports=reports)
+
+
+@contextmanager
+def run_incremental(
+    records,
+    ctx,
+    output_folder,
+    staging,
+    sort_column,
+    ranges=DEFAULT_SPLIT_RANGES,
+    backend="rows",
+):
+    """Clean the new rows and write the changed outputs to ``staging``.
+
+    The caller moves ``staging`` into ``output_folder`` inside the ``with``
+    block.  When the block exits without an error, split files that were
+    renamed are removed and the state store is committed; otherwise the
+    store is left as it was.
+    """
+    fieldnames = DESIRED_ORDER
+    schema = ctx["schema"]
+    sort_index = schema.index[sort_column]
+    entry_date_index = schema.index["Entry Date"]
+    project = schema.projector(fieldnames)
+    conn = open_state(
+        output_folder, reference_fingerprint(ctx), sort_column, ranges
+    )
+    try:
+        stored = {
+            (email, content_hash): copies
+            for email, content_hash, copies in conn.execute(
+                "SELECT email, content_hash, copies FROM rows"
+            )
+        }
+        positions = defaultdict(list)
+        new_rows = {}
+        skipped = new_skipped()
+        for position, record in enumerate(records):
+            key = row_identity(record, ctx["email_index"])
+            if key in positions or key in stored:
+                positions[key].append(position)
+                continue
+            row = schema.from_record(record)
+            try:
+                row[sort_index] = parse_sort_date(row, entry_date_index, sort_index)
+            except ValueError as e:
+                record_skipped(skipped, row, ctx["email_index"], e)
+                continue
+            positions[key].append(position)
+            new_rows[key] = row
+        CLEANING_BACKENDS[backend](list(new_rows.values()), ctx)
+        print_skipped(skipped)
+
+        touched = set()
+        stale = set()
+        count_deltas = defaultdict(int)
+        for key, row in new_rows.items():
+            copies = len(positions[key])
+            sort_ts = row[sort_index]
+            range_key = date_range_filename(sort_ts, ranges)
+            values = project(row)
+            conn.execute(
+                "INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?)",
+                (key[0], key[1], copies, sort_ts, range_key, json.dumps(values)),
+            )
+            touched.add(range_key)
+            order_key = (sort_ts, f"{key[0]}\x1f{key[1]}")
+            apply_report_delta(conn, values, copies, order_key, count_deltas, stale)
+
+        changed = 0
+        removed = 0
+        for key, old_copies in stored.items():
+            copies = len(positions.get(key, ()))
+            if copies == old_copies:
+                continue
+            sort_ts, range_key, cleaned = conn.execute(
+                "SELECT sort_ts, range_key, cleaned FROM rows "
+                "WHERE email = ? AND content_hash = ?",
+                key,
+            ).fetchone()
+            if copies:
+                changed += 1
+                conn.execute(
+                    "UPDATE rows SET copies = ? WHERE email = ? AND content_hash = ?",
+                    (copies, key[0], key[1]),
+                )
+            else:
+                removed += 1
+                conn.execute(
+                    "DELETE FROM rows WHERE email = ? AND content_hash = ?", key
+                )
+            touched.add(range_key)
+            report_row = json.loads(cleaned)
+            order_key = (sort_ts, f"{key[0]}\x1f{key[1]}")
+            apply_report_delta(
+                conn, report_row, copies - old_copies, order_key, count_deltas, stale
+            )
+        flush_count_deltas(conn, count_deltas)
+        refresh_first_seen(conn, stale)
+
+        filenames = range_filenames(conn, ranges)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        previous = json.loads(meta.get("range_files", "{}"))
+        replaced = []
+        for range_key, old_name in previous.items():
+            if filenames.get(range_key) != old_name:
+                if old_name not in filenames.values():
+                    replaced.append(os.path.join(output_folder, old_name))
+                touched.add(range_key)
+        for range_key, filename in filenames.items():
+            if not os.path.exists(os.path.join(output_folder, filename)):
+                touched.add(range_key)
+
+        rewritten = 0
+        range_paths = []
+        for range_key, filename in filenames.items():
+            if range_key in touched:
+                path = os.path.join(staging, filename)
+                write_range_file(conn, range_key, path, positions, fieldnames)
+                rewritten += 1
+            else:
+                path = os.path.join(output_folder, filename)
+            range_paths.append(path)
+        if touched or not os.path.exists(
+            os.path.join(output_folder, MASTER_FILENAME)
+        ):
+            concatenate_ranges(
+                os.path.join(staging, MASTER_FILENAME), range_paths, fieldnames
+            )
+
+        write_incremental_reports(conn, staging)
+        conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('range_files', ?)",
+            (json.dumps(filenames),),
+        )
+        yield
+        for path in replaced:
+            if os.path.exists(path):
+                os.remove(path)
+        conn.commit()
+        print(
+            f"Incremental run: {len(new_rows)} new, {changed} changed, "
+            f"{removed} removed rows; rewrote {rewritten} split files"
+        )
+    finally:
+        conn.close()
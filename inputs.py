@@ -0,0 +1,300 @@
+"""Input exports: expanding globs and reading several files as one.
+
+Several exports can be cleaned as one data set (``--combine``).  Their rows
+are read one file after the other in a single stream of records under the
+first file's header, followed by any column a later file adds.  Rows of a
+file with a different header are moved into those columns by name, so the
+subscribed, unsubscribed and cleaned exports of a list can be mixed.
+
+With ``--reader mmap`` each file is memory-mapped and cut into spans of
+about ``DEFAULT_CHUNK_BYTES``, which worker processes parse on their own
+(see ``parallel.py``).  A span ends at a newline after an even number of
+quote characters, so it does not end inside a quoted field such as a
+multi-line Notes or school value.  A stray quote in an unquoted field can
+throw that count off; every span but the last is therefore parsed with a
+sentinel line after it, which only comes back as a record of its own if the
+span ended between records, and a span that did not is parsed again
+together with the next one.  Records are cut down to the selected columns
+as they are parsed, so unused columns such as the ``DELETION_SET`` ones are
+never copied between processes.
+"""
+
+import csv
+import gc
+import glob
+import io
+import mmap
+import os
+from collections import deque
+from functools import partial
+from itertools import count
+from operator import itemgetter
+
+READERS = ["csv", "mmap"]
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+_SENTINEL = "\ue000"
+
+
+def expand_inputs(patterns):
+    """Return the input files for paths and glob patterns, without repeats.
+
+    A pattern without matches is kept as given, so a missing file is
+    reported by name.
+    """
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return list(dict.fromkeys(paths))
+
+
+def output_folders(paths, output_folder):
+    """Return one subfolder of ``output_folder`` per input file, named after it."""
+    folders = []
+    used = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name = stem
+        number = 2
+        while name in used:
+            name = f"{stem}-{number}"
+            number += 1
+        used.add(name)
+        folders.append(os.path.join(output_folder, name))
+    return folders
+
+
+def union_header(headers):
+    fieldnames = list(headers[0])
+    for header in headers[1:]:
+        for column in header:
+            if column not in fieldnames:
+                fieldnames.append(column)
+    return fieldnames
+
+
+def _positions(header, fieldnames):
+    # Like DictReader, a repeated header name refers to its last column.
+    index = {name: i for i, name in enumerate(header)}
+    positions = [index.get(column) for column in fieldnames]
+    if positions == list(range(len(header))):
+        return None
+    return positions
+
+
+def _projector(positions):
+    """Return a function moving a record's values to ``positions``, or None."""
+    if positions is None:
+        return None
+    if len(positions) > 1 and None not in positions:
+        getter = itemgetter(*positions)
+        width = max(positions) + 1
+
+        def project(record):
+            if len(record) >= width:
+                return list(getter(record))
+            return [record[i] if i < len(record) else "" for i in positions]
+
+        return project
+
+    def project(record):
+        return [
+            record[i] if i is not None and i < len(record) else "" for i in positions
+        ]
+
+    return project
+
+
+def _project(records, positions):
+    project = _projector(positions)
+    for record in records:
+        # Like DictReader, skip blank lines.
+        if not record:
+            continue
+        yield record if project is None else project(record)
+
+
+def _records(readers, headers, fieldnames):
+    for reader, header in zip(readers, headers):
+        yield from _project(reader, _positions(header, fieldnames))
+
+
+def parse_span(span):
+    """Return the records of a ``MappedRecords`` span, None if it ends in a field.
+
+    The last span of a file is parsed as is, like the end of the file.
+    """
+    path, start, end, positions = span
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            last = end == len(m)
+            text = m[start:end].decode("utf-8")
+    if not last:
+        text += _SENTINEL + "\n"
+    project = _projector(positions)
+    records = []
+    record = None
+    # The records hold no reference cycles; collecting while thousands of
+    # them are built would only slow the parse down.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        for record in csv.reader(io.StringIO(text, newline="")):
+            if record:
+                records.append(record if project is None else project(record))
+    finally:
+        if collecting:
+            gc.enable()
+    if not last:
+        # The sentinel only reads as a record of its own after a whole record.
+        if record != [_SENTINEL]:
+            return None
+        records.pop()
+    return records
+
+
+def map_spans(spans, apply, ahead):
+    """Yield the results for ``spans`` in order, ``ahead`` of them in flight.
+
+    ``apply(number, span)`` starts the work on the ``number``-th span and
+    returns a function giving its result, None if the span ended inside a
+    quoted field.  That span is then applied again, under its number,
+    together with the next one; the last span of a file always ends well.
+    """
+    spans = iter(spans)
+    pending = deque()
+    numbers = count()
+
+    def fill():
+        while len(pending) < ahead:
+            span = next(spans, None)
+            if span is None:
+                return
+            number = next(numbers)
+            pending.append((number, span, apply(number, span)))
+
+    while True:
+        fill()
+        if not pending:
+            return
+        number, span, result = pending.popleft()
+        result = result()
+        while result is None:
+            fill()
+            _, (_, _, end, _), _ = pending.popleft()
+            path, start, _, positions = span
+            span = (path, start, end, positions)
+            result = apply(number, span)()
+        yield result
+
+
+def _spans(m, start, chunk_bytes):
+    """Yield (start, end) byte offsets of spans of ``m`` from ``start`` on."""
+    size = len(m)
+    while start < size:
+        end = min(start + chunk_bytes, size)
+        quotes = m[start:end].count(b'"')
+        while end < size:
+            newline = m.find(b"\n", end)
+            if newline < 0:
+                end = size
+                break
+            quotes += m[end : newline + 1].count(b'"')
+            end = newline + 1
+            if quotes % 2 == 0:
+                break
+        yield start, end
+        start = end
+
+
+def _open_mapped(path, stack):
+    """Map ``path`` on ``stack`` and return (map, header, offset after it)."""
+    f = stack.enter_context(open(path, "rb"))
+    if os.fstat(f.fileno()).st_size == 0:
+        raise ValueError("No headers found in CSV file.")
+    m = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    end = 0
+    while True:
+        newline = m.find(b"\n", end)
+        end = len(m) if newline < 0 else newline + 1
+        text = m[:end].decode("utf-8")
+        if end == len(m):
+            records = list(csv.reader(io.StringIO(text, newline="")))
+            break
+        records = list(csv.reader(io.StringIO(text + _SENTINEL + "\n", newline="")))
+        if records[-1] == [_SENTINEL]:
+            break
+    if not records or not records[0]:
+        raise ValueError("No headers found in CSV file.")
+    return m, records[0], end
+
+
+class MappedRecords:
+    """The records of memory-mapped input files, in spans.
+
+    Iterating parses the spans one after the other in this process;
+    ``parallel.py`` hands ``spans()`` out to a process pool instead.
+    """
+
+    def __init__(self, files, fieldnames, chunk_bytes=DEFAULT_CHUNK_BYTES):
+        # (path, map, header, offset after the header) per file.
+        self.files = files
+        self.fieldnames = fieldnames
+        self.chunk_bytes = chunk_bytes
+
+    def spans(self):
+        """Yield (path, start, end, positions) for each span of the files."""
+        for path, m, header, start in self.files:
+            positions = _positions(header, self.fieldnames)
+            for start, end in _spans(m, start, self.chunk_bytes):
+                yield path, start, end, positions
+
+    def __iter__(self):
+        for records in map_spans(
+            self.spans(), lambda number, span: partial(parse_span, span), 1
+        ):
+            yield from records
+
+
+def _open_reader(path, stack):
+    reader = csv.reader(
+        stack.enter_context(open(path, "r", newline="", encoding="utf-8"))
+    )
+    header = next(reader, None)
+    if not header:
+        raise ValueError("No headers found in CSV file.")
+    return reader, header
+
+
+def open_inputs(
+    paths,
+    stack,
+    fieldnames=None,
+    reader="csv",
+    select=None,
+    chunk_bytes=DEFAULT_CHUNK_BYTES,
+):
+    """Open ``paths`` on ``stack`` and return (fieldnames, records).
+
+    ``fieldnames`` defaults to the union of the files' headers, cut down to
+    ``select(fieldnames)`` when ``select`` is given.
+
+    With ``reader`` "mmap" the records are a ``MappedRecords``.
+    """
+    if reader == "mmap":
+        files = [(path, *_open_mapped(path, stack)) for path in paths]
+        if fieldnames is None:
+            fieldnames = union_header([header for _, _, header, _ in files])
+            if select is not None:
+                fieldnames = select(fieldnames)
+        return fieldnames, MappedRecords(files, fieldnames, chunk_bytes)
+    readers = []
+    headers = []
+    for path in paths:
+        reader, header = _open_reader(path, stack)
+        readers.append(reader)
+        headers.append(header)
+    if fieldnames is None:
+        fieldnames = union_header(headers)
+        if select is not None:
+            fieldnames = select(fieldnames)
+    return fieldnames, _records(readers, headers, fieldnames)
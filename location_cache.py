@@ -0,0 +1,157 @@
+"""Memoized location cleaning (the ``clean_location`` rule).
+
+The location rules (country and state mappings, bad state and city values,
+city corrections, the city/state and New York fixes, the qq.com rules and
+the gazetteer clearing) only read Country, State, City/Town and whether the
+email is a qq.com address.  Those combinations repeat across an audience, so
+``LocationCache`` resolves each distinct one once and reuses the result.
+
+With ``--location-cache PATH`` the results are also kept in a SQLite file
+between runs, under the fingerprint of the reference data and rules that
+produced them (see ``incremental.reference_fingerprint``).  A file with
+another fingerprint is ignored and replaced.
+"""
+
+import os
+import sqlite3
+from collections import OrderedDict
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE locations (
+    country TEXT,
+    state TEXT,
+    city TEXT,
+    qq INTEGER,
+    new_country TEXT,
+    new_state TEXT,
+    new_city TEXT,
+    clear_zip INTEGER,
+    PRIMARY KEY (country, state, city, qq)
+);
+"""
+
+
+class LocationCache:
+    """Results of ``resolve(ctx, country, state, city, qq)`` by input tuple.
+
+    With ``maxsize`` set, only that many of the most recently used results
+    are kept, and none are kept as new entries to save or send back: a
+    bounded cache is for long-running processes (see ``server.py``).
+    """
+
+    def __init__(self, resolve, maxsize=None):
+        self.resolve = resolve
+        self.maxsize = maxsize
+        self.entries = {} if maxsize is None else OrderedDict()
+        self.loaded = 0
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, ctx):
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            result = self.resolve(ctx, *key)
+            self.entries[key] = result
+            if self.maxsize is None:
+                self.new_entries[key] = result
+            elif len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            if self.maxsize is not None:
+                self.entries.move_to_end(key)
+        return result
+
+    def take_learned(self):
+        """Return the entries and counts since the last call and forget them."""
+        learned = {
+            "entries": self.new_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+        self.new_entries = {}
+        self.hits = self.misses = 0
+        return learned
+
+    def add_learned(self, learned):
+        """Record what another process learned (see ``parallel.py``)."""
+        for key, result in learned["entries"].items():
+            if key not in self.entries:
+                self.entries[key] = self.new_entries[key] = result
+        self.hits += learned["hits"]
+        self.misses += learned["misses"]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "distinct_locations": len(self.entries),
+            "loaded": self.loaded,
+        }
+
+
+def _read_entries(path, fingerprint):
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(path)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get("fingerprint") != fingerprint:
+            return {}
+        return {
+            (country, state, city, bool(qq)): (
+                new_country,
+                new_state,
+                new_city,
+                bool(clear_zip),
+            )
+            for (
+                country,
+                state,
+                city,
+                qq,
+                new_country,
+                new_state,
+                new_city,
+                clear_zip,
+            ) in conn.execute("SELECT * FROM locations")
+        }
+    except sqlite3.DatabaseError:
+        return {}
+    finally:
+        conn.close()
+
+
+def load_location_cache(cache, path, fingerprint):
+    """Add the entries saved in ``path`` under ``fingerprint`` to ``cache``."""
+    entries = _read_entries(path, fingerprint)
+    for key, result in entries.items():
+        cache.entries.setdefault(key, result)
+    cache.loaded += len(entries)
+
+
+def save_location_cache(cache, path, fingerprint):
+    """Write the cache's entries, and any saved meanwhile, to ``path``."""
+    entries = _read_entries(path, fingerprint)
+    entries.update(cache.entries)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        conn.executemany(
+            "INSERT INTO locations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key + result for key, result in entries.items()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
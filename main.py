@@ -1,619 +1,659 @@
-import csv
-from datetime import datetime
+import argparse
+import heapq
 import os
-import json
-from collections import defaultdict
-import unicodedata
-from analysis_outputs import run_all_analyses
-
-
-def remove_accents(input_str):
-    return "".join(
-        c
-        for c in unicodedata.normalize("NFKD", input_str)
-        if not unicodedata.combining(c)
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from analysis_outputs import (
+    merge_counters,
+    new_counters,
+    run_all_analyses,
+    write_analyses,
+)
+from cleaning_rules import (
+    DESIRED_ORDER,
+    add_learned,
+    build_cleaning_context,
+    input_columns,
+)
+from columnar_cleaning import BATCH_ROWS, CLEANING_BACKENDS
+from dedupe import (
+    bloom_bits,
+    dedupe_records,
+    duplicate_candidates,
+    new_dedupe_stats,
+    print_dedupe_stats,
+)
+from external_sort import ExternalSorter
+from fuzzy_cities import DEFAULT_THRESHOLD, FUZZY_MODES, CityMatcher, write_matches
+from incremental import reference_fingerprint, run_incremental
+from inputs import READERS, expand_inputs, open_inputs, output_folders
+from location_cache import load_location_cache, save_location_cache
+from parallel import clean_chunks_in_parallel, pool_context, read_in_parallel
+from profiling import RunProfile, timed_cleaner
+from sketches import DEFAULT_TOP_N, SKETCH_MODES
+from columnar_output import require_pyarrow
+from reference_data import load_reference_data
+from split_writer import OUTPUT_FORMATS, write_split_files
+from timestamps import (
+    DEFAULT_SPLIT_DATES,
+    merge_skipped,
+    new_skipped,
+    parse_sort_date,
+    print_skipped,
+    record_skipped,
+    split_ranges,
+)
+
+
+def write_fuzzy_matches(matcher, output_folder, profile):
+    if matcher is None:
+        return
+    write_matches(matcher, output_folder)
+    profile.info["fuzzy_cities"] = {
+        "distinct_values": len(matcher.results),
+        "matches": len(matcher.matches()),
+    }
+
+
+def finish_location_cache(ctx, path, fingerprint, profile):
+    cache = ctx["location_cache"]
+    if cache is None:
+        return
+    if path:
+        save_location_cache(cache, path, fingerprint)
+    profile.info["location_cache"] = cache.stats()
+
+
+def publish_outputs(staging, output_folder):
+    """Move the files written to ``staging`` into ``output_folder``."""
+    for name in os.listdir(staging):
+        os.replace(os.path.join(staging, name), os.path.join(output_folder, name))
+
+
+def process_csv(
+    input_file,
+    output_folder,
+    sort_column,
+    memory_budget_mb=None,
+    workers=None,
+    incremental=False,
+    split_dates=DEFAULT_SPLIT_DATES,
+    output_format="csv",
+    backend="rows",
+    profile=None,
+    fuzzy_cities="off",
+    fuzzy_threshold=DEFAULT_THRESHOLD,
+    dedupe=False,
+    reference=None,
+    location_cache=None,
+    sketches="off",
+    top_n=DEFAULT_TOP_N,
+    reader="csv",
+    read_workers=None,
+):
+    """Clean, sort and split ``input_file`` into ``output_folder``.
+
+    ``input_file`` can also be a list of files, which are cleaned as one
+    export (see ``inputs.py``).  ``reference`` is the result of
+    ``load_reference_data``, loaded from the working directory when None.
+
+    Rows are kept as lists indexed by the ``RowSchema`` of the input header
+    (see ``row_schema.py``) rather than one dict per row.
+
+    With ``memory_budget_mb`` set, rows are sorted externally: sorted runs are
+    spilled to temp files whenever the buffered rows reach the budget and are
+    merged back as a stream for the writers and the analyses.
+
+    With ``workers`` above 1, chunks of rows are cleaned, sorted and counted in
+    a process pool (see ``parallel.py``) and merged back in input order.
+
+    With ``incremental`` set, only rows not seen by a previous run into the same
+    ``output_folder`` are cleaned (see ``incremental.py``).
+
+    ``split_dates`` are the dates the fixed split files end before; later rows
+    go to monthly files (see ``timestamps.split_ranges``).
+
+    ``output_format`` is "csv", "parquet" or "both" (see ``split_writer.py``).
+
+    ``backend`` picks how rows are cleaned: "rows" runs every rule on one row
+    at a time, "columnar" runs each rule over whole columns of a batch (see
+    ``columnar_cleaning.py``).  Both give the same output.
+
+    ``fuzzy_cities`` is "off", "propose" or "apply": whether misspelled cities
+    are matched against the gazetteer, and whether matches scoring at least
+    ``fuzzy_threshold`` replace the value or are only listed in
+    ``fuzzy_city_matches.csv`` (see ``fuzzy_cities.py``).
+
+    The location rules run once per distinct location (see
+    ``location_cache.py``).  ``location_cache`` is the path of a file that
+    keeps their results between runs; it cannot be combined with fuzzy city
+    matching, whose matches file needs every location looked up.
+
+    ``sketches`` is "off", "approx" or "exact": whether distinct emails and
+    schools per location and the ``top_n`` schools and cities are reported,
+    estimated in bounded memory or counted exactly (see ``sketches.py``).
+
+    ``reader`` is "csv" or "mmap": whether the input is read line by line or
+    memory-mapped and parsed in spans, keeping only the columns
+    ``input_columns`` lists (see ``inputs.py``).  The spans are parsed by
+    the ``workers`` pool, or else by ``read_workers`` processes (one per CPU
+    when None).  Incremental runs keep every column, which their row hashes
+    cover.
+
+    With ``dedupe`` set, rows with the same normalized Email Address are
+    merged into one before cleaning (see ``dedupe.py``); with
+    ``memory_budget_mb`` also set, a Bloom filter pass over the file first
+    finds the emails that can repeat, so only their rows are held.
+
+    Each stage is timed by ``profile`` (a ``profiling.RunProfile``; a default
+    one when None) and the timings are written to ``run_report.json`` in
+    ``output_folder``.
+
+    Returns whether the run succeeded.  A failed run prints the error and
+    leaves no new output files (outputs are written to a ``.partial-``
+    folder first and moved into ``output_folder`` at the end); an
+    incremental run also leaves its state store as it was.
+    """
+    sorter = None
+    staging = None
+    counters = None
+    dedupe_stats = new_dedupe_stats()
+    if profile is None:
+        profile = RunProfile()
+    profile.info.update(
+        input_file=input_file,
+        options={
+            "sort_column": sort_column,
+            "memory_budget_mb": memory_budget_mb,
+            "workers": workers,
+            "incremental": incremental,
+            "split_dates": list(split_dates),
+            "output_format": output_format,
+            "backend": backend,
+            "fuzzy_cities": fuzzy_cities,
+            "fuzzy_threshold": fuzzy_threshold,
+            "dedupe": dedupe,
+            "location_cache": location_cache,
+            "sketches": sketches,
+            "top_n": top_n,
+            "reader": reader,
+            "read_workers": read_workers,
+        },
     )
-
-
-def process_csv(input_file, output_folder, sort_column):
     try:
-        # Load mapping files and lists for cleaning
-        with open("state_mappings.json", "r", encoding="utf-8") as sm_file:
-            state_mappings = json.load(sm_file)
-        with open("country_mappings.json", "r", encoding="utf-8") as cm_file:
-            country_mappings = json.load(cm_file)
-        with open("bad_state_entries.json", "r", encoding="utf-8") as bse_file:
-            bad_state_entries = set(json.load(bse_file))
-        with open("bad_city_entries.json", "r", encoding="utf-8") as bce_file:
-            raw_bad_cities = json.load(bce_file)
-            bad_city_entries = set(entry.strip().lower() for entry in raw_bad_cities)
-        with open("bad_school_entries.json", "r", encoding="utf-8") as bs_file:
-            raw_bad_schools = json.load(bs_file)
-            bad_school_entries = set(entry.strip().lower() for entry in raw_bad_schools)
-        with open("city_to_country.json", "r", encoding="utf-8") as ctc_file:
-            city_to_country = json.load(ctc_file)
-        with open("city_corrections.json", "r", encoding="utf-8") as cc_file:
-            raw = json.load(cc_file)
-            city_corrections = {k.strip().lower(): v for k, v in raw.items()}
-
+        ranges = split_ranges(split_dates)
+        formats = OUTPUT_FORMATS[output_format]
+        clean = timed_cleaner(CLEANING_BACKENDS[backend], profile)
+        if "parquet" in formats:
+            if incremental:
+                raise ValueError("Incremental runs only write CSV output")
+            require_pyarrow()
+        if profile.rule_detail and (incremental or (workers and workers > 1)):
+            raise ValueError("Per-rule profiling only works for serial runs")
+        if location_cache and fuzzy_cities != "off":
+            raise ValueError("The location cache cannot be used with fuzzy cities")
+        sketch_options = None
+        if sketches != "off":
+            if incremental:
+                raise ValueError("Incremental runs do not keep sketch reports")
+            sketch_options = {"mode": sketches, "top_n": top_n}
+        input_files = [input_file] if isinstance(input_file, str) else input_file
+        select = None
+        if reader == "mmap" and not incremental:
+            if reference is None:
+                with profile.stage("load reference data"):
+                    reference = load_reference_data()
+            select = partial(
+                input_columns, sort_column=sort_column, reference=reference
+            )
         # Read input CSV
-        with open(input_file, "r", newline="", encoding="utf-8") as infile:
-            reader = csv.DictReader(infile)
-            fieldnames = reader.fieldnames
-            if not fieldnames:
-                raise ValueError("No headers found in CSV file.")
+        with ExitStack() as inputs:
+            fieldnames, records = open_inputs(
+                input_files, inputs, reader=reader, select=select
+            )
             if sort_column not in fieldnames:
                 raise ValueError(
                     f"Sort column '{sort_column}' not found in CSV headers"
                 )
-            data = []
-            for row in reader:
-                try:
-                    # Use "Entry Date" if available; otherwise, use sort_column.
-                    if "Entry Date" in row and row["Entry Date"].strip():
-                        sort_date = datetime.strptime(
-                            row["Entry Date"].strip(), "%Y-%m-%d"
+            with profile.stage("load reference data"):
+                ctx = build_cleaning_context(fieldnames, reference)
+            matcher = None
+            if fuzzy_cities != "off":
+                matcher = ctx["city_matcher"] = CityMatcher(
+                    ctx["gazetteer"], fuzzy_threshold, apply=fuzzy_cities == "apply"
+                )
+            fingerprint = None
+            if location_cache and ctx["location_cache"] is not None:
+                fingerprint = reference_fingerprint(ctx)
+                load_location_cache(ctx["location_cache"], location_cache, fingerprint)
+            schema = ctx["schema"]
+            sort_index = schema.index[sort_column]
+            entry_date_index = schema.index["Entry Date"]
+            email_index = ctx["email_index"]
+            skipped = new_skipped()
+            pooled = workers and workers > 1 and not (dedupe or incremental)
+            if reader == "mmap" and not pooled:
+                # Otherwise the cleaning workers parse the spans themselves.
+                records = read_in_parallel(records, read_workers)
+            if dedupe:
+                candidates = None
+                if memory_budget_mb:
+                    with profile.stage("find duplicate emails"), ExitStack() as again:
+                        candidates = duplicate_candidates(
+                            read_in_parallel(
+                                open_inputs(
+                                    input_files, again, fieldnames, reader=reader
+                                )[1],
+                                read_workers,
+                            ),
+                            email_index,
+                            bloom_bits(sum(map(os.path.getsize, input_files))),
                         )
-                    else:
-                        sort_date = datetime.strptime(
-                            row[sort_column].strip(), "%Y-%m-%d %H:%M:%S"
+                records = dedupe_records(
+                    records,
+                    email_index,
+                    entry_date_index,
+                    sort_index,
+                    candidates,
+                    dedupe_stats,
+                )
+            if incremental:
+                # The state store is committed as the update exits, after the
+                # staged outputs are published.
+                os.makedirs(output_folder, exist_ok=True)
+                staging = tempfile.mkdtemp(prefix=".partial-", dir=output_folder)
+                with ExitStack() as update:
+                    with profile.stage("incremental update"):
+                        update.enter_context(
+                            run_incremental(
+                                records,
+                                ctx,
+                                output_folder,
+                                staging,
+                                sort_column,
+                                ranges,
+                                backend,
+                            )
                         )
-                    row[sort_column] = sort_date
-                    data.append(row)
-                except ValueError as e:
-                    print(
-                        f"Error converting datetime in row: {row}. Skipping. Error: {e}"
-                    )
-                    continue
-
-            sorted_data = sorted(data, key=lambda row: row[sort_column])
-
-            # === Cleaning Steps (unchanged) ===
-            col_d_header = fieldnames[3]  # "I am a..."
-            try:
-                start_index = fieldnames.index("Number of Students")
-            except ValueError:
-                raise ValueError("Header 'Number of Students' not found.")
-            
-            # Clear student/parent school-related fields
-            # Find the end column - "Cultural education" is the last subject column before Notes
-            try:
-                end_index = fieldnames.index("Cultural education")
-            except ValueError:
-                # Fallback if Cultural education not found
-                end_index = start_index + 47  # Approximate range
-            
-            for row in sorted_data:
-                if row[col_d_header].strip() in ["Student", "Parent"]:
-                    for col in fieldnames[start_index : end_index + 1]:
-                        row[col] = ""
-
-            col_f_header = fieldnames[5]  # Country
-            for row in sorted_data:
-                country = row[col_f_header].strip()
-                found_mapping = None
-                for key, value in country_mappings.items():
-                    if key.lower() == country.lower():
-                        found_mapping = value
-                        break
-                if found_mapping is not None:
-                    row[col_f_header] = found_mapping
-
-            for row in sorted_data:
-                city = row[fieldnames[6]].strip()
-                if city:
-                    city_lower = city.lower()
-                    if city_lower in city_to_country:
-                        row[col_f_header] = city_to_country[city_lower]
-
-            col_h_header = fieldnames[7]  # State
-            valid_states_all = set()
-            for k, v in state_mappings.items():
-                valid_states_all.add(k.lower())
-                valid_states_all.add(v.lower())
-            valid_states_all.add("district of columbia")
-            for row in sorted_data:
-                country_val = row[col_f_header].strip()
-                state_val = row[col_h_header].strip().lower()
-                if country_val == "United States" or (
-                    country_val == "" and state_val in valid_states_all
-                ):
-                    if country_val == "":
-                        row[col_f_header] = "United States"
-                    normalized_state = state_mappings.get(state_val, state_val)
-                    if normalized_state.lower() == "other - non-us":
-                        normalized_state = ""
-                        row[col_f_header] = ""
-                    else:
-                        normalized_state = normalized_state.title()
-                    row[col_h_header] = normalized_state
-            for row in sorted_data:
-                if row[col_h_header].strip() in bad_state_entries:
-                    row[col_h_header] = ""
-
-            col_g_header = fieldnames[6]  # City/Town
-            for row in sorted_data:
-                city_norm = row[col_g_header].strip().lower()
-                if city_norm in bad_city_entries:
-                    row[col_g_header] = ""
-            for row in sorted_data:
-                city = row[col_g_header].strip()
-                if city.isdigit():
-                    row[col_g_header] = ""
-
-            for row in sorted_data:
-                city = row[col_g_header].strip()
-                if city:
-                    row[col_g_header] = remove_accents(city)
-
-            for row in sorted_data:
-                city = row[col_g_header].strip()
-                key = city.lower()
-                if key in city_corrections:
-                    row[col_g_header] = city_corrections[key]
-
-            col_e_header = fieldnames[4]
-            for row in sorted_data:
-                school = row[col_e_header].strip()
-                if school.isdigit():
-                    row[col_e_header] = ""
-                elif school.lower() in bad_school_entries:
-                    row[col_e_header] = ""
-
-            for row in sorted_data:
-                if row[col_f_header].strip() == "":
-                    city = row[col_g_header].strip()
-                    state = row[col_h_header].strip()
-                    if city and state and city.lower() == state.lower():
-                        row[col_h_header] = ""
-            for row in sorted_data:
-                country_val = row[col_f_header].strip()
-                if country_val and country_val != "United States":
-                    city = row[col_g_header].strip()
-                    state = row[col_h_header].strip()
-                    if city and state and city.lower() == state.lower():
-                        row[col_h_header] = ""
-            for row in sorted_data:
-                country_val = row[col_f_header].strip()
-                state_val = row[col_h_header].strip().lower()
-                if (
-                    country_val
-                    and country_val != "United States"
-                    and state_val in valid_states_all
-                ):
-                    row[col_h_header] = ""
-            for row in sorted_data:
-                if row[col_f_header].strip() == "United States":
-                    city = row[col_g_header].strip()
-                    state = row[col_h_header].strip()
-                    if city.lower() == "new york" and state.lower() == "new york":
-                        row[col_h_header] = "New York"
-
-            col_a_header = fieldnames[0]  # Email Address
-            # Note: Website column no longer exists in the CSV, dayofai.org check removed
-            for row in sorted_data:
-                email = row[col_a_header].strip()
-                if "@qq.com" in email.lower():
-                    row[col_h_header] = ""
-            for row in sorted_data:
-                if row[col_f_header].strip() == "China":
-                    row[col_h_header] = ""
-            col_i_header = fieldnames[8]  # Zip Code
-            for row in sorted_data:
-                email = row[col_a_header].strip()
-                if (
-                    "@qq.com" in email.lower()
-                    and row[col_f_header].strip() == "United States"
-                    and row[col_h_header].strip() == ""
-                ):
-                    row[col_f_header] = "China"
-                    row[col_g_header] = ""
-                    row[col_i_header] = ""
-            for row in sorted_data:
-                if row[col_h_header].strip().lower() == "other - non-us":
-                    row[col_h_header] = ""
-
-            cols_to_clear = [
-                "Preschool",
-                "Early elementary K - 2 (5 - 7 years)",
-                "Upper elementary 3 - 5 (8 - 10 years)",
-                "Middle school 6 - 8 (11 - 13 years)",
-                "High school 9 - 12 (14 - 17 years)",
-                "Post-secondary school/community college (18+)",
-                "College or university",
-                "Adult or vocational education",
-            ]
-            role_header = fieldnames[3]  # "I am a..."
-            teach_status_header = "I don't teach at the moment"
-            for row in sorted_data:
-                if (
-                    row[role_header].strip() == "Teacher / Educator"
-                    and row.get(teach_status_header, "").strip()
-                    == "I don't teach at the moment"
-                ):
-                    for col in cols_to_clear:
-                        if col in row:
-                            row[col] = ""
-
-            computed_grade_header = "Computed Grade Band"
-            try:
-                col_p_index = fieldnames.index("High school 9 - 12 (14 - 17 years)")
-            except ValueError:
-                raise ValueError(
-                    "Header 'High school 9 - 12 (14 - 17 years)' not found."
+                    print_dedupe_stats(dedupe_stats)
+                    profile.info["dedupe"] = dedupe_stats
+                    write_fuzzy_matches(matcher, staging, profile)
+                    finish_location_cache(ctx, location_cache, fingerprint, profile)
+                    profile.write(staging)
+                    publish_outputs(staging, output_folder)
+                return True
+
+            # Every cleaning rule only looks at its own row, so rows are cleaned
+            # as they stream in and sorting happens once at the end.
+            if memory_budget_mb:
+                sorter = ExternalSorter(
+                    key=lambda row: row[sort_index],
+                    memory_budget_bytes=int(memory_budget_mb * 1024 * 1024),
                 )
-            if computed_grade_header not in fieldnames:
-                fieldnames.insert(col_p_index + 1, computed_grade_header)
-
-            def compute_grade_band(row):
-                colL = row.get("Preschool", "").strip()
-                colM = row.get("Early elementary K - 2 (5 - 7 years)", "").strip()
-                colN = row.get("Upper elementary 3 - 5 (8 - 10 years)", "").strip()
-                colO = row.get("Middle school 6 - 8 (11 - 13 years)", "").strip()
-                colP = row.get("High school 9 - 12 (14 - 17 years)", "").strip()
-                band = ""
-                if colL:
-                    band += "PK"
-                if colM:
-                    band += ", K-2" if band else "K-2"
-                if colN:
-                    band += ", 3-5" if band else "3-5"
-                if colO:
-                    band += ", 6-8" if band else "6-8"
-                if colP:
-                    band += ", 9-12" if band else "9-12"
-                return band
-
-            for row in sorted_data:
-                row[computed_grade_header] = compute_grade_band(row)
-
-            computed_stem_header = "Computed STEM/Tech/Non-STEM"
-            try:
-                col_bi_index = fieldnames.index("Cultural education")
-            except ValueError:
-                raise ValueError("Header 'Cultural education' not found.")
-            if computed_stem_header not in fieldnames:
-                fieldnames.insert(col_bi_index + 1, computed_stem_header)
-
-            def compute_stem_tech_nonstem(row):
-                if (
-                    row.get("I am a...", "").strip()
-                    and row.get("I don't teach at the moment", "").strip()
-                ):
-                    return ""
-                tech_cols = [
-                    "Computer science",
-                    "Robotics",
-                    "Career and technical education",
-                    "Digital/Information Literacy",
-                ]
-                stem_cols = [
-                    "Chemistry",
-                    "Mathematics",
-                    "Physics",
-                    "Biology",
-                    "Science",
-                    "Engineering",
-                    "Environmental",
-                ]
-                non_stem_cols = [
-                    "Social studies",
-                    "Business",
-                    "Economics",
-                    "Journalism",
-                    "Humanities",
-                    "Art",
-                    "Dance",
-                    "Music",
-                    "English",
-                    "Language (other than English)",
-                    "Foreign languages",
-                    "Literature",
-                    "Performing arts",
-                    "Physical education",
-                    "Civics education",
-                    "Health education",
-                    "Vocational education",
-                    "Agricultural education",
-                    "Legal education",
-                    "Maritime education",
-                    "Military education and training",
-                    "Teacher education",
-                    "Library Media",
-                    "Librarian",
-                    "Special education",
-                    "Deaf education",
-                    "Cultural education",
-                ]
-                selected = []
-                if any(row.get(col, "").strip() for col in tech_cols):
-                    selected.append("Technology")
-                if any(row.get(col, "").strip() for col in stem_cols):
-                    selected.append("STEM")
-                if any(row.get(col, "").strip() for col in non_stem_cols):
-                    selected.append("Non-STEM")
-                return ", ".join(selected)
-
-            for row in sorted_data:
-                row[computed_stem_header] = compute_stem_tech_nonstem(row)
-
-            # ==== US/International city+state clearing logic (name, asciiname, alternatenames) ====
-            us_city_state_set = set()
-            intl_city_country_set = set()
-            with open("all_cities.csv", "r", encoding="utf-8") as acf:
-                ac_reader = csv.DictReader(acf)
-                for city_row in ac_reader:
-                    country = city_row["country"].strip()
-                    states = city_row.get("state(s)", "").strip()
-                    # Gather all possible normalized city names (name, asciiname, alternatenames)
-                    city_names = set()
-                    for col in ["name", "asciiname", "alternatenames"]:
-                        value = city_row.get(col, "")
-                        if value:
-                            if col == "alternatenames":
-                                for alt in value.split(","):
-                                    city_names.add(remove_accents(alt.strip()).lower())
-                            else:
-                                city_names.add(remove_accents(value.strip()).lower())
-
-                    if country == "United States":
-                        if states:
-                            for st in states.split("|"):
-                                state_clean = remove_accents(st.strip()).lower()
-                                for city_name in city_names:
-                                    if city_name:
-                                        us_city_state_set.add(
-                                            (country, state_clean, city_name)
-                                        )
-                    else:
-                        for city_name in city_names:
-                            if city_name:
-                                intl_city_country_set.add((country, city_name))
-
-            # Apply the clearing logic per row
-            for row in sorted_data:
-                country = row.get("Country", "").strip()
-                city = remove_accents(row.get("City/Town", "")).strip().lower()
-                state = remove_accents(row.get("State", "")).strip().lower()
-                if not country or not city:
-                    continue
-                if country == "United States":
-                    if (country, state, city) in us_city_state_set:
-                        row["City/Town"] = ""
-                else:
-                    if (country, city) in intl_city_country_set:
-                        row["City/Town"] = ""
-                        row["State"] = ""
-
-            # STEP 8: Merge old columns into new data source columns
-            # Combine "Name (First)" + "Name (Last)" into "Full Name" if Full Name is empty
-            for row in sorted_data:
-                full_name = row.get("Full Name", "").strip()
-                if not full_name:
-                    first = row.get("Name (First)", "").strip()
-                    last = row.get("Name (Last)", "").strip()
-                    if first or last:
-                        row["Full Name"] = f"{first} {last}".strip()
-            
-            # Merge "City/Town" into "City" if City is empty
-            for row in sorted_data:
-                city = row.get("City", "").strip()
-                if not city:
-                    city_town = row.get("City/Town", "").strip()
-                    if city_town:
-                        row["City"] = city_town
-            
-            # Merge "Computed STEM/Tech/Non-STEM" into "Primary Subject" if Primary Subject is empty
-            for row in sorted_data:
-                primary_subject = row.get("Primary Subject", "").strip()
-                if not primary_subject:
-                    computed = row.get("Computed STEM/Tech/Non-STEM", "").strip()
-                    if computed:
-                        row["Primary Subject"] = computed
-            
-            # Merge "Computed Grade Band" into "Ages Taught" if Ages Taught is empty
-            for row in sorted_data:
-                ages_taught = row.get("Ages Taught", "").strip()
-                if not ages_taught:
-                    grade_band = row.get("Computed Grade Band", "").strip()
-                    if grade_band:
-                        row["Ages Taught"] = grade_band
-            
-            # STEP 9: Remove unwanted columns.
-            deletion_set = {
-                "Created By (User Id)",
-                "Entry Id",
-                "Date Updated",
-                "Transaction Id",
-                "Payment Amount",
-                "Payment Date",
-                "Payment Status",
-                "Post Id",
-                "User Agent",
-                "User IP",
-                "Name (Prefix)",
-                "Name (Middle)",
-                "MEMBER_RATING",
-                "OPTIN_IP",
-                "CONFIRM_TIME",
-                "CONFIRM_IP",
-                "LATITUDE",
-                "LONGITUDE",
-                "GMTOFF",
-                "DSTOFF",
-                "TIMEZONE",
-                "CC",
-                "REGION",
-                "LAST_CHANGED",
-                "LEID",
-                "EUID",
-                "TAGS",
-                "NOTES",  # Keep only "Notes", remove "NOTES"
-            }
-            fieldnames = [header for header in fieldnames if header not in deletion_set]
-            for row in sorted_data:
-                for key in list(row.keys()):
-                    if key in deletion_set:
-                        del row[key]
-
-            # STEP 10: Reorder columns into the desired final order.
-            desired_order = [
-                "Email Address",
-                "Name (First)",
-                "Name (Last)",
-                "Full Name",
-                "I am a...",
-                "Referral Source",
-                "School / Company Name",
-                "Country",
-                "City/Town",
-                "City",
-                "State",
-                "Zip Code",
-                "Number of Students",
-                "I don't teach at the moment",
-                "Computed Grade Band",
-                "Ages Taught",
-                "Computed STEM/Tech/Non-STEM",
-                "Primary Subject",
-                "Notes",
-                "Preschool",
-                "Early elementary K - 2 (5 - 7 years)",
-                "Upper elementary 3 - 5 (8 - 10 years)",
-                "Middle school 6 - 8 (11 - 13 years)",
-                "High school 9 - 12 (14 - 17 years)",
-                "Post-secondary school/community college (18+)",
-                "College or university",
-                "Adult or vocational education",
-                "Computer science",
-                "Robotics",
-                "Chemistry",
-                "Mathematics",
-                "Physics",
-                "Biology",
-                "Science",
-                "Engineering",
-                "Environmental",
-                "Social studies",
-                "Business",
-                "Economics",
-                "Journalism",
-                "Humanities",
-                "Art",
-                "Dance",
-                "Music",
-                "English",
-                "Language (other than English)",
-                "Foreign languages",
-                "Literature",
-                "Performing arts",
-                "Physical education",
-                "Civics education",
-                "Health education",
-                "Vocational education",
-                "Agricultural education",
-                "Career and technical education",
-                "Legal education",
-                "Maritime education",
-                "Military education and training",
-                "Teacher education",
-                "Library Media",
-                "Librarian",
-                "Digital/Information Literacy",
-                "Special education",
-                "Deaf education",
-                "Cultural education",
-                "Day of AI",
-                "MIT RAISE",
-                "Interested in research participation",
-                "Entry Date",
-                "OPTIN_TIME",
-            ]
-            fieldnames = desired_order
-
-            # Write the cleaned data to output CSV files (with date-range splits).
-            date_ranges = defaultdict(list)
-            for row in sorted_data:
-                date = row[sort_column]
-                if date < datetime(2024, 10, 15):
-                    date_ranges["1-pre1015.csv"].append(row)
-                elif datetime(2024, 10, 15) <= date < datetime(2024, 11, 1):
-                    date_ranges["2-1031.csv"].append(row)
-                else:
-                    key = f"{date.year}-{date.month:02d}"
-                    date_ranges[key].append(row)
-            sorted_cleaned_filename = "0-sorted-and-cleaned.csv"
-            with open(
-                os.path.join(output_folder, sorted_cleaned_filename),
-                "w",
-                newline="",
-                encoding="utf-8",
-            ) as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-                writer.writeheader()
-                for row in sorted_data:
-                    row_to_write = row.copy()
-                    row_to_write[sort_column] = row_to_write[sort_column].strftime(
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    writer.writerow(row_to_write)
-            for special_file in ["1-pre1015.csv", "2-1031.csv"]:
-                if date_ranges[special_file]:
-                    with open(
-                        os.path.join(output_folder, special_file),
-                        "w",
-                        newline="",
-                        encoding="utf-8",
-                    ) as outfile:
-                        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-                        writer.writeheader()
-                        for row in date_ranges[special_file]:
-                            row_to_write = row.copy()
-                            row_to_write[sort_column] = row_to_write[
-                                sort_column
-                            ].strftime("%Y-%m-%d %H:%M:%S")
-                            writer.writerow(row_to_write)
-            monthly_dates = sorted(
-                [
-                    k
-                    for k in date_ranges.keys()
-                    if k not in ["1-pre1015.csv", "2-1031.csv"]
-                ]
-            )
-            for index, month_key in enumerate(monthly_dates, start=3):
-                filename = f"{index}-{month_key}.csv"
-                with open(
-                    os.path.join(output_folder, filename),
-                    "w",
-                    newline="",
-                    encoding="utf-8",
-                ) as outfile:
-                    writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    for row in date_ranges[month_key]:
-                        row_to_write = row.copy()
-                        row_to_write[sort_column] = row_to_write[sort_column].strftime(
-                            "%Y-%m-%d %H:%M:%S"
+                add_row = sorter.add
+            else:
+                data = []
+                add_row = data.append
+
+            cleaned_rows = 0
+            if workers and workers > 1:
+                counters = new_counters(sketch_options=sketch_options)
+                runs = []
+                chunks = clean_chunks_in_parallel(
+                    records,
+                    ctx,
+                    sort_column,
+                    workers,
+                    backend=backend,
+                    sketch_options=sketch_options,
+                )
+                with profile.stage("read and clean"):
+                    for chunk_rows, chunk_counters, chunk_skipped, learned in chunks:
+                        cleaned_rows += len(chunk_rows)
+                        merge_skipped(skipped, chunk_skipped)
+                        merge_counters(counters, chunk_counters)
+                        add_learned(ctx, learned)
+                        if sorter is not None:
+                            sorter.add_sorted_run(chunk_rows)
+                        else:
+                            runs.append(chunk_rows)
+                if sorter is None:
+                    with profile.stage("sort", rows=cleaned_rows):
+                        data = list(
+                            heapq.merge(*runs, key=lambda row: row[sort_index])
                         )
-                        writer.writerow(row_to_write)
-
-            # (Optional) You can still save unsure_rows here if you kept that step
-
-        run_all_analyses(sorted_data, output_folder)
-
-    except FileNotFoundError:
-        print(f"Error: Input file '{input_file}' not found.")
+            else:
+                batch = []
+                with profile.stage("read and clean"):
+                    for record in records:
+                        row = schema.from_record(record)
+                        try:
+                            row[sort_index] = parse_sort_date(
+                                row, entry_date_index, sort_index
+                            )
+                        except ValueError as e:
+                            record_skipped(skipped, row, email_index, e)
+                            continue
+                        batch.append(row)
+                        if len(batch) >= BATCH_ROWS:
+                            cleaned_rows += len(batch)
+                            for row in clean(batch, ctx):
+                                add_row(row)
+                            batch = []
+                    cleaned_rows += len(batch)
+                    for row in clean(batch, ctx):
+                        add_row(row)
+            rows_read = cleaned_rows + skipped["count"]
+            profile.stages["read and clean"]["rows"] = rows_read
+            profile.info.update(rows_read=rows_read, rows_skipped=skipped["count"])
+            print_skipped(skipped)
+            if dedupe:
+                print_dedupe_stats(dedupe_stats)
+                profile.info["dedupe"] = dedupe_stats
+
+        # Outputs are written next to the output folder's files and moved in
+        # once all of them are complete, so a failed run leaves none behind.
+        os.makedirs(output_folder, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".partial-", dir=output_folder)
+
+        # STEP 10: Reorder columns into the desired final order and write the
+        # cleaned data to output CSV files (with date-range splits).
+        if sorter is not None:
+            sorted_data = sorter
+        else:
+            with profile.stage("sort", rows=len(data)):
+                sorted_data = sorted(data, key=lambda row: row[sort_index])
+        # With an external sort, the merge runs as the files are written.
+        with profile.stage("write") as record:
+            record["rows"] = write_split_files(
+                sorted_data,
+                staging,
+                DESIRED_ORDER,
+                schema.projector(DESIRED_ORDER),
+                sort_index,
+                ranges,
+                formats,
+                timestamp_column=sort_column,
+            )
+        profile.info["rows_written"] = record["rows"]
+
+        if counters is not None:
+            write_analyses(counters, staging, profile)
+        else:
+            counters = run_all_analyses(
+                sorted_data,
+                staging,
+                schema.index,
+                profile,
+                sort_column,
+                sketch_options,
+            )
+        if sketch_options is not None:
+            profile.info["sketches"] = counters["sketches"].error_bounds()
+        write_fuzzy_matches(matcher, staging, profile)
+        finish_location_cache(ctx, location_cache, fingerprint, profile)
+        profile.write(staging)
+        publish_outputs(staging, output_folder)
+        return True
+
+    except FileNotFoundError as e:
+        print(f"Error: Input file '{e.filename}' not found.")
     except PermissionError:
         print("Error: Permission denied when accessing files.")
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        if sorter is not None:
+            sorter.close()
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+    return False
+
+
+_batch_state = {}
+
+
+def _init_batch_worker(reference):
+    _batch_state["reference"] = reference
+
+
+def _process_in_batch(input_file, output_folder, sort_column, options, profile_options):
+    os.makedirs(output_folder, exist_ok=True)
+    return process_csv(
+        input_file,
+        output_folder,
+        sort_column,
+        profile=RunProfile(**profile_options),
+        reference=_batch_state["reference"],
+        **options,
+    )
+
+
+def _report_batch_file(input_file, folder, succeeded):
+    if succeeded:
+        print(f"Processed '{input_file}' into '{folder}'")
+    else:
+        print(f"Failed to process '{input_file}'")
+    return succeeded
+
+
+def run_batch(
+    input_files, output_folder, sort_column, jobs=None, profile_options=None, **options
+):
+    """Process each of ``input_files`` into its own subfolder of ``output_folder``.
+
+    The reference data and gazetteer are loaded once.  Up to ``jobs`` files
+    (default: one per CPU) are processed at a time by a pool of processes
+    that inherit them.  ``profile_options`` are ``RunProfile`` arguments and
+    the other options are passed on to ``process_csv``.  Returns whether
+    every file succeeded.
+    """
+    profile_options = profile_options or {}
+    reference = load_reference_data()
+    jobs = min(jobs or os.cpu_count() or 1, len(input_files))
+    if jobs > 1 and options.get("read_workers") is None:
+        # The files already keep the CPUs busy.
+        options["read_workers"] = 1
+    tasks = [
+        (input_file, folder, sort_column, options, profile_options)
+        for input_file, folder in zip(
+            input_files, output_folders(input_files, output_folder)
+        )
+    ]
+    if jobs <= 1:
+        _init_batch_worker(reference)
+        results = [
+            _report_batch_file(task[0], task[1], _process_in_batch(*task))
+            for task in tasks
+        ]
+        return all(results)
+    with ProcessPoolExecutor(
+        jobs,
+        mp_context=pool_context(),
+        initializer=_init_batch_worker,
+        initargs=(reference,),
+    ) as pool:
+        futures = [pool.submit(_process_in_batch, *task) for task in tasks]
+        results = [
+            _report_batch_file(task[0], task[1], future.result())
+            for task, future in zip(tasks, futures)
+        ]
+    return all(results)
 
 
 if __name__ == "__main__":
-    input_csv = "raw.csv"
-    output_folder = "outputs"
-    sort_column_name = "OPTIN_TIME"
+    parser = argparse.ArgumentParser(description="Clean and split a Mailchimp export.")
+    parser.add_argument(
+        "input_csv",
+        nargs="*",
+        default=["raw.csv"],
+        help="input files or glob patterns; several are processed as a batch",
+    )
+    parser.add_argument("--output-folder", default="outputs")
+    parser.add_argument("--sort-column", default="OPTIN_TIME")
+    parser.add_argument(
+        "--combine",
+        action="store_true",
+        help="clean several input files as one export into the output folder",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="input files processed at a time in a batch (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        default=None,
+        help="sort externally, keeping at most this many MB of rows in memory",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="clean and count row chunks in a pool of this many processes",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only clean rows that changed since the last run into the output folder",
+    )
+    parser.add_argument(
+        "--split-dates",
+        nargs="*",
+        default=DEFAULT_SPLIT_DATES,
+        metavar="YYYY-MM-DD",
+        help="dates the fixed split files end before; later rows are split by month",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=sorted(OUTPUT_FORMATS),
+        default="csv",
+        help="write the cleaned data as CSV, Parquet (needs pyarrow) or both",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=sorted(CLEANING_BACKENDS),
+        default="rows",
+        help="clean one row at a time or whole columns of a batch at a time",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="merge rows with the same email into the newest one, filling its "
+        "blank fields from the others",
+    )
+    parser.add_argument(
+        "--fuzzy-cities",
+        choices=FUZZY_MODES,
+        default="off",
+        help="list (propose) or also fix (apply) cities that closely match a "
+        "gazetteer city of their state or country",
+    )
+    parser.add_argument(
+        "--fuzzy-threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="lowest similarity (0-1) counted as a fuzzy city match",
+    )
+    parser.add_argument(
+        "--sketches",
+        choices=SKETCH_MODES,
+        default="off",
+        help="report distinct emails and schools per location and the top "
+        "schools and cities, estimated (approx) or counted exactly",
+    )
+    parser.add_argument(
+        "--top-n",
+        type=int,
+        default=DEFAULT_TOP_N,
+        help="schools and cities listed in the top lists of --sketches",
+    )
+    parser.add_argument(
+        "--reader",
+        choices=READERS,
+        default="csv",
+        help="read the input line by line, or memory-map it and parse it in "
+        "parallel, keeping only the columns the cleaning uses",
+    )
+    parser.add_argument(
+        "--read-workers",
+        type=int,
+        default=None,
+        help="processes parsing the input with --reader mmap (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--location-cache",
+        default=None,
+        metavar="PATH",
+        help="keep the cleaned locations in this file to reuse them in later runs",
+    )
+    parser.add_argument(
+        "--profile-rules",
+        action="store_true",
+        help="time every cleaning rule and count the rows it changes (serial runs)",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="record each stage's peak Python memory with tracemalloc (slower)",
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="append",
+        default=[],
+        metavar="STAGE",
+        help="run a stage of run_report.json under cProfile; can be repeated",
+    )
+    args = parser.parse_args()
+    input_files = expand_inputs(args.input_csv)
+    output_folder = args.output_folder
+    sort_column_name = args.sort_column
+    options = dict(
+        memory_budget_mb=args.memory_budget_mb,
+        workers=args.workers,
+        incremental=args.incremental,
+        split_dates=args.split_dates,
+        output_format=args.output_format,
+        backend=args.backend,
+        fuzzy_cities=args.fuzzy_cities,
+        fuzzy_threshold=args.fuzzy_threshold,
+        dedupe=args.dedupe,
+        location_cache=args.location_cache,
+        sketches=args.sketches,
+        top_n=args.top_n,
+        reader=args.reader,
+        read_workers=args.read_workers,
+    )
+    profile_options = dict(
+        rule_detail=args.profile_rules,
+        trace_memory=args.trace_memory,
+        cprofile_stages=args.cprofile,
+    )
 
     os.makedirs(output_folder, exist_ok=True)
-    process_csv(input_csv, output_folder, sort_column_name)
+    if len(input_files) > 1 and not args.combine:
+        succeeded = run_batch(
+            input_files,
+            output_folder,
+            sort_column_name,
+            jobs=args.jobs,
+            profile_options=profile_options,
+            **options,
+        )
+    else:
+        succeeded = process_csv(
+            input_files if args.combine else input_files[0],
+            output_folder,
+            sort_column_name,
+            profile=RunProfile(**profile_options),
+            **options,
+        )
+    if not succeeded:
+        sys.exit(1)
     print(f"Data processed and saved to '{output_folder}'")
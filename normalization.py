@@ -0,0 +1,73 @@
+"""Text normalization shared by the cleaning rules and the gazetteer.
+
+City and state values repeat heavily across an export, so every normalizer is
+memoized in a bounded LRU cache.  Pure-ASCII input skips ``unicodedata``
+entirely since NFKD leaves it unchanged.  ``cache_stats`` reports hits and
+misses per normalizer.
+"""
+
+import unicodedata
+from functools import lru_cache
+
+NORMALIZATION_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def remove_accents(input_str):
+    if input_str.isascii():
+        return input_str
+    return "".join(
+        c
+        for c in unicodedata.normalize("NFKD", input_str)
+        if not unicodedata.combining(c)
+    )
+
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def fold_case(value):
+    """``value.strip().lower()``, cached."""
+    return value.strip().lower()
+
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def normalize_key(value):
+    """Shared lookup key for every mapping table: accent- and case-folded."""
+    return remove_accents(value.strip()).casefold()
+
+
+NORMALIZERS = {
+    "remove_accents": remove_accents,
+    "fold_case": fold_case,
+    "normalize_key": normalize_key,
+}
+
+
+def cache_stats():
+    stats = {}
+    for name, func in NORMALIZERS.items():
+        info = func.cache_info()
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+        }
+    return stats
+
+
+def clear_caches():
+    for func in NORMALIZERS.values():
+        func.cache_clear()
+
+
+def folded_mapping(mapping):
+    # The first entry wins when two keys fold to the same value, matching the
+    # order the old linear scans checked them in.
+    folded = {}
+    for key, value in mapping.items():
+        folded.setdefault(normalize_key(key), value)
+    return folded
+
+
+def folded_set(entries):
+    return {normalize_key(entry) for entry in entries}
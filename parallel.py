@@ -0,0 +1,171 @@
+"""Chunk-parallel cleaning for ``process_csv --workers N``.
+
+The parent reads the CSV and hands out chunks of raw records.  Each worker
+parses the sort dates, runs the cleaning rules with the chosen backend, sorts
+its chunk and counts the analysis reports for it.  Chunks come back in input order, so a stable
+merge of the sorted chunks matches a serial ``sorted`` call, and each
+counter entry is keyed by (date, chunk, position) so merged counts keep the
+serial first-seen order.
+
+With ``--reader mmap`` the workers parse their chunks themselves: the
+parent only hands out byte spans of the input (see ``inputs.py``), so
+neither the parsing nor the raw records pass through it.
+For runs that clean in the parent, ``read_in_parallel`` parses the spans in
+a pool.
+
+The cleaning context is handed to the pool initializer, which is inherited
+by forked workers without pickling.  Where fork is unavailable it is pickled
+once per worker; the gazetteer index reopens its memory-mapped SQLite file
+in each process.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from itertools import islice
+
+from analysis_outputs import new_counters, row_counter
+from cleaning_rules import take_learned
+from columnar_cleaning import CLEANING_BACKENDS
+from inputs import MappedRecords, map_spans, parse_span
+from timestamps import new_skipped, parse_sort_date, record_skipped
+
+DEFAULT_CHUNK_SIZE = 5000
+
+_worker_state = {}
+
+
+def _init_worker(ctx, sort_column, backend, sketch_options):
+    _worker_state["ctx"] = ctx
+    _worker_state["sort_column"] = sort_column
+    _worker_state["backend"] = backend
+    _worker_state["sketch_options"] = sketch_options
+
+
+def clean_chunk(
+    chunk_no, records, ctx, sort_column, backend="rows", sketch_options=None
+):
+    """Clean one chunk of ``csv.reader`` records.
+
+    Returns (sorted rows, partial counters, skipped-row counts, what the
+    worker's caches learned since its previous chunk, see ``take_learned``).
+    """
+    schema = ctx["schema"]
+    entry_date_index = schema.index["Entry Date"]
+    sort_index = schema.index[sort_column]
+    email_index = ctx["email_index"]
+    skipped = new_skipped()
+    parsed = []
+    for record in records:
+        row = schema.from_record(record)
+        try:
+            row[sort_index] = parse_sort_date(row, entry_date_index, sort_index)
+        except ValueError as e:
+            record_skipped(skipped, row, email_index, e)
+            continue
+        parsed.append(row)
+    cleaned = CLEANING_BACKENDS[backend](parsed, ctx)
+    cleaned.sort(key=lambda row: row[sort_index])
+
+    counters = new_counters(sketch_options=sketch_options)
+    count = row_counter(schema.index, date_column=sort_column)
+    for position, row in enumerate(cleaned):
+        count(counters, row, (row[sort_index], chunk_no, position))
+    return cleaned, counters, skipped, take_learned(ctx)
+
+
+def _clean_chunk_in_worker(chunk_no, rows):
+    return clean_chunk(
+        chunk_no,
+        rows,
+        _worker_state["ctx"],
+        _worker_state["sort_column"],
+        _worker_state["backend"],
+        _worker_state["sketch_options"],
+    )
+
+
+def _clean_span_in_worker(chunk_no, span):
+    records = parse_span(span)
+    if records is None:
+        return None
+    return _clean_chunk_in_worker(chunk_no, records)
+
+
+def pool_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def clean_chunks_in_parallel(
+    records,
+    ctx,
+    sort_column,
+    workers,
+    chunk_size=None,
+    backend="rows",
+    sketch_options=None,
+):
+    """Yield ``clean_chunk`` results for ``records`` in input order.
+
+    At most two chunks per worker are in flight, so memory stays bounded by
+    what the caller keeps of the results.  The chunks of ``MappedRecords``
+    are its spans, which the workers parse.
+    """
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    with pool_context().Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(ctx, sort_column, backend, sketch_options),
+    ) as pool:
+        if isinstance(records, MappedRecords):
+            yield from map_spans(
+                records.spans(),
+                lambda chunk_no, span: pool.apply_async(
+                    _clean_span_in_worker, (chunk_no, span)
+                ).get,
+                workers * 2,
+            )
+            # A span parsed again with the next one leaves that one's result
+            # unread; let it finish before the pool is terminated.
+            pool.close()
+            pool.join()
+            return
+        records = iter(records)
+        pending = deque()
+        chunk_no = 0
+        while True:
+            while len(pending) < workers * 2:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                pending.append(
+                    pool.apply_async(_clean_chunk_in_worker, (chunk_no, chunk))
+                )
+                chunk_no += 1
+            if not pending:
+                return
+            yield pending.popleft().get()
+
+
+def read_in_parallel(records, workers=None):
+    """Yield ``records`` with their spans parsed by ``workers`` processes.
+
+    ``workers`` defaults to one per CPU; other records than ``MappedRecords``
+    and a single worker leave the parsing to the caller's process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if not isinstance(records, MappedRecords) or workers <= 1:
+        yield from records
+        return
+    with pool_context().Pool(workers) as pool:
+        for span_records in map_spans(
+            records.spans(),
+            lambda number, span: pool.apply_async(parse_span, (span,)).get,
+            workers * 2,
+        ):
+            yield from span_records
+        # As above, let any unread span finish before the pool is terminated.
+        pool.close()
+        pool.join()
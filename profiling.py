@@ -0,0 +1,216 @@
+"""Per-stage timing of a run, written to ``run_report.json``.
+
+Every named stage of ``process_csv`` and every report records its wall time,
+the number of calls and rows, and the process's peak RSS when it finished.
+Stages can nest ("clean" runs inside "read and clean") and a stage entered
+again, such as "clean" for each batch, adds to the same entry.  Optional
+extras, all off by default because they slow the run down:
+
+- ``rule_detail`` cleans each batch rule by rule and records every cleaning
+  rule as its own stage, with the number of rows it changed.  The location
+  rules are recorded inside "rule clean_location" each time they run, which
+  with the location cache is once per distinct location, so their rows count
+  locations rather than rows;
+- ``trace_memory`` records the peak Python allocation of each stage with
+  ``tracemalloc``;
+- ``cprofile_stages`` runs the named stages under ``cProfile`` and saves the
+  stats next to the report as ``profile-<stage>.prof``.
+"""
+
+import cProfile
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from operator import itemgetter
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from cleaning_rules import CLEANING_RULES, LOCATION_RULES
+from columnar_cleaning import RULE_FOOTPRINTS, footprint_indexes
+from normalization import cache_stats
+
+RUN_REPORT_FILENAME = "run_report.json"
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _new_stage():
+    return {
+        "calls": 0,
+        "wall_seconds": 0.0,
+        "rows": 0,
+        "rows_modified": None,
+        "peak_rss_mb": None,
+        "peak_traced_mb": None,
+    }
+
+
+class NullProfile:
+    """Stand-in for ``RunProfile`` that records nothing."""
+
+    rule_detail = False
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        yield _new_stage()
+
+
+NO_PROFILE = NullProfile()
+
+
+class RunProfile:
+    def __init__(self, rule_detail=False, trace_memory=False, cprofile_stages=()):
+        self.rule_detail = rule_detail
+        self.trace_memory = trace_memory
+        self.cprofile_stages = set(cprofile_stages)
+        self.stages = {}
+        self.info = {}
+        self.profilers = {}
+        self._open = []
+        self._profiling = False
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        """Time the ``with`` block as stage ``name`` and yield its entry.
+
+        Callers that only know the row count afterwards add it to the yielded
+        entry's "rows".
+        """
+        record = self.stages.get(name)
+        if record is None:
+            record = self.stages[name] = _new_stage()
+        record["calls"] += 1
+        record["rows"] += rows
+
+        if self.trace_memory:
+            # The enclosing stages keep the peak so far before it is reset.
+            self._note_traced_peak()
+            tracemalloc.reset_peak()
+        profiler = None
+        if name in self.cprofile_stages and not self._profiling:
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+            self._profiling = True
+            profiler.enable()
+        self._open.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] += time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            if self.trace_memory:
+                self._note_traced_peak()
+            self._open.pop()
+            record["peak_rss_mb"] = peak_rss_mb()
+
+    def _note_traced_peak(self):
+        peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        for record in self._open:
+            if record["peak_traced_mb"] is None or peak > record["peak_traced_mb"]:
+                record["peak_traced_mb"] = peak
+
+    def report(self):
+        return {
+            "started_at": self.started_at.isoformat(sep=" ", timespec="seconds"),
+            "total_seconds": time.perf_counter() - self.start,
+            "peak_rss_mb": peak_rss_mb(),
+            **self.info,
+            "stages": [
+                {"name": name, **record} for name, record in self.stages.items()
+            ],
+            # Only this process's caches: workers of a --workers run keep
+            # their own.
+            "normalization_caches": cache_stats(),
+        }
+
+    def write(self, output_folder):
+        """Write ``run_report.json`` and any cProfile stats to ``output_folder``."""
+        for name, profiler in self.profilers.items():
+            slug = re.sub(r"[^A-Za-z0-9]+", "-", name).strip("-")
+            profiler.dump_stats(os.path.join(output_folder, f"profile-{slug}.prof"))
+        with open(
+            os.path.join(output_folder, RUN_REPORT_FILENAME), "w", encoding="utf-8"
+        ) as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+
+def timed_location_rules(ctx, profile):
+    """Wrap each of LOCATION_RULES to record it as "location rule <name>"."""
+    cells = itemgetter(
+        ctx["country_index"], ctx["state_index"], ctx["city_index"], ctx["zip_index"]
+    )
+
+    def timed(rule):
+        name = f"location rule {rule.__name__}"
+
+        def timed_rule(row, ctx):
+            before = cells(row)
+            with profile.stage(name, rows=1) as record:
+                rule(row, ctx)
+            modified = cells(row) != before
+            record["rows_modified"] = (record["rows_modified"] or 0) + modified
+
+        return timed_rule
+
+    return [timed(rule) for rule in LOCATION_RULES]
+
+
+def clean_rows_by_rule(rows, ctx, profile):
+    """Clean ``rows`` in place one rule at a time, recording each rule.
+
+    Every rule only looks at its own row, so applying one rule to the whole
+    batch before the next gives the same result as ``clean_rows``.  A row
+    counts as modified by a rule when a cell the rule writes changed.
+    """
+    width = len(ctx["schema"].columns)
+    location_rules = ctx["location_rules"]
+    ctx["location_rules"] = timed_location_rules(ctx, profile)
+    try:
+        for rule in CLEANING_RULES:
+            footprint = RULE_FOOTPRINTS.get(rule.__name__)
+            writes = (
+                footprint_indexes(ctx, footprint[1]) if footprint else range(width)
+            )
+            cells = itemgetter(*writes)
+            before = [cells(row) for row in rows]
+            with profile.stage(f"rule {rule.__name__}", rows=len(rows)) as record:
+                for row in rows:
+                    rule(row, ctx)
+            modified = sum(1 for row, old in zip(rows, before) if cells(row) != old)
+            record["rows_modified"] = (record["rows_modified"] or 0) + modified
+    finally:
+        ctx["location_rules"] = location_rules
+    return rows
+
+
+def timed_cleaner(clean, profile):
+    """Wrap a ``CLEANING_BACKENDS`` function to time each batch as "clean"."""
+
+    def timed_clean(rows, ctx):
+        with profile.stage("clean", rows=len(rows)):
+            if profile.rule_detail:
+                return clean_rows_by_rule(rows, ctx, profile)
+            return clean(rows, ctx)
+
+    return timed_clean
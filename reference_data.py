@@ -0,0 +1,72 @@
+"""Reference data shared by every cleaning run.
+
+All mapping files and bad-entry lists are loaded once and keyed by
+``normalize_key`` so that each per-row lookup is a single dict or set probe,
+however large the files grow.  The bad state entries are the exception: they
+include lowercase codes such as "on" and "bc" that must not match the real
+province codes, so they are matched exactly after stripping.
+"""
+
+import json
+import os
+
+from gazetteer import load_gazetteer
+from normalization import folded_mapping, folded_set
+
+REFERENCE_FILES = [
+    "state_mappings.json",
+    "country_mappings.json",
+    "bad_state_entries.json",
+    "bad_city_entries.json",
+    "bad_school_entries.json",
+    "city_to_country.json",
+    "city_corrections.json",
+    "grade_and_subject_columns.json",
+]
+GAZETTEER_FILE = "all_cities.csv"
+
+
+def _load_json(base_dir, filename):
+    with open(os.path.join(base_dir, filename), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_reference_data(base_dir="."):
+    state_mappings = folded_mapping(_load_json(base_dir, "state_mappings.json"))
+
+    valid_states_all = set(state_mappings)
+    valid_states_all.update(folded_set(state_mappings.values()))
+    valid_states_all.add("district of columbia")
+
+    checkbox_columns = _load_json(base_dir, "grade_and_subject_columns.json")
+
+    return {
+        # The folder the files were read from, for hashing them again.
+        "base_dir": base_dir,
+        "state_mappings": state_mappings,
+        "valid_states_all": valid_states_all,
+        "country_mappings": folded_mapping(
+            _load_json(base_dir, "country_mappings.json")
+        ),
+        "city_to_country": folded_mapping(
+            _load_json(base_dir, "city_to_country.json")
+        ),
+        "city_corrections": folded_mapping(
+            _load_json(base_dir, "city_corrections.json")
+        ),
+        "bad_state_entries": {
+            entry.strip() for entry in _load_json(base_dir, "bad_state_entries.json")
+        },
+        "bad_city_entries": folded_set(_load_json(base_dir, "bad_city_entries.json")),
+        "bad_school_entries": folded_set(
+            _load_json(base_dir, "bad_school_entries.json")
+        ),
+        "grade_bands": [
+            (band["column"], band["label"]) for band in checkbox_columns["grade_bands"]
+        ],
+        "subject_categories": [
+            (category["label"], category["columns"])
+            for category in checkbox_columns["subject_categories"]
+        ],
+        "gazetteer": load_gazetteer(os.path.join(base_dir, GAZETTEER_FILE)),
+    }
@@ -0,0 +1,57 @@
+"""Compact row representation shared by the whole pipeline.
+
+Rows are plain lists addressed by a column index that is built once per
+input header, instead of one dict with ~100 keys per row.  The schema holds
+the input columns followed by any output columns the input lacks (such as
+the computed grade band and subject columns), so every column the rules or
+writers use has a fixed slot.
+"""
+
+from operator import itemgetter
+
+
+class RowSchema:
+    def __init__(self, fieldnames, extra_columns=()):
+        self.input_columns = list(fieldnames)
+        self.columns = list(fieldnames)
+        for column in extra_columns:
+            if column not in self.columns:
+                self.columns.append(column)
+        # Like DictReader, a repeated header name refers to its last column.
+        self.index = {name: i for i, name in enumerate(self.columns)}
+        self.input_width = len(self.input_columns)
+        self.padding = [""] * (len(self.columns) - self.input_width)
+        self.interned = []
+
+    def intern_columns(self, columns):
+        """Keep one string object per distinct value of the input ``columns``.
+
+        Each column gets a dictionary of the values seen so far and
+        ``from_record`` swaps every cell for its dictionary entry, so repeated
+        values such as countries or checkbox labels share one object and
+        compare by identity.
+        """
+        self.interned = [
+            (self.index[column], {})
+            for column in dict.fromkeys(columns)
+            if self.index.get(column, self.input_width) < self.input_width
+        ]
+
+    def from_record(self, record):
+        """Turn a ``csv.reader`` record into a row with a slot for every column."""
+        if len(record) != self.input_width:
+            # Missing trailing values read as blanks; values beyond the header
+            # have no column and are dropped.
+            record = (record + [""] * self.input_width)[: self.input_width]
+        record.extend(self.padding)
+        for index, values in self.interned:
+            value = record[index]
+            record[index] = values.setdefault(value, value)
+        return record
+
+    def projector(self, columns):
+        """Return a function mapping a row to the values of ``columns``."""
+        getter = itemgetter(*[self.index[column] for column in columns])
+        if len(columns) == 1:
+            return lambda row: [getter(row)]
+        return lambda row: list(getter(row))
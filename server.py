@@ -0,0 +1,430 @@
+"""Cleaning service that keeps the reference data loaded (``python server.py``).
+
+Every main.py run loads the mapping files and opens the gazetteer before it
+reads a row.  The server does that once and then cleans rows as they
+arrive, over HTTP on a local port or on a Unix socket:
+
+- ``POST /clean`` takes a JSON object with one "row" or a list of "rows",
+  each an object keyed by the export's column names in its column order,
+  or a CSV batch with its header (``Content-Type: text/csv``).  It returns
+  the cleaned rows in DESIRED_ORDER, the number skipped for an unparseable
+  date, and the report counts of those rows.
+- ``GET /counters`` returns the report counts over every row cleaned since
+  the server started and ``DELETE /counters`` resets them.
+- ``GET /stats`` returns the latency of recent requests per endpoint and when
+  the reference data was loaded.
+
+Rows come back in the order they were sent; they are not sorted.  A thread
+checks the reference files every few seconds.  When one has changed, the
+reference data is loaded again next to the old one and swapped in whole
+once ready, so a request sees either the old files or the new ones, never a
+mix.  If the new files fail to load, the old data stays in use.  The memos
+of the old data (location results, gazetteer lookups and the normalization
+caches) are cleared on the swap, and while it is in use each header's
+location results are capped at ``MAX_LOCATIONS``.
+
+Each connection is handled on its own thread, so a slow client does not hold
+up the others.  Cleaning and the counters are guarded by one lock: the
+rules are pure Python, so cleaning two requests at once would not be faster,
+only unsafe for the shared memos.
+
+A request the service cannot handle gets a JSON error: 400 for a malformed
+body or a header without the columns the rules use, 500 for anything else.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import signal
+import socketserver
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from analysis_outputs import (
+    REPORT_SPECS,
+    merge_counters,
+    new_counters,
+    report_counts,
+    row_counter,
+)
+from cleaning_rules import DESIRED_ORDER, build_cleaning_context, resolve_location
+from columnar_cleaning import CLEANING_BACKENDS
+from inputs import union_header
+from location_cache import LocationCache
+from normalization import clear_caches
+from reference_data import GAZETTEER_FILE, REFERENCE_FILES, load_reference_data
+from timestamps import new_skipped, parse_sort_date, record_skipped
+
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 2.0
+# Latencies kept per endpoint for /stats.
+LATENCY_WINDOW = 1000
+# Cleaning contexts kept per reference state, one per distinct header.
+MAX_CONTEXTS = 32
+# Location results kept per cleaning context.
+MAX_LOCATIONS = 100000
+
+
+def reference_stamp():
+    """Return the size and mtime of every reference file, None if missing."""
+    stamp = []
+    for filename in REFERENCE_FILES + [GAZETTEER_FILE]:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            stamp.append(None)
+        else:
+            stamp.append((stat.st_size, stat.st_mtime_ns))
+    return tuple(stamp)
+
+
+def report_json(counters):
+    """Return the counters as ``{report filename: {value: count or info}}``."""
+    reports = report_counts(counters)
+    return {
+        spec["filename"]: {
+            value: payload if isinstance(payload, int) else list(payload)
+            for value, (payload, _) in sorted(
+                reports[spec["filename"]].items(), key=lambda item: item[1][1]
+            )
+        }
+        for spec in REPORT_SPECS
+    }
+
+
+class ReferenceState:
+    """One version of the reference data and a cleaning context per header.
+
+    Only the ``MAX_CONTEXTS`` most recently used headers keep their context.
+    """
+
+    def __init__(self, reference, stamp):
+        self.reference = reference
+        self.stamp = stamp
+        self.loaded_at = datetime.now()
+        self.contexts = OrderedDict()
+
+    def context(self, fieldnames):
+        key = tuple(fieldnames)
+        ctx = self.contexts.get(key)
+        if ctx is None:
+            ctx = self.contexts[key] = build_cleaning_context(
+                fieldnames, self.reference
+            )
+            if ctx["location_cache"] is not None:
+                ctx["location_cache"] = LocationCache(
+                    resolve_location, maxsize=MAX_LOCATIONS
+                )
+            if len(self.contexts) > MAX_CONTEXTS:
+                self.contexts.popitem(last=False)
+        else:
+            self.contexts.move_to_end(key)
+        return ctx
+
+    def clear_caches(self):
+        """Drop what this state memoized; it is no longer in use."""
+        self.contexts.clear()
+        self.reference["gazetteer"].clear_caches()
+
+
+class CleaningService:
+    def __init__(self, sort_column, backend="rows"):
+        self.sort_column = sort_column
+        self.clean = CLEANING_BACKENDS[backend]
+        stamp = reference_stamp()
+        self.state = ReferenceState(load_reference_data(), stamp)
+        self.failed_stamp = None
+        self.reloads = 0
+        self.counters = new_counters()
+        self.batches = 0
+        self.rows_cleaned = 0
+        self.latencies = {}
+        # Guards the state's contexts and memos, the counters and the stats.
+        self.lock = threading.Lock()
+
+    def reload_if_changed(self):
+        """Load the reference files again if they changed; return whether."""
+        stamp = reference_stamp()
+        if stamp in (self.state.stamp, self.failed_stamp):
+            return False
+        try:
+            reference = load_reference_data()
+        except (OSError, ValueError) as e:
+            self.failed_stamp = stamp
+            print(f"Error reloading reference data, keeping the old data: {e}")
+            return False
+        with self.lock:
+            # Requests use either the old state or this one, never both.
+            old_state, self.state = self.state, ReferenceState(reference, stamp)
+            old_state.clear_caches()
+            clear_caches()
+        self.failed_stamp = None
+        self.reloads += 1
+        print(f"Reloaded reference data ({self.state.loaded_at:%H:%M:%S})")
+        return True
+
+    def clean_records(self, fieldnames, records):
+        if self.sort_column not in fieldnames:
+            raise ValueError(f"Sort column '{self.sort_column}' not found in headers")
+        with self.lock:
+            return self._clean_records(fieldnames, records)
+
+    def _clean_records(self, fieldnames, records):
+        ctx = self.state.context(fieldnames)
+        schema = ctx["schema"]
+        sort_index = schema.index[self.sort_column]
+        entry_date_index = schema.index["Entry Date"]
+        skipped = new_skipped()
+        rows = []
+        for record in records:
+            row = schema.from_record(record)
+            try:
+                row[sort_index] = parse_sort_date(row, entry_date_index, sort_index)
+            except ValueError as e:
+                record_skipped(skipped, row, ctx["email_index"], e)
+                continue
+            rows.append(row)
+        cleaned = self.clean(rows, ctx)
+
+        self.batches += 1
+        self.rows_cleaned += len(cleaned)
+        counters = new_counters()
+        count = row_counter(schema.index, date_column=self.sort_column)
+        for position, row in enumerate(cleaned):
+            count(counters, row, (row[sort_index], self.batches, position))
+        merge_counters(self.counters, counters)
+        project = schema.projector(DESIRED_ORDER)
+        return {
+            "columns": DESIRED_ORDER,
+            "rows": [project(row) for row in cleaned],
+            "skipped": skipped["count"],
+            "counters": report_json(counters),
+        }
+
+    def counters_json(self):
+        with self.lock:
+            return {"counters": report_json(self.counters)}
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = new_counters()
+            return {"counters": report_json(self.counters)}
+
+    def record_latency(self, endpoint, seconds):
+        with self.lock:
+            latencies = self.latencies.get(endpoint)
+            if latencies is None:
+                latencies = self.latencies[endpoint] = {
+                    "requests": 0,
+                    "recent": deque(maxlen=LATENCY_WINDOW),
+                }
+            latencies["requests"] += 1
+            latencies["recent"].append(seconds * 1000)
+
+    def stats(self):
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        state = self.state
+        endpoints = {}
+        for endpoint, latencies in self.latencies.items():
+            recent = sorted(latencies["recent"])
+            endpoints[endpoint] = {
+                "requests": latencies["requests"],
+                "mean_ms": statistics.fmean(recent),
+                "p50_ms": recent[len(recent) // 2],
+                "p95_ms": recent[int(len(recent) * 0.95)],
+                "max_ms": recent[-1],
+            }
+        return {
+            "reference_loaded_at": state.loaded_at.isoformat(
+                sep=" ", timespec="seconds"
+            ),
+            "reloads": self.reloads,
+            "rows_cleaned": self.rows_cleaned,
+            "endpoints": endpoints,
+            "location_caches": [
+                ctx["location_cache"].stats()
+                for ctx in state.contexts.values()
+                if ctx["location_cache"] is not None
+            ],
+        }
+
+
+def parse_json_rows(body):
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or not ("row" in payload or "rows" in payload):
+        raise ValueError('Expected a JSON object with "row" or "rows"')
+    rows = [payload["row"]] if "row" in payload else payload["rows"]
+    if not rows or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Rows must be non-empty JSON objects")
+    fieldnames = union_header([list(row) for row in rows])
+    records = [
+        ["" if row.get(name) is None else str(row[name]) for name in fieldnames]
+        for row in rows
+    ]
+    return fieldnames, records
+
+
+def parse_csv_rows(body):
+    reader = csv.reader(io.StringIO(body.decode("utf-8"), newline=""))
+    fieldnames = next(reader, None)
+    if not fieldnames:
+        raise ValueError("No headers found in CSV file.")
+    # Like DictReader, skip blank lines.
+    return fieldnames, [record for record in reader if record]
+
+
+class CleaningHandler(BaseHTTPRequestHandler):
+    server_version = "mailchimp-cleaner"
+
+    def do_POST(self):
+        if self.path == "/clean":
+            self._respond("POST /clean", self._clean)
+        else:
+            self._not_found()
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/counters":
+            self._respond("GET /counters", service.counters_json)
+        elif self.path == "/stats":
+            self._respond("GET /stats", service.stats)
+        else:
+            self._not_found()
+
+    def do_DELETE(self):
+        if self.path == "/counters":
+            self._respond("DELETE /counters", self.server.service.reset_counters)
+        else:
+            self._not_found()
+
+    def _clean(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Type", "").startswith("text/csv"):
+            fieldnames, records = parse_csv_rows(body)
+        else:
+            fieldnames, records = parse_json_rows(body)
+        return self.server.service.clean_records(fieldnames, records)
+
+    def _respond(self, endpoint, handler):
+        start = time.perf_counter()
+        try:
+            status, payload = 200, handler()
+        except (KeyError, ValueError) as e:
+            # Bad JSON or CSV, or a header without the columns the rules use.
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            print(f"Error handling {endpoint}:")
+            traceback.print_exc()
+            status, payload = 500, {"error": f"Internal error: {e}"}
+        seconds = time.perf_counter() - start
+        self.server.service.record_latency(endpoint, seconds)
+        payload["seconds"] = seconds
+        self._send(status, payload)
+
+    def _not_found(self):
+        self._send(404, {"error": f"No endpoint {self.command} {self.path}"})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+
+
+def watch_reference_files(service, interval, stop):
+    while not stop.wait(interval):
+        service.reload_if_changed()
+
+
+def serve(
+    service,
+    host="127.0.0.1",
+    port=DEFAULT_PORT,
+    socket_path=None,
+    reload_interval=DEFAULT_RELOAD_INTERVAL,
+):
+    if socket_path:
+        server = UnixHTTPServer(socket_path, CleaningHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), CleaningHandler)
+        address = f"http://{host}:{server.server_port}"
+    server.service = service
+    stop = threading.Event()
+    if reload_interval > 0:
+        threading.Thread(
+            target=watch_reference_files,
+            args=(service, reload_interval, stop),
+            daemon=True,
+        ).start()
+    print(f"Cleaning rows on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Clean Mailchimp export rows sent over HTTP."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--socket", default=None, metavar="PATH", help="listen on a Unix socket"
+    )
+    parser.add_argument("--sort-column", default="OPTIN_TIME")
+    parser.add_argument(
+        "--backend",
+        choices=sorted(CLEANING_BACKENDS),
+        default="rows",
+        help="clean one row at a time or whole columns of a batch at a time",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=DEFAULT_RELOAD_INTERVAL,
+        metavar="SECONDS",
+        help="how often to check the reference files for changes (0: never)",
+    )
+    args = parser.parse_args()
+    # Stop cleanly (removing the socket file) when a service manager stops us.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    serve(
+        CleaningService(args.sort_column, args.backend),
+        args.host,
+        args.port,
+        args.socket,
+        args.reload_interval,
+    )
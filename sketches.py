@@ -0,0 +1,498 @@
+"""Distinct counts and top lists in bounded memory (``--sketches``).
+
+Three reports that exact counting would have to keep every distinct value
+for:
+
+- ``distinct_by_location.csv``: distinct emails and schools per country and
+  per country and state (a blank State is the whole country);
+- ``top_schools.csv`` and ``top_cities.csv``: the most frequent schools and
+  City/Town values (with their state and country).
+
+In "approx" mode distinct values are counted with HyperLogLog: 2**precision
+one-byte registers per location (4 KiB at the default precision of 12),
+with a relative standard error of 1.04 / sqrt(2**precision), about 1.6%.
+Locations with only a few values keep their hashes instead and are counted
+exactly.  Top lists use Space-Saving with ``top_n * CAPACITY_FACTOR``
+counters: every value occurring more than rows / capacity times is listed,
+and each count is at most its "Max overcount" column above the true count.
+
+"exact" mode keeps sets and full counters instead, to validate the
+estimates.  The sketches of a run are saved to ``sketches.json``; sketches
+of several runs or files can be merged into one set of reports with
+``python sketches.py merge A/sketches.json B/sketches.json``.
+"""
+
+import argparse
+import base64
+import csv
+import hashlib
+import heapq
+import json
+import math
+import os
+from collections import Counter
+
+from dedupe import normalize_email
+
+SKETCH_MODES = ["off", "approx", "exact"]
+DEFAULT_PRECISION = 12
+DEFAULT_TOP_N = 100
+CAPACITY_FACTOR = 10
+SKETCHES_FILENAME = "sketches.json"
+DISTINCT_FILENAME = "distinct_by_location.csv"
+TOP_SCHOOLS_FILENAME = "top_schools.csv"
+TOP_CITIES_FILENAME = "top_cities.csv"
+# The columns ``ReportSketches.add_row`` takes, in order.
+ROW_COLUMNS = [
+    "Email Address",
+    "School / Company Name",
+    "Country",
+    "State",
+    "City/Town",
+]
+
+_POWERS = [2.0**-rank for rank in range(65)]
+
+
+def value_hash(value):
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        # Hashes are kept until there are about as many bytes of them as of
+        # registers.
+        self.sparse_limit = self.size // 64
+        self.hashes = set()
+        self.registers = None
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value):
+        self.add_hash(value_hash(value))
+
+    def add_hash(self, h):
+        if self.registers is None:
+            self.hashes.add(h)
+            if len(self.hashes) > self.sparse_limit:
+                self._densify()
+        else:
+            self._add_hash(h)
+
+    def _densify(self):
+        self.registers = bytearray(self.size)
+        for h in self.hashes:
+            self._add_hash(h)
+        self.hashes = set()
+
+    def _add_hash(self, h):
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        if other.registers is None:
+            if self.registers is None:
+                self.hashes |= other.hashes
+                if len(self.hashes) > self.sparse_limit:
+                    self._densify()
+            else:
+                for h in other.hashes:
+                    self._add_hash(h)
+            return
+        if self.registers is None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        if self.registers is None:
+            return len(self.hashes)
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting
+        return round(estimate)
+
+    def to_json(self):
+        if self.registers is None:
+            return {"hashes": sorted(self.hashes)}
+        return {"registers": base64.b64encode(self.registers).decode("ascii")}
+
+    @classmethod
+    def from_json(cls, data, precision):
+        sketch = cls(precision)
+        if "registers" in data:
+            sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        else:
+            sketch.hashes = set(data["hashes"])
+        return sketch
+
+
+class ExactDistinct:
+    relative_error = 0.0
+
+    def __init__(self):
+        self.values = set()
+
+    def add(self, value):
+        self.values.add(value)
+
+    def merge(self, other):
+        self.values |= other.values
+
+    def count(self):
+        return len(self.values)
+
+    def to_json(self):
+        return {"values": sorted(self.values)}
+
+    @classmethod
+    def from_json(cls, data, precision=None):
+        sketch = cls()
+        sketch.values = set(data["values"])
+        return sketch
+
+
+class SpaceSaving:
+    """Space-Saving top-k: ``capacity`` counters of [count, max overcount].
+
+    A value that is not monitored replaces the one with the smallest count
+    and inherits that count as its overcount.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        # One (count, value) entry per monitored value; counts only grow, so
+        # an entry may be behind and is refreshed when it reaches the top.
+        self.heap = []
+
+    def add(self, value, count=1):
+        self.total += count
+        entry = self.counts.get(value)
+        if entry is not None:
+            entry[0] += count
+            return
+        overcount = 0
+        if len(self.counts) >= self.capacity:
+            overcount = self._evict()
+        self.counts[value] = [overcount + count, overcount]
+        heapq.heappush(self.heap, (overcount + count, value))
+
+    def _evict(self):
+        while True:
+            count, value = self.heap[0]
+            current = self.counts[value][0]
+            if current == count:
+                break
+            heapq.heapreplace(self.heap, (current, value))
+        heapq.heappop(self.heap)
+        del self.counts[value]
+        return count
+
+    def min_count(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counts.values())
+
+    def merge(self, other):
+        """Merge ``other`` in; counts stay over-estimates of the combined ones.
+
+        A value missing from a full summary may have occurred up to that
+        summary's smallest count, which is added to its count and overcount.
+        """
+        self_min = self.min_count()
+        other_min = other.min_count()
+        merged = {}
+        for value in self.counts.keys() | other.counts.keys():
+            count, overcount = self.counts.get(value, (self_min, self_min))
+            other_count, other_overcount = other.counts.get(
+                value, (other_min, other_min)
+            )
+            merged[value] = [count + other_count, overcount + other_overcount]
+        kept = sorted(merged.items(), key=lambda item: (-item[1][0], item[0]))
+        kept = kept[: self.capacity]
+        self.total += other.total
+        self.counts = dict(kept)
+        self.heap = [(entry[0], value) for value, entry in kept]
+        heapq.heapify(self.heap)
+
+    def top(self, n):
+        """Return the ``n`` largest as (value, count, max overcount)."""
+        best = sorted(self.counts.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(value, count, overcount) for value, (count, overcount) in best[:n]]
+
+    def max_overcount(self):
+        return self.total // self.capacity
+
+    def to_json(self):
+        return {
+            "total": self.total,
+            "counts": [[value, entry] for value, entry in self.counts.items()],
+        }
+
+    @classmethod
+    def from_json(cls, data, capacity):
+        sketch = cls(capacity)
+        sketch.total = data["total"]
+        for value, entry in data["counts"]:
+            sketch.counts[_value_key(value)] = entry
+        sketch.heap = [(entry[0], value) for value, entry in sketch.counts.items()]
+        heapq.heapify(sketch.heap)
+        return sketch
+
+
+class ExactTop:
+    def __init__(self, capacity=None):
+        self.total = 0
+        self.counts = Counter()
+
+    def add(self, value, count=1):
+        self.total += count
+        self.counts[value] += count
+
+    def merge(self, other):
+        self.total += other.total
+        self.counts.update(other.counts)
+
+    def top(self, n):
+        best = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return [(value, count, 0) for value, count in best[:n]]
+
+    def max_overcount(self):
+        return 0
+
+    def to_json(self):
+        return {
+            "total": self.total,
+            "counts": [[value, count] for value, count in self.counts.items()],
+        }
+
+    @classmethod
+    def from_json(cls, data, capacity=None):
+        sketch = cls()
+        sketch.total = data["total"]
+        for value, count in data["counts"]:
+            sketch.counts[_value_key(value)] = count
+        return sketch
+
+
+def _value_key(value):
+    # JSON turns the (city, state, country) keys into lists.
+    return tuple(value) if isinstance(value, list) else value
+
+
+class ReportSketches:
+    def __init__(
+        self, mode="approx", precision=DEFAULT_PRECISION, top_n=DEFAULT_TOP_N
+    ):
+        if mode not in ("approx", "exact"):
+            raise ValueError(f"Unknown sketch mode '{mode}'")
+        self.mode = mode
+        self.precision = precision
+        self.top_n = top_n
+        self.capacity = top_n * CAPACITY_FACTOR
+        self.rows = 0
+        # (country, state) -> distinct counter; state "" is the whole country.
+        self.emails = {}
+        self.schools = {}
+        top = SpaceSaving if mode == "approx" else ExactTop
+        self.top_schools = top(self.capacity)
+        self.top_cities = top(self.capacity)
+
+    def _distinct(self, groups, key):
+        sketch = groups.get(key)
+        if sketch is None:
+            if self.mode == "approx":
+                sketch = groups[key] = HyperLogLog(self.precision)
+            else:
+                sketch = groups[key] = ExactDistinct()
+        return sketch
+
+    def _add_distinct(self, groups, locations, value):
+        if self.mode == "approx":
+            # Hash once for all locations.
+            h = value_hash(value)
+            for location in locations:
+                self._distinct(groups, location).add_hash(h)
+        else:
+            for location in locations:
+                self._distinct(groups, location).add(value)
+
+    def add_row(self, email, school, country, state, city):
+        self.rows += 1
+        email = normalize_email(email) if email else ""
+        school = school.strip() if school else ""
+        country = country.strip() if country else ""
+        state = state.strip() if state else ""
+        city = city.strip() if city else ""
+        locations = [(country, "")]
+        if state:
+            locations.append((country, state))
+        if email:
+            self._add_distinct(self.emails, locations, email)
+        if school:
+            self._add_distinct(self.schools, locations, school.casefold())
+        if school:
+            self.top_schools.add(school)
+        if city:
+            self.top_cities.add((city, state, country))
+
+    def _check_compatible(self, other):
+        if (other.mode, other.precision, other.top_n) != (
+            self.mode,
+            self.precision,
+            self.top_n,
+        ):
+            raise ValueError("Cannot merge sketches made with different settings")
+
+    def merge(self, other):
+        self._check_compatible(other)
+        self.rows += other.rows
+        for groups, other_groups in [
+            (self.emails, other.emails),
+            (self.schools, other.schools),
+        ]:
+            for location, sketch in other_groups.items():
+                current = groups.get(location)
+                if current is None:
+                    groups[location] = sketch
+                else:
+                    current.merge(sketch)
+        self.top_schools.merge(other.top_schools)
+        self.top_cities.merge(other.top_cities)
+        return self
+
+    def error_bounds(self):
+        if self.mode == "exact":
+            distinct_error = 0.0
+        else:
+            distinct_error = HyperLogLog(self.precision).relative_error
+        return {
+            "mode": self.mode,
+            "rows": self.rows,
+            "distinct_relative_standard_error": distinct_error,
+            "top_schools_max_overcount": self.top_schools.max_overcount(),
+            "top_cities_max_overcount": self.top_cities.max_overcount(),
+        }
+
+    def write_reports(self, output_folder):
+        locations = sorted(
+            self.emails.keys() | self.schools.keys(),
+            key=lambda location: (
+                -self._count(self.emails, location),
+                location,
+            ),
+        )
+        with _open_report(output_folder, DISTINCT_FILENAME) as f:
+            writer = csv.writer(f)
+            writer.writerow(["Country", "State", "Emails", "Schools"])
+            for location in locations:
+                writer.writerow(
+                    list(location)
+                    + [
+                        self._count(self.emails, location),
+                        self._count(self.schools, location),
+                    ]
+                )
+        with _open_report(output_folder, TOP_SCHOOLS_FILENAME) as f:
+            writer = csv.writer(f)
+            writer.writerow(["School / Company Name", "Count", "Max overcount"])
+            for school, count, overcount in self.top_schools.top(self.top_n):
+                writer.writerow([school, count, overcount])
+        with _open_report(output_folder, TOP_CITIES_FILENAME) as f:
+            writer = csv.writer(f)
+            writer.writerow(["City/Town", "State", "Country", "Count", "Max overcount"])
+            for city, count, overcount in self.top_cities.top(self.top_n):
+                writer.writerow(list(city) + [count, overcount])
+
+    @staticmethod
+    def _count(groups, location):
+        sketch = groups.get(location)
+        return sketch.count() if sketch is not None else 0
+
+    def to_json(self):
+        return {
+            "mode": self.mode,
+            "precision": self.precision,
+            "top_n": self.top_n,
+            "rows": self.rows,
+            "emails": [[list(k), s.to_json()] for k, s in self.emails.items()],
+            "schools": [[list(k), s.to_json()] for k, s in self.schools.items()],
+            "top_schools": self.top_schools.to_json(),
+            "top_cities": self.top_cities.to_json(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        sketches = cls(data["mode"], data["precision"], data["top_n"])
+        sketches.rows = data["rows"]
+        distinct = HyperLogLog if sketches.mode == "approx" else ExactDistinct
+        top = SpaceSaving if sketches.mode == "approx" else ExactTop
+        for groups, name in [
+            (sketches.emails, "emails"),
+            (sketches.schools, "schools"),
+        ]:
+            for location, sketch in data[name]:
+                groups[tuple(location)] = distinct.from_json(
+                    sketch, sketches.precision
+                )
+        sketches.top_schools = top.from_json(data["top_schools"], sketches.capacity)
+        sketches.top_cities = top.from_json(data["top_cities"], sketches.capacity)
+        return sketches
+
+    def save(self, output_folder):
+        with _open_report(output_folder, SKETCHES_FILENAME) as f:
+            json.dump(self.to_json(), f)
+
+    def write(self, output_folder):
+        """Write the three reports and ``sketches.json`` to ``output_folder``."""
+        self.write_reports(output_folder)
+        self.save(output_folder)
+
+
+def _open_report(output_folder, filename):
+    return open(
+        os.path.join(output_folder, filename), "w", newline="", encoding="utf-8"
+    )
+
+
+def load_sketches(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return ReportSketches.from_json(json.load(f))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge the sketches of several runs into one set of reports."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge = subparsers.add_parser("merge", help="merge sketches.json files")
+    merge.add_argument("sketches", nargs="+", metavar="SKETCHES_JSON")
+    merge.add_argument("--output-folder", default="outputs-merged")
+    args = parser.parse_args()
+
+    try:
+        merged = load_sketches(args.sketches[0])
+        for path in args.sketches[1:]:
+            merged.merge(load_sketches(path))
+    except FileNotFoundError as e:
+        print(f"Error: Sketch file '{e.filename}' not found.")
+    except ValueError as e:
+        print(f"Error: {e}")
+    else:
+        os.makedirs(args.output_folder, exist_ok=True)
+        merged.write(args.output_folder)
+        print(f"Merged {len(args.sketches)} sketch files into '{args.output_folder}'")
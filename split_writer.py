@@ -0,0 +1,149 @@
+"""Streaming writer for ``0-sorted-and-cleaned.csv`` and its date-range splits.
+
+The rows arrive sorted, so every date range is a contiguous run: each row is
+written to the master file and to the one split file that is open, and the
+previous split file is closed when the range changes.  Each row is formatted
+as CSV once and the same line goes to both files, through large write
+buffers.  Parquet copies of the same files can be written alongside or
+instead of the CSV files (see ``columnar_output.py``).
+"""
+
+import csv
+import os
+
+from columnar_output import ParquetFile, require_pyarrow
+from timestamps import DEFAULT_SPLIT_RANGES, date_range_filename
+
+MASTER_STEM = "0-sorted-and-cleaned"
+MASTER_FILENAME = MASTER_STEM + ".csv"
+WRITE_BUFFER_SIZE = 1024 * 1024
+OUTPUT_FORMATS = {
+    "csv": ("csv",),
+    "parquet": ("parquet",),
+    "both": ("csv", "parquet"),
+}
+
+
+def open_output(path):
+    return open(
+        path, "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER_SIZE
+    )
+
+
+class _LastLine:
+    """Write target that keeps the line a ``csv.writer`` last produced."""
+
+    line = ""
+
+    def write(self, line):
+        self.line = line
+
+
+def csv_line_formatter():
+    """Return a function formatting a list of values as one CSV line."""
+    target = _LastLine()
+    writer = csv.writer(target)
+
+    def format_line(values):
+        writer.writerow(values)
+        return target.line
+
+    return format_line
+
+
+class CsvFile:
+    """Output file that takes rows already formatted as CSV lines."""
+
+    def __init__(self, path, header_line):
+        self.file = open_output(path)
+        self.file.write(header_line)
+
+    def write(self, values, line):
+        self.file.write(line)
+
+    def close(self):
+        self.file.close()
+
+
+def _open_outputs(stem, header, header_line, formats, timestamp_column):
+    outputs = []
+    if "csv" in formats:
+        outputs.append(CsvFile(stem + ".csv", header_line))
+    if "parquet" in formats:
+        outputs.append(ParquetFile(stem + ".parquet", header, timestamp_column))
+    return outputs
+
+
+def _close_outputs(outputs):
+    for output in outputs:
+        output.close()
+
+
+def write_split_files(
+    sorted_rows,
+    output_folder,
+    header,
+    project,
+    sort_index,
+    ranges=DEFAULT_SPLIT_RANGES,
+    formats=("csv",),
+    timestamp_column=None,
+):
+    """Write the master file and the split files in one pass.
+
+    ``project`` maps a row to its output values and ``sort_index`` is the slot
+    of the sort-date text.  Fixed ranges use the filenames from ``ranges``;
+    monthly files are numbered after them in the order they appear, which is
+    the same as sorting their keys.  Every file is written in each of
+    ``formats`` ("csv", "parquet"); ``timestamp_column`` is stored as a
+    timestamp in Parquet files.  Returns the number of rows written.
+    """
+    if "parquet" in formats:
+        require_pyarrow()
+    format_line = csv_line_formatter()
+    header_line = format_line(header)
+    use_csv = "csv" in formats
+    line = None
+    month_number = len(ranges) + 1
+    current_range = None
+    rows_written = 0
+    range_outputs = []
+    master_outputs = _open_outputs(
+        os.path.join(output_folder, MASTER_STEM),
+        header,
+        header_line,
+        formats,
+        timestamp_column,
+    )
+    try:
+        for row in sorted_rows:
+            values = project(row)
+            if use_csv:
+                line = format_line(values)
+            for output in master_outputs:
+                output.write(values, line)
+
+            range_key = date_range_filename(row[sort_index], ranges)
+            if range_key != current_range:
+                _close_outputs(range_outputs)
+                range_outputs = []
+                if range_key.endswith(".csv"):
+                    stem = range_key[: -len(".csv")]
+                else:
+                    stem = f"{month_number}-{range_key}"
+                    month_number += 1
+                range_outputs = _open_outputs(
+                    os.path.join(output_folder, stem),
+                    header,
+                    header_line,
+                    formats,
+                    timestamp_column,
+                )
+                current_range = range_key
+            for output in range_outputs:
+                output.write(values, line)
+            rows_written += 1
+    finally:
+        _close_outputs(range_outputs)
+        _close_outputs(master_outputs)
+    return rows_written
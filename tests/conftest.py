@@ -0,0 +1,86 @@
+import os
+import pathlib
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmark import EXPORT_HEADER, generate_export  # noqa: E402
+from cleaning_rules import build_cleaning_context  # noqa: E402
+from main import process_csv  # noqa: E402
+from reference_data import REFERENCE_FILES, load_reference_data  # noqa: E402
+
+GAZETTEER_ROWS = """\
+geonameid,name,asciiname,alternatenames,country,state(s)
+1,Springfield,Springfield,,United States,Illinois|Massachusetts
+2,Toronto,Toronto,,Canada,Ontario
+3,Berlin,Berlin,,Germany,
+4,Gießen,Gießen,,Germany,
+"""
+
+
+@pytest.fixture(scope="session")
+def reference_dir(tmp_path_factory):
+    """A folder with the repo's mapping files and a small gazetteer."""
+    base_dir = tmp_path_factory.mktemp("reference")
+    for filename in REFERENCE_FILES:
+        shutil.copy(os.path.join(REPO_DIR, filename), base_dir)
+    (base_dir / "all_cities.csv").write_text(GAZETTEER_ROWS, encoding="utf-8")
+    return base_dir
+
+
+@pytest.fixture(scope="session")
+def reference(reference_dir):
+    return load_reference_data(str(reference_dir))
+
+
+@pytest.fixture
+def ctx(reference):
+    return build_cleaning_context(list(EXPORT_HEADER), reference)
+
+
+def export_record(values):
+    """An export record with ``values`` (keyed by column name), blank elsewhere."""
+    return [values.get(column, "") for column in EXPORT_HEADER]
+
+
+@pytest.fixture(scope="session")
+def export_file(tmp_path_factory):
+    """A small synthetic export, with the real header."""
+    path = tmp_path_factory.mktemp("export") / "export.csv"
+    generate_export(str(path), 2000, seed=1, base_dir=REPO_DIR)
+    return path
+
+
+@pytest.fixture(scope="session")
+def default_outputs(export_file, reference, tmp_path_factory):
+    """The outputs of a default run over ``export_file``."""
+    return run_main(export_file, tmp_path_factory.mktemp("default"), reference)
+
+
+# Files that differ between runs with the same output.
+RUN_FILES = {"run_report.json", ".incremental_state.sqlite"}
+
+
+def run_main(input_file, output_folder, reference, **options):
+    """Run ``process_csv`` and return ``{filename: contents}`` of its outputs."""
+    if isinstance(input_file, list):
+        input_file = [str(path) for path in input_file]
+    else:
+        input_file = str(input_file)
+    output_folder = str(output_folder)
+    assert process_csv(
+        input_file, output_folder, "OPTIN_TIME", reference=reference, **options
+    )
+    return output_files(pathlib.Path(output_folder))
+
+
+def output_files(output_folder):
+    return {
+        name: (output_folder / name).read_bytes()
+        for name in sorted(os.listdir(output_folder))
+        if name not in RUN_FILES
+    }
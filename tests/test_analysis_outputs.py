@@ -0,0 +1,59 @@
+import csv
+import io
+from collections import Counter
+
+from analysis_outputs import REPORT_SPECS
+from split_writer import MASTER_FILENAME
+
+
+def read_csv(contents):
+    return list(csv.DictReader(io.StringIO(contents.decode("utf-8"))))
+
+
+def recount(rows, spec):
+    """Count a report the slow way, one row at a time."""
+    columns = {column: column for column in rows[0]}
+    row_filter = spec.get("filter")
+    return Counter(
+        (row[spec["column"]] or "").strip()
+        for row in rows
+        if row_filter is None or row_filter(row, columns)
+    )
+
+
+def test_reports_match_a_recount_of_the_master(default_outputs):
+    rows = read_csv(default_outputs[MASTER_FILENAME])
+    for spec in REPORT_SPECS:
+        if spec.get("kind") == "first_seen":
+            continue
+        report = read_csv(default_outputs[spec["filename"]])
+        counts = recount(rows, spec)
+        written = {row[spec["label"]]: int(row["Count"]) for row in report}
+        total = written.pop("TOTAL")
+        if "categories" in spec:
+            blank = written.pop("(Blank)")
+            assert blank == counts[""], spec["filename"]
+            assert list(written) == spec["categories"], spec["filename"]
+            counts = {value: counts[value] for value in spec["categories"]}
+            assert total == sum(counts.values()) + blank, spec["filename"]
+        else:
+            assert total == sum(counts.values()), spec["filename"]
+        assert written == dict(counts), spec["filename"]
+
+
+def test_first_seen_report_keeps_the_first_row(default_outputs):
+    rows = read_csv(default_outputs[MASTER_FILENAME])
+    (spec,) = [spec for spec in REPORT_SPECS if spec.get("kind") == "first_seen"]
+    first = {}
+    for row in rows:
+        value = (row[spec["column"]] or "").strip()
+        if value:
+            first.setdefault(
+                value,
+                [(row[column] or "").strip() for column in spec["value_columns"]],
+            )
+    report = read_csv(default_outputs[spec["filename"]])
+    assert {
+        row[spec["label"]]: [row[column] for column in spec["value_columns"]]
+        for row in report
+    } == first
@@ -0,0 +1,37 @@
+import csv
+import shutil
+
+from conftest import REPO_DIR, output_files, run_main
+
+from benchmark import generate_export
+from main import run_batch
+
+
+def test_batch_matches_single_runs(
+    export_file, reference, reference_dir, default_outputs, tmp_path, monkeypatch
+):
+    other = tmp_path / "other" / "export.csv"
+    other.parent.mkdir()
+    generate_export(str(other), 500, seed=2, base_dir=REPO_DIR)
+    monkeypatch.chdir(reference_dir)  # run_batch loads the reference data here
+    assert run_batch(
+        [str(export_file), str(other)], str(tmp_path / "batch"), "OPTIN_TIME", jobs=2
+    )
+    # Files with the same name get numbered folders.
+    assert output_files(tmp_path / "batch" / "export") == default_outputs
+    assert output_files(tmp_path / "batch" / "export-2") == run_main(
+        other, tmp_path / "single", reference
+    )
+
+
+def test_several_inputs_clean_as_one_export(export_file, reference, tmp_path):
+    with open(export_file, newline="", encoding="utf-8") as f:
+        header, *rows = csv.reader(f)
+    paths = [tmp_path / "first.csv", tmp_path / "second.csv"]
+    for path, part in zip(paths, [rows[:700], rows[700:]]):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([header] + part)
+    shutil.copy(export_file, tmp_path / "whole.csv")
+    assert run_main(paths, tmp_path / "parts", reference) == run_main(
+        tmp_path / "whole.csv", tmp_path / "one", reference
+    )
@@ -0,0 +1,31 @@
+import pytest
+from conftest import REPO_DIR, run_main
+
+from benchmark import find_regressions, reference_folder
+from reference_data import load_reference_data
+
+
+def test_runs_without_a_real_gazetteer(export_file, tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    folder = reference_folder(str(tmp_path / "data"))
+    reference = load_reference_data(folder)
+    assert reference["gazetteer"].has_us_city("alabama", "new york")
+    outputs = run_main(export_file, tmp_path / "out", reference)
+    assert "0-sorted-and-cleaned.csv" in outputs
+
+
+def test_missing_gazetteer_is_reported(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    with pytest.raises(FileNotFoundError, match="Gazetteer 'nope.csv' not found"):
+        reference_folder(str(tmp_path / "data"), "nope.csv")
+
+
+def test_slower_stages_are_regressions():
+    stages = {"load": 1.0, "clean": 2.0, "sort": 0, "write": 0, "analyze": 0}
+    baseline = {"results": {"10": {"stages": stages, "total_seconds": 3.0}}}
+    slower = dict(stages, clean=3.0)
+    results = {10: {"stages": slower, "total_seconds": 4.0}}
+    assert find_regressions(results, baseline) == [
+        "10 rows: clean took 3.00s, baseline 2.00s (+50%)",
+        "10 rows: total took 4.00s, baseline 3.00s (+33%)",
+    ]
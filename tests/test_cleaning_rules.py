@@ -0,0 +1,184 @@
+import csv
+from itertools import product
+
+from conftest import REPO_DIR, export_record
+
+from benchmark import generate_export
+from cleaning_rules import (
+    DESIRED_ORDER,
+    build_cleaning_context,
+    clean_row,
+    compute_grade_band,
+    compute_stem_tech_nonstem,
+    pack_checkbox_mask,
+)
+from columnar_cleaning import CLEANING_BACKENDS
+
+
+def clean_location(ctx, country, state, city=""):
+    row = ctx["schema"].from_record(
+        export_record(
+            {
+                "Email Address": "teacher@example.com",
+                "I am a...": "Teacher / Educator",
+                "Country": country,
+                "State": state,
+                "City/Town": city,
+            }
+        )
+    )
+    clean_row(row, ctx)
+    return row[ctx["country_index"]], row[ctx["state_index"]]
+
+
+def test_province_code_is_not_a_bad_state_entry(ctx):
+    # "on" is listed as a bad state entry; the Ontario code "ON" is not.
+    assert clean_location(ctx, "Canada", "ON", "Ottawa") == ("Canada", "ON")
+
+
+def test_bad_state_entries_are_cleared(ctx):
+    assert clean_location(ctx, "Canada", " Select State ") == ("Canada", "")
+    assert clean_location(ctx, "Canada", "on") == ("Canada", "")
+
+
+def test_gazetteer_cities_match_on_the_shared_key(ctx):
+    # normalize_key case-folds "ß" to "ss" on both sides of the lookup.
+    assert ctx["gazetteer"].has_intl_city("Germany", "giessen")
+    assert clean_location(ctx, "Germany", "Hessen", " GIESSEN") == ("Germany", "")
+
+
+def test_columnar_backend_matches_rows(reference, tmp_path):
+    export = tmp_path / "export.csv"
+    generate_export(str(export), 3000, seed=1, base_dir=REPO_DIR)
+    with open(export, newline="", encoding="utf-8") as f:
+        records = list(csv.reader(f))
+    fieldnames = records.pop(0)
+    cleaned = {}
+    for backend, clean in CLEANING_BACKENDS.items():
+        ctx = build_cleaning_context(fieldnames, reference)
+        rows = [ctx["schema"].from_record(list(record)) for record in records]
+        cleaned[backend] = clean(rows, ctx)
+    assert cleaned["columnar"] == cleaned["rows"]
+
+
+def cleaned(ctx, values):
+    row = ctx["schema"].from_record(export_record(values))
+    clean_row(row, ctx)
+    output = dict(zip(DESIRED_ORDER, ctx["schema"].projector(DESIRED_ORDER)(row)))
+    return {column: value for column, value in output.items() if value}
+
+
+def test_pipeline_maps_us_locations(ctx):
+    assert cleaned(
+        ctx,
+        {
+            "Email Address": "a@x.com",
+            "I am a...": "Teacher / Educator",
+            "Country": "United States of America",
+            "State": "ma",
+            "City/Town": "Boston",
+        },
+    ) == {
+        "Email Address": "a@x.com",
+        "I am a...": "Teacher / Educator",
+        "Country": "United States",
+        "State": "Massachusetts",
+        "City/Town": "Boston",
+        "City": "Boston",
+    }
+
+
+def test_pipeline_moves_qq_users_to_china(ctx):
+    row = cleaned(
+        ctx,
+        {
+            "Email Address": "a@QQ.com",
+            "Country": "United States",
+            "State": "CA",
+            "City/Town": "Beijing",
+        },
+    )
+    assert (row["Country"], "State" in row) == ("China", False)
+
+
+def test_pipeline_clears_student_fields(ctx):
+    assert cleaned(
+        ctx,
+        {
+            "Email Address": "s@x.com",
+            "I am a...": "Student",
+            "Country": "Canada",
+            "Number of Students": "30",
+            "Preschool": "Preschool",
+            "Computer science": "Computer science",
+        },
+    ) == {"Email Address": "s@x.com", "I am a...": "Student", "Country": "Canada"}
+
+
+def test_pipeline_merges_computed_columns(ctx):
+    row = cleaned(
+        ctx,
+        {
+            "Email Address": "t@x.com",
+            "Name (First)": "Ann",
+            "Name (Last)": "Li",
+            "I am a...": "Teacher / Educator",
+            "State": "Texas",
+            "Middle school 6 - 8 (11 - 13 years)": "x",
+            "Mathematics": "Mathematics",
+        },
+    )
+    assert row["Country"] == "United States"  # from a US state without country
+    assert row["Full Name"] == "Ann Li"
+    assert (row["Computed Grade Band"], row["Ages Taught"]) == ("6-8", "6-8")
+    assert (row["Computed STEM/Tech/Non-STEM"], row["Primary Subject"]) == (
+        "STEM",
+        "STEM",
+    )
+
+
+def checkbox_row(ctx, ticked, values=()):
+    row = ctx["schema"].from_record(
+        export_record({**{column: column for column in ticked}, **dict(values)})
+    )
+    pack_checkbox_mask(row, ctx)
+    return row
+
+
+def test_grade_bands_for_every_combination(ctx):
+    grade_bands = ctx["grade_bands"]
+    for ticked in product([False, True], repeat=len(grade_bands)):
+        columns = [column for (column, _), tick in zip(grade_bands, ticked) if tick]
+        expected = ", ".join(
+            label for (_, label), tick in zip(grade_bands, ticked) if tick
+        )
+        assert compute_grade_band(checkbox_row(ctx, columns), ctx) == expected
+
+
+def test_subject_categories_for_every_combination(ctx):
+    categories = ctx["subject_categories"]
+    for ticked in product([False, True], repeat=len(categories)):
+        # The last column of each category, so every bit of it is looked at.
+        columns = [
+            columns[-1] for (_, columns), tick in zip(categories, ticked) if tick
+        ]
+        expected = ", ".join(
+            label for (label, _), tick in zip(categories, ticked) if tick
+        )
+        row = checkbox_row(ctx, columns)
+        assert compute_stem_tech_nonstem(row, ctx) == expected
+
+
+def test_blank_checkboxes_are_not_ticked(ctx):
+    row = checkbox_row(ctx, [], [("Preschool", " "), ("Mathematics", " ")])
+    assert compute_grade_band(row, ctx) == ""
+    assert compute_stem_tech_nonstem(row, ctx) == ""
+
+
+def test_no_subject_category_when_not_teaching(ctx):
+    row = checkbox_row(
+        ctx,
+        ["Mathematics", "I don't teach at the moment"],
+        [("I am a...", "Teacher / Educator")],
+    )
+    assert compute_stem_tech_nonstem(row, ctx) == ""
@@ -0,0 +1,47 @@
+import csv
+import subprocess
+import sys
+
+from conftest import REPO_DIR, run_main
+
+from analysis_outputs import (
+    CUBE_DIMENSIONS,
+    CUBE_FILENAME,
+    report_counts,
+    write_reports,
+)
+from count_cube import COUNT_REPORT_SPECS, read_cube, slice_cube
+
+
+def test_reports_from_the_cube_match_the_run(export_file, reference, tmp_path):
+    outputs = run_main(export_file, tmp_path / "out", reference)
+    counters = read_cube(tmp_path / "out" / CUBE_FILENAME)
+    reports = report_counts(counters, COUNT_REPORT_SPECS)
+    (tmp_path / "from-cube").mkdir()
+    write_reports(reports, tmp_path / "from-cube", COUNT_REPORT_SPECS)
+    for spec in COUNT_REPORT_SPECS:
+        filename = spec["filename"]
+        assert (tmp_path / "from-cube" / filename).read_bytes() == outputs[filename]
+    rows = outputs["0-sorted-and-cleaned.csv"].decode("utf-8")
+    written = sum(1 for _ in csv.reader(rows.splitlines(keepends=True))) - 1
+    assert slice_cube(counters, []) == [((), written)]
+
+
+def test_closed_pipe_exits_quietly(tmp_path):
+    cube = tmp_path / CUBE_FILENAME
+    with open(cube, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CUBE_DIMENSIONS + ["Count"])
+        for n in range(50000):
+            writer.writerow([f"Country {n}"] + [""] * (len(CUBE_DIMENSIONS) - 1) + [1])
+    process = subprocess.Popen(
+        [sys.executable, "count_cube.py", str(cube), "--by", "Country"],
+        cwd=REPO_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert process.stdout.readline() == b"Country,Count\r\n"
+    process.stdout.close()  # like `| head -1`
+    stderr = process.stderr.read()
+    process.wait()
+    assert stderr == b""
@@ -0,0 +1,21 @@
+from dedupe import dedupe_records, new_dedupe_stats
+
+# Email Address, Entry Date, OPTIN_TIME, Country
+EMAIL, ENTRY_DATE, OPTIN, COUNTRY = range(4)
+
+
+def test_merged_row_keeps_its_own_dates():
+    newest = ["A@x.com ", "", "2025-05-05 10:00:00", "Germany"]
+    older = ["a@x.com", "2024-01-01", "2024-01-01 09:00:00", "France"]
+    stats = new_dedupe_stats()
+    records = [older, newest]
+    merged = list(dedupe_records(records, EMAIL, ENTRY_DATE, OPTIN, None, stats))
+    assert merged == [["A@x.com ", "", "2025-05-05 10:00:00", "Germany"]]
+    assert stats == {"rows": 2, "duplicates": 1, "subscribers": 1}
+
+
+def test_blank_fields_are_filled_from_older_rows():
+    newest = ["a@x.com", "2025-05-05", "", ""]
+    older = ["a@x.com", "", "2024-01-01 09:00:00", "France"]
+    merged = list(dedupe_records([newest, older], EMAIL, ENTRY_DATE, OPTIN))
+    assert merged == [["a@x.com", "2025-05-05", "", "France"]]
@@ -0,0 +1,26 @@
+import os
+import random
+
+from external_sort import ExternalSorter
+
+
+def test_merges_many_runs_in_passes_and_keeps_input_order():
+    rng = random.Random(7)
+    rows = [[rng.randrange(50), n] for n in range(2000)]
+    with ExternalSorter(
+        key=lambda row: row[0], memory_budget_bytes=1, max_merge_runs=3
+    ) as sorter:
+        for row in rows[:1000]:
+            sorter.add(row)
+        sorter.add_sorted_run(sorted(rows[1000:], key=lambda row: row[0]))
+        merged = list(sorter)
+        # Every run was merged down to at most three files.
+        assert len(sorter.run_paths) <= 3
+        assert len(os.listdir(sorter.tmp_dir)) == len(sorter.run_paths)
+        assert list(sorter) == merged
+    expected = sorted(rows[:1000], key=lambda row: row[0])
+    expected = sorted(
+        expected + sorted(rows[1000:], key=lambda row: row[0]),
+        key=lambda row: row[0],
+    )
+    assert merged == expected
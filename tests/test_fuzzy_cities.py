@@ -0,0 +1,76 @@
+import csv
+import io
+
+import pytest
+from conftest import GAZETTEER_ROWS, run_main
+
+from fuzzy_cities import MATCHES_FILENAME, CityMatcher, write_matches
+from gazetteer import load_gazetteer
+
+EXTRA_ROWS = """5,Lakesidex,Lakesidex,,United States,Ohio
+6,Lakesidey,Lakesidey,,United States,Ohio
+7,Zürich,Zurich,,Switzerland,
+"""
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    source = tmp_path / "all_cities.csv"
+    source.write_text(GAZETTEER_ROWS + EXTRA_ROWS, encoding="utf-8")
+    index = load_gazetteer(str(source))
+    yield index
+    index.close()
+
+
+def test_misspelled_cities_match_within_their_scope(gazetteer):
+    matcher = CityMatcher(gazetteer)
+    name, score = matcher.match("United States", "Illinois", "Springfeld")
+    assert name == "Springfield" and score >= matcher.threshold
+    assert matcher.match("Canada", "", "Torontoo")[0] == "Toronto"
+    # Matches are written without accents.
+    assert matcher.match("Switzerland", "", "Zurichh")[0] == "Zurich"
+    # Springfield is not a Texas city.
+    assert matcher.match("United States", "Texas", "Springfeld") is None
+
+
+@pytest.mark.parametrize(
+    "country, state, city",
+    [
+        ("United States", "Illinois", "Springfield"),  # already known
+        ("United States", "Ohio", "Lakeside"),  # as close to two cities
+        ("United States", "", "Springfeld"),  # no state
+        ("", "Illinois", "Springfeld"),  # no country
+        ("Germany", "", "Brln"),  # too short
+    ],
+)
+def test_values_left_alone(gazetteer, country, state, city):
+    assert CityMatcher(gazetteer).match(country, state, city) is None
+
+
+def test_only_apply_mode_corrects(gazetteer):
+    args = ("United States", "Illinois", "Springfeld")
+    assert CityMatcher(gazetteer).correct(*args) is None
+    assert CityMatcher(gazetteer, apply=True).correct(*args) == "Springfield"
+
+
+def test_matches_from_other_processes_are_listed(gazetteer, tmp_path):
+    worker = CityMatcher(gazetteer)
+    worker.match("Canada", "", "Torontoo")
+    worker.match("Canada", "", "Ottawa")
+    matcher = CityMatcher(gazetteer)
+    matcher.add_matches(worker.take_matches())
+    assert worker.take_matches() == {}
+    write_matches(matcher, str(tmp_path))
+    with open(tmp_path / MATCHES_FILENAME, newline="", encoding="utf-8") as f:
+        assert list(csv.reader(f))[1:] == [
+            ["torontoo", "Canada", "Toronto", "0.93", "no"]
+        ]
+
+
+def test_proposing_matches_leaves_the_outputs(
+    export_file, reference, default_outputs, tmp_path
+):
+    outputs = run_main(export_file, tmp_path, reference, fuzzy_cities="propose")
+    header = next(csv.reader(io.StringIO(outputs.pop(MATCHES_FILENAME).decode())))
+    assert header == ["City/Town", "Scope", "Suggestion", "Score", "Applied"]
+    assert outputs == default_outputs
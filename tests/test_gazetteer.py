@@ -0,0 +1,62 @@
+import os
+
+from conftest import GAZETTEER_ROWS
+
+import gazetteer
+from gazetteer import build_index, ensure_index, load_gazetteer
+from normalization import normalize_key
+
+
+def write_gazetteer(tmp_path, text=GAZETTEER_ROWS):
+    source = tmp_path / "all_cities.csv"
+    source.write_text(text, encoding="utf-8")
+    return str(source)
+
+
+def count_builds(monkeypatch):
+    builds = []
+
+    def counting_build(*args, **kwargs):
+        builds.append(args)
+        return build_index(*args, **kwargs)
+
+    monkeypatch.setattr(gazetteer, "build_index", counting_build)
+    return builds
+
+
+def test_index_answers_lookups(tmp_path):
+    index = load_gazetteer(write_gazetteer(tmp_path))
+    springfield = normalize_key("Springfield")
+    assert index.has_us_city(normalize_key("Illinois"), springfield)
+    assert index.has_us_city(normalize_key("Massachusetts"), springfield)
+    assert not index.has_us_city(normalize_key("Texas"), springfield)
+    assert index.has_intl_city("Canada", normalize_key("Toronto"))
+    assert not index.has_intl_city("Germany", normalize_key("Toronto"))
+    assert index.display_name(normalize_key("Gießen")) == "Gießen"
+    index.close()
+
+
+def test_index_is_reused_until_the_source_changes(tmp_path, monkeypatch):
+    source = write_gazetteer(tmp_path)
+    index_path = ensure_index(source)
+    builds = count_builds(monkeypatch)
+
+    # Same content with a new mtime (e.g. a fresh copy) keeps the index.
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert ensure_index(source) == index_path
+    assert builds == []
+
+    write_gazetteer(tmp_path, GAZETTEER_ROWS + "5,Paris,Paris,,France,\n")
+    ensure_index(source)
+    assert len(builds) == 1
+    assert load_gazetteer(source).has_intl_city("France", normalize_key("Paris"))
+
+
+def test_index_is_rebuilt_for_a_new_format(tmp_path, monkeypatch):
+    source = write_gazetteer(tmp_path)
+    ensure_index(source)
+    builds = count_builds(monkeypatch)
+    monkeypatch.setattr(gazetteer, "INDEX_FORMAT_VERSION", "old")
+    ensure_index(source)
+    assert len(builds) == 1
@@ -0,0 +1,85 @@
+import csv
+import sqlite3
+
+from conftest import output_files, run_main
+
+import incremental
+from incremental import STATE_FILENAME, reference_fingerprint
+from main import process_csv
+
+
+def same_outputs(incremental_files, full_files):
+    # Reports list values with equal counts alphabetically in incremental
+    # runs, so only the split files are compared byte for byte.
+    assert incremental_files.keys() == full_files.keys()
+    for name, contents in full_files.items():
+        if name[0].isdigit():
+            assert incremental_files[name] == contents, name
+        else:
+            assert sorted(incremental_files[name].splitlines()) == sorted(
+                contents.splitlines()
+            ), name
+
+
+def changed_export(export_file, path):
+    with open(export_file, newline="", encoding="utf-8") as f:
+        records = list(csv.reader(f))
+    header, rows = records[0], records[1:]
+    rows = rows[300:] + rows[:50]
+    rows[0][2] = "Changed"  # Name (Last)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([header] + rows)
+    return path
+
+
+def stored_state(output_folder):
+    conn = sqlite3.connect(output_folder / STATE_FILENAME)
+    try:
+        return (
+            sorted(conn.execute("SELECT email, content_hash, copies FROM rows")),
+            sorted(conn.execute("SELECT key, value FROM meta")),
+        )
+    finally:
+        conn.close()
+
+
+def test_fingerprint_reads_the_reference_folder(
+    ctx, reference_dir, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)  # holds no reference files
+    fingerprint = reference_fingerprint(ctx)
+    monkeypatch.chdir(reference_dir)
+    assert reference_fingerprint(ctx) == fingerprint
+
+
+def test_reruns_match_full_runs(export_file, reference, tmp_path):
+    out = tmp_path / "incremental"
+    full = run_main(export_file, tmp_path / "full", reference)
+    same_outputs(run_main(export_file, out, reference, incremental=True), full)
+    same_outputs(run_main(export_file, out, reference, incremental=True), full)
+
+    export = changed_export(export_file, tmp_path / "changed.csv")
+    full = run_main(export, tmp_path / "full-changed", reference)
+    same_outputs(run_main(export, out, reference, incremental=True), full)
+
+
+def test_failed_rerun_keeps_outputs_and_state(
+    export_file, reference, tmp_path, monkeypatch
+):
+    out = tmp_path / "incremental"
+    run_main(export_file, out, reference, incremental=True)
+    before = output_files(out), stored_state(out)
+
+    def broken(conn, output_folder):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(incremental, "write_incremental_reports", broken)
+    export = changed_export(export_file, tmp_path / "changed.csv")
+    assert not process_csv(
+        str(export), str(out), "OPTIN_TIME", reference=reference, incremental=True
+    )
+    assert (output_files(out), stored_state(out)) == before
+
+    monkeypatch.undo()
+    full = run_main(export, tmp_path / "full", reference)
+    same_outputs(run_main(export, out, reference, incremental=True), full)
@@ -0,0 +1,79 @@
+import csv
+from contextlib import ExitStack
+from functools import partial
+
+import pytest
+from conftest import run_main
+
+import inputs
+import main
+from inputs import open_inputs
+
+ROWS = [
+    ["Email Address", "Notes", "School"],
+    ["a@x.com", "one line", "Lincoln High"],
+    ["b@x.com", "first line\nsecond, line\n\nfourth", 'The "Best" School'],
+    ["c@x.com", "", ""],
+    ["d@x.com", 'said "hi"\r\nthen left', "Roosevelt"],
+    ["e@x.com", "x" * 40, "Ünïcode Academy"],
+]
+
+
+def read_records(paths, **options):
+    with ExitStack() as stack:
+        fieldnames, records = open_inputs(paths, stack, **options)
+        return fieldnames, [list(record) for record in records]
+
+
+def test_quoted_newlines_across_span_boundaries(tmp_path):
+    path = tmp_path / "export.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(ROWS)
+    expected = read_records([str(path)])
+    assert expected == (ROWS[0], ROWS[1:])
+    # Every small span size puts a boundary inside some quoted field.
+    for chunk_bytes in range(1, 80):
+        assert (
+            read_records([str(path)], reader="mmap", chunk_bytes=chunk_bytes)
+            == expected
+        ), chunk_bytes
+
+
+def test_stray_quotes_in_unquoted_fields(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_bytes(
+        b'Email Address,Notes\na@x.com,5" tall\nb@x.com,"two\nlines"\n'
+        b'c@x.com,plain\nd@x.com,an "odd\n'
+    )
+    expected = read_records([str(path)])
+    for chunk_bytes in range(1, 40):
+        assert (
+            read_records([str(path)], reader="mmap", chunk_bytes=chunk_bytes)
+            == expected
+        ), chunk_bytes
+
+
+def test_mapped_files_read_as_one_export(tmp_path):
+    first, second = tmp_path / "first.csv", tmp_path / "second.csv"
+    first.write_text("A,B\n1,2\n", encoding="utf-8")
+    second.write_text('B,C\n3,"4\n5"\n', encoding="utf-8")
+    paths = [str(first), str(second)]
+    expected = (["A", "B", "C"], [["1", "2", ""], ["", "3", "4\n5"]])
+    assert read_records(paths) == expected
+    assert read_records(paths, reader="mmap", chunk_bytes=2) == expected
+
+
+@pytest.mark.parametrize("read_workers", [1, 2])
+def test_mmap_reader_matches_the_default_run(
+    read_workers, export_file, reference, default_outputs, tmp_path, monkeypatch
+):
+    # Small spans, so the export is read in many of them.
+    monkeypatch.setattr(
+        main, "open_inputs", partial(inputs.open_inputs, chunk_bytes=4096)
+    )
+    assert (
+        run_main(
+            export_file, tmp_path, reference, reader="mmap", read_workers=read_workers
+        )
+        == default_outputs
+    )
@@ -0,0 +1,48 @@
+import csv
+import io
+
+import pytest
+from conftest import run_main
+
+import parallel
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"workers": 2},
+        {"memory_budget_mb": 0.05},
+        {"workers": 2, "memory_budget_mb": 0.05},
+    ],
+    ids=["workers", "external-sort", "workers-external-sort"],
+)
+def test_modes_match_the_default_run(
+    options, export_file, reference, default_outputs, tmp_path, monkeypatch
+):
+    # Several chunks per worker, so merging them back in order is exercised.
+    monkeypatch.setattr(parallel, "DEFAULT_CHUNK_SIZE", 300)
+    assert run_main(export_file, tmp_path, reference, **options) == default_outputs
+
+
+def test_parquet_files_hold_the_csv_rows(
+    export_file, reference, default_outputs, tmp_path
+):
+    pq = pytest.importorskip("pyarrow.parquet")
+    outputs = run_main(export_file, tmp_path, reference, output_format="both")
+    parquet_names = [name for name in outputs if name.endswith(".parquet")]
+    assert {name for name in outputs if name not in parquet_names} == set(
+        default_outputs
+    )
+    assert sorted(name[: -len(".parquet")] for name in parquet_names) == sorted(
+        name[: -len(".csv")] for name in default_outputs if name[0].isdigit()
+    )
+    for name in parquet_names:
+        csv_name = name[: -len(".parquet")] + ".csv"
+        assert outputs[csv_name] == default_outputs[csv_name]
+        header, *rows = csv.reader(io.StringIO(outputs[csv_name].decode("utf-8")))
+        table = pq.read_table(tmp_path / name)
+        assert table.column_names == header
+        assert [
+            [str(value) if value is not None else "" for value in row.values()]
+            for row in table.to_pylist()
+        ] == rows, name
@@ -0,0 +1,47 @@
+import json
+
+from conftest import export_record, run_main
+
+from profiling import RUN_REPORT_FILENAME, RunProfile, clean_rows_by_rule
+
+
+def test_rule_detail_times_each_location_rule_once_per_location(ctx):
+    rows = [
+        ctx["schema"].from_record(
+            export_record({"Email Address": email, "Country": "Canada", "State": "-"})
+        )
+        for email in ["a@example.com", "b@example.com"]
+    ]
+    profile = RunProfile(rule_detail=True)
+    clean_rows_by_rule(rows, ctx, profile)
+    stage = profile.stages["location rule clear_bad_state"]
+    assert (stage["calls"], stage["rows"], stage["rows_modified"]) == (1, 1, 1)
+    assert profile.stages["rule clean_location"]["rows"] == 2
+    assert [row[ctx["state_index"]] for row in rows] == ["", ""]
+
+
+def test_stages_nest_and_add_up():
+    profile = RunProfile()
+    for rows in [2, 3]:
+        with profile.stage("read and clean"):
+            with profile.stage("clean", rows=rows) as record:
+                record["rows_modified"] = 1
+    clean = profile.stages["clean"]
+    assert list(profile.stages) == ["read and clean", "clean"]
+    assert (clean["calls"], clean["rows"]) == (2, 5)
+    assert profile.stages["read and clean"]["wall_seconds"] >= clean["wall_seconds"]
+
+
+def test_profiled_run_writes_its_report(
+    export_file, reference, default_outputs, tmp_path
+):
+    profile = RunProfile(rule_detail=True)
+    assert run_main(export_file, tmp_path, reference, profile=profile) == (
+        default_outputs
+    )
+    with open(tmp_path / RUN_REPORT_FILENAME, encoding="utf-8") as f:
+        report = json.load(f)
+    stages = {stage["name"]: stage for stage in report["stages"]}
+    assert stages["read and clean"]["rows"] == report["rows_read"]
+    assert stages["write"]["rows"] == report["rows_written"]
+    assert stages["rule clean_location"]["calls"] >= 1
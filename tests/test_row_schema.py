@@ -0,0 +1,45 @@
+from conftest import export_record
+
+from row_schema import RowSchema
+
+
+def test_rows_have_a_slot_for_every_column():
+    schema = RowSchema(["a", "b", "c"], extra_columns=["c", "d"])
+    assert schema.columns == ["a", "b", "c", "d"]
+    assert schema.from_record(["1", "2", "3"]) == ["1", "2", "3", ""]
+    # Short records are padded and values beyond the header are dropped.
+    assert schema.from_record(["1"]) == ["1", "", "", ""]
+    assert schema.from_record(["1", "2", "3", "4", "5"]) == ["1", "2", "3", ""]
+
+
+def test_repeated_header_refers_to_its_last_column():
+    schema = RowSchema(["a", "b", "a"])
+    assert schema.index["a"] == 2
+    assert schema.projector(["a"])(schema.from_record(["1", "2", "3"])) == ["3"]
+
+
+def test_projector_keeps_column_order():
+    schema = RowSchema(["a", "b", "c"])
+    row = schema.from_record(["1", "2", "3"])
+    assert schema.projector(["c", "a"])(row) == ["3", "1"]
+    assert schema.projector(["b"])(row) == ["2"]
+
+
+def test_interned_columns_share_one_object_per_value():
+    schema = RowSchema(["Email", "Country"], extra_columns=["Band"])
+    schema.intern_columns(["Country", "Country", "Band", "Missing"])
+    # Built at run time so that each record holds its own string object.
+    first = schema.from_record(["a@x.com", "".join(["Can", "ada"])])
+    second = schema.from_record(["b@x.com", "".join(["Can", "ada"])])
+    assert first[1] is second[1]
+    assert schema.from_record(["c@x.com", "Chile"])[1] == "Chile"
+
+
+def test_cleaning_context_interns_categorical_columns(ctx):
+    schema = ctx["schema"]
+    rows = [
+        schema.from_record(export_record({"Country": "".join(["Can", "ada"])}))
+        for _ in range(2)
+    ]
+    country = schema.index["Country"]
+    assert rows[0][country] is rows[1][country]
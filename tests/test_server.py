@@ -0,0 +1,134 @@
+import http.client
+import json
+import os
+import socket
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+from conftest import export_record
+
+from benchmark import EXPORT_HEADER
+from normalization import normalize_key
+from server import MAX_CONTEXTS, CleaningHandler, CleaningService
+
+BY_COUNTRY = "all_registrations_by_country.csv"
+
+
+@pytest.fixture
+def service(reference_dir, monkeypatch):
+    monkeypatch.chdir(reference_dir)
+    return CleaningService("OPTIN_TIME")
+
+
+@pytest.fixture
+def request_json(service):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CleaningHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(method, path, payload=None):
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        body = None if payload is None else json.dumps(payload)
+        conn.request(method, path, body, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = response.status, json.loads(response.read())
+        conn.close()
+        return result
+
+    request.port = server.server_port
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+def export_row(email, country):
+    values = {
+        "Email Address": email,
+        "I am a...": "Teacher / Educator",
+        "Country": country,
+        "OPTIN_TIME": "2025-01-02 03:04:05",
+    }
+    return dict(zip(EXPORT_HEADER, export_record(values)))
+
+
+def test_clean_returns_the_counts_of_its_own_rows(request_json):
+    status, first = request_json(
+        "POST", "/clean", {"rows": [export_row("a@x.com", "Canada")]}
+    )
+    assert status == 200
+    assert first["counters"][BY_COUNTRY] == {"Canada": 1}
+    status, second = request_json(
+        "POST", "/clean", {"row": export_row("b@x.com", "Germany")}
+    )
+    assert second["counters"][BY_COUNTRY] == {"Germany": 1}
+    status, total = request_json("GET", "/counters")
+    assert total["counters"][BY_COUNTRY] == {"Canada": 1, "Germany": 1}
+
+
+def test_short_header_is_a_bad_request(request_json):
+    row = {"Email Address": "a@x.com", "OPTIN_TIME": "2025-01-02 03:04:05"}
+    status, payload = request_json("POST", "/clean", {"row": row})
+    assert status == 400
+    assert "Expected at least 9 columns" in payload["error"]
+
+
+def test_unexpected_error_is_a_json_500(request_json, service, monkeypatch):
+    def broken(rows, ctx):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(service, "clean", broken)
+    row = export_row("a@x.com", "Canada")
+    status, payload = request_json("POST", "/clean", {"row": row})
+    assert status == 500
+    assert payload["error"] == "Internal error: boom"
+
+
+def test_contexts_are_capped(service):
+    state = service.state
+    for n in range(MAX_CONTEXTS + 5):
+        state.context(list(EXPORT_HEADER) + [f"Extra {n}"])
+    assert len(state.contexts) == MAX_CONTEXTS
+    assert (*EXPORT_HEADER, f"Extra {MAX_CONTEXTS + 4}") in state.contexts
+
+
+def test_slow_client_does_not_block_others(request_json):
+    with socket.create_connection(("127.0.0.1", request_json.port)) as slow:
+        slow.sendall(b"POST /clean HTTP/1.1\r\nContent-Length: 2\r\n\r\n{")
+        status, payload = request_json("GET", "/counters")
+        slow.sendall(b"}")
+        assert slow.recv(1024).startswith(b"HTTP/1.0 400")
+    assert status == 200
+
+
+def test_location_results_are_bounded(service, monkeypatch):
+    monkeypatch.setattr("server.MAX_LOCATIONS", 2)
+    ctx = service.state.context(list(EXPORT_HEADER))
+    for country in ["Canada", "Germany", "France"]:
+        service.clean_records(
+            list(EXPORT_HEADER), [export_record(export_row("a@x.com", country))]
+        )
+    assert list(ctx["location_cache"].entries) == [
+        ("Germany", "", "", False),
+        ("France", "", "", False),
+    ]
+
+
+def test_reload_clears_the_old_state_caches(service, reference_dir):
+    old_state = service.state
+    service.clean_records(
+        list(EXPORT_HEADER), [export_record(export_row("a@x.com", "Canada"))]
+    )
+    normalize_key("Canada")
+    old_state.reference["gazetteer"].has_intl_city("Canada", "ottawa")
+    stat = os.stat(reference_dir / "state_mappings.json")
+    os.utime(
+        reference_dir / "state_mappings.json",
+        ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000),
+    )
+    assert service.reload_if_changed()
+    assert service.state is not old_state
+    assert not old_state.contexts
+    assert not old_state.reference["gazetteer"]._intl_cache
+    assert normalize_key.cache_info().currsize == 0
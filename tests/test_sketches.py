@@ -0,0 +1,89 @@
+import csv
+import io
+import random
+from collections import Counter
+
+import pytest
+from conftest import run_main
+
+import parallel
+from sketches import (
+    SKETCHES_FILENAME,
+    TOP_SCHOOLS_FILENAME,
+    HyperLogLog,
+    SpaceSaving,
+    load_sketches,
+)
+from split_writer import MASTER_FILENAME
+
+
+def test_hyperloglog_stays_within_its_error():
+    sketch = HyperLogLog()
+    values = [f"user{n}@example.com" for n in range(20000)]
+    for value in values:
+        sketch.add(value)
+    assert sketch.registers is not None
+    assert abs(sketch.count() - len(values)) <= 4 * sketch.relative_error * len(
+        values
+    )
+
+
+def test_merged_hyperloglogs_equal_one_sketch():
+    whole, first, second = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for n in range(5000):
+        value = f"user{n}@example.com"
+        whole.add(value)
+        (first if n % 3 else second).add(value)
+    small = HyperLogLog()
+    small.add("user1@example.com")  # still exact
+    first.merge(second)
+    first.merge(small)
+    assert first.registers == whole.registers
+
+
+def test_space_saving_bounds_the_counts():
+    rng = random.Random(1)
+    stream = [f"school{min(int(rng.expovariate(0.05)), 500)}" for _ in range(20000)]
+    sketch = SpaceSaving(50)
+    for value in stream:
+        sketch.add(value)
+    true_counts = Counter(stream)
+    top = sketch.top(10)
+    for value, count, overcount in top:
+        assert count - overcount <= true_counts[value] <= count
+        assert overcount <= sketch.max_overcount()
+    # Every value occurring more than total / capacity times is listed.
+    frequent = {v for v, c in true_counts.items() if c > len(stream) // 50}
+    assert frequent <= set(sketch.counts)
+
+
+def read_csv(contents):
+    return list(csv.DictReader(io.StringIO(contents.decode("utf-8"))))
+
+
+@pytest.mark.parametrize("mode", ["approx", "exact"])
+def test_workers_match_the_serial_sketches(
+    mode, export_file, reference, default_outputs, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(parallel, "DEFAULT_CHUNK_SIZE", 300)
+    serial = run_main(export_file, tmp_path / "serial", reference, sketches=mode)
+    workers = run_main(
+        export_file, tmp_path / "workers", reference, sketches=mode, workers=2
+    )
+    assert {name: serial[name] for name in default_outputs} == default_outputs
+    # sketches.json lists the locations in the order they were first seen.
+    assert serial.pop(SKETCHES_FILENAME) and workers.pop(SKETCHES_FILENAME)
+    assert serial == workers
+
+
+def test_exact_sketches_match_a_recount(export_file, reference, tmp_path):
+    outputs = run_main(export_file, tmp_path, reference, sketches="exact")
+    rows = read_csv(outputs[MASTER_FILENAME])
+    schools = Counter(row["School / Company Name"].strip() for row in rows)
+    schools.pop("", None)
+    top = read_csv(outputs[TOP_SCHOOLS_FILENAME])
+    assert {row["School / Company Name"]: int(row["Count"]) for row in top} == dict(
+        schools
+    )
+    sketches = load_sketches(tmp_path / SKETCHES_FILENAME)
+    assert sketches.rows == len(rows)
@@ -0,0 +1,47 @@
+import csv
+import io
+
+from split_writer import MASTER_FILENAME, write_split_files
+from timestamps import split_ranges
+
+
+def read_rows(contents):
+    return list(csv.reader(io.StringIO(contents.decode("utf-8"))))
+
+
+def test_rows_go_to_the_master_and_their_range(tmp_path):
+    rows = [
+        ["a", "2024-10-01 00:00:00"],
+        ["b, with\nnewline", "2024-10-20 00:00:00"],
+        ["c", "2024-11-02 00:00:00"],
+        ["d", "2024-11-30 23:59:59"],
+        ["e", "2025-01-01 00:00:00"],
+    ]
+    written = write_split_files(
+        rows, str(tmp_path), ["Name", "Date"], list, 1, ranges=split_ranges()
+    )
+    assert written == len(rows)
+    files = {path.name: read_rows(path.read_bytes()) for path in tmp_path.iterdir()}
+    header = [["Name", "Date"]]
+    assert files == {
+        MASTER_FILENAME: header + rows,
+        "1-pre1015.csv": header + rows[:1],
+        "2-1031.csv": header + rows[1:2],
+        "3-2024-11.csv": header + rows[2:4],
+        "4-2025-01.csv": header + rows[4:],
+    }
+
+
+def test_split_files_partition_the_master(default_outputs):
+    master = read_rows(default_outputs[MASTER_FILENAME])
+    splits = sorted(
+        (name for name in default_outputs if name[0].isdigit()),
+        key=lambda name: int(name.split("-")[0]),
+    )
+    assert splits[0] == MASTER_FILENAME
+    rows = [master[0]]
+    for name in splits[1:]:
+        header, *split_rows = read_rows(default_outputs[name])
+        assert header == master[0]
+        rows.extend(split_rows)
+    assert rows == master
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+
+from timestamps import (
+    SORT_TIME_FORMAT,
+    date_range_filename,
+    parse_entry_date,
+    parse_sort_date,
+    parse_sort_time,
+    split_ranges,
+)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("2025-03-04", "2025-03-04 00:00:00"),
+        ("2025-3-4", "2025-03-04 00:00:00"),
+    ],
+)
+def test_entry_dates_are_canonical(text, expected):
+    assert parse_entry_date(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("2025-03-04 05:06:07", "2025-03-04 05:06:07"),
+        ("2025-3-4 5:6:7", "2025-03-04 05:06:07"),
+    ],
+)
+def test_sort_times_are_canonical(text, expected):
+    assert parse_sort_time(text) == expected
+
+
+@pytest.mark.parametrize("text", ["2025/03/04", "2025-02-30", ""])
+def test_invalid_entry_dates_raise(text):
+    with pytest.raises(ValueError):
+        parse_entry_date(text)
+
+
+@pytest.mark.parametrize("text", ["2025-02-30 00:00:00", "2025-03-04 24:00:00"])
+def test_invalid_sort_times_raise(text):
+    with pytest.raises(ValueError):
+        parse_sort_time(text)
+
+
+def test_canonical_text_orders_like_datetimes():
+    texts = ["2025-1-2 3:4:5", "2024-12-31 23:59:59", "2025-01-02 03:04:06"]
+    assert sorted(map(parse_sort_time, texts)) == [
+        str(date)
+        for date in sorted(datetime.strptime(text, SORT_TIME_FORMAT) for text in texts)
+    ]
+
+
+def test_entry_date_wins_over_the_sort_column():
+    assert parse_sort_date([" 2025-03-04 ", "2025-01-01 10:00:00"], 0, 1) == (
+        "2025-03-04 00:00:00"
+    )
+    assert parse_sort_date(["", "2025-01-01 10:00:00"], 0, 1) == (
+        "2025-01-01 10:00:00"
+    )
+
+
+def test_split_ranges_name_fixed_and_monthly_files():
+    ranges = split_ranges()
+    assert [filename for _, filename in ranges] == ["1-pre1015.csv", "2-1031.csv"]
+    assert date_range_filename("2024-10-14 23:59:59", ranges) == "1-pre1015.csv"
+    assert date_range_filename("2024-10-15 00:00:00", ranges) == "2-1031.csv"
+    assert date_range_filename("2024-11-01 00:00:00", ranges) == "2024-11"
+
+
+def test_split_dates_must_increase():
+    with pytest.raises(ValueError):
+        split_ranges(["2024-11-01", "2024-10-15"])
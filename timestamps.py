@@ -0,0 +1,119 @@
+"""Codec for the sort date of a row.
+
+The sort date is kept as the text that is written out, "YYYY-MM-DD HH:MM:SS".
+Every part is zero-padded and fixed-width, so comparing the text orders rows
+exactly like comparing datetimes, and the writers copy it without calling
+``strftime``.  Values already in that form are checked with
+``datetime.fromisoformat`` and kept as they are; anything else goes through
+``strptime`` once and is cached, since the same values repeat across rows.
+"""
+
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+ENTRY_DATE_FORMAT = "%Y-%m-%d"
+SORT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CACHE_SIZE = 65536
+MAX_SKIPPED_EXAMPLES = 5
+
+_FIXED_ENTRY_DATE = re.compile(r"\d{4}-\d\d-\d\d", re.ASCII)
+_FIXED_SORT_TIME = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d", re.ASCII)
+
+# The split files start with one file per fixed date range, ending before
+# each of these dates, followed by one file per month.
+DEFAULT_SPLIT_DATES = ["2024-10-15", "2024-11-01"]
+
+
+def _canonical(date):
+    return date.isoformat(sep=" ")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_entry_date(text):
+    if _FIXED_ENTRY_DATE.fullmatch(text):
+        try:
+            datetime.fromisoformat(text)
+            return text + " 00:00:00"
+        except ValueError:
+            pass
+    return _canonical(datetime.strptime(text, ENTRY_DATE_FORMAT))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_sort_time(text):
+    if _FIXED_SORT_TIME.fullmatch(text):
+        try:
+            datetime.fromisoformat(text)
+            return text
+        except ValueError:
+            pass
+    return _canonical(datetime.strptime(text, SORT_TIME_FORMAT))
+
+
+def parse_sort_date(row, entry_date_index, sort_index):
+    # Use "Entry Date" if available; otherwise, use sort_column.
+    entry_date = row[entry_date_index].strip()
+    if entry_date:
+        return parse_entry_date(entry_date)
+    return parse_sort_time(row[sort_index].strip())
+
+
+# Rows with a sort date that cannot be parsed are skipped and counted; the
+# first few are kept as examples for the summary.
+
+
+def new_skipped():
+    return {"count": 0, "examples": []}
+
+
+def record_skipped(skipped, row, email_index, error):
+    skipped["count"] += 1
+    if len(skipped["examples"]) < MAX_SKIPPED_EXAMPLES:
+        skipped["examples"].append(f"{row[email_index].strip()!r}: {error}")
+
+
+def merge_skipped(target, other):
+    target["count"] += other["count"]
+    room = MAX_SKIPPED_EXAMPLES - len(target["examples"])
+    target["examples"].extend(other["examples"][:room])
+    return target
+
+
+def print_skipped(skipped):
+    if not skipped["count"]:
+        return
+    print(f"Skipped {skipped['count']} rows with an unparseable date, e.g.:")
+    for example in skipped["examples"]:
+        print(f"  {example}")
+
+
+def split_ranges(split_dates=DEFAULT_SPLIT_DATES):
+    """Return (end, filename) for each fixed range, in order.
+
+    The first file is named after the day its range ends before and the others
+    after their last day, so the default dates give "1-pre1015.csv" and
+    "2-1031.csv".  Monthly files are numbered after the fixed ones.
+    """
+    ends = [datetime.strptime(date, ENTRY_DATE_FORMAT) for date in split_dates]
+    if any(later <= earlier for earlier, later in zip(ends, ends[1:])):
+        raise ValueError("Split dates must be in increasing order")
+    ranges = []
+    for number, end in enumerate(ends, start=1):
+        if number == 1:
+            filename = f"1-pre{end:%m%d}.csv"
+        else:
+            filename = f"{number}-{end - timedelta(days=1):%m%d}.csv"
+        ranges.append((_canonical(end), filename))
+    return ranges
+
+
+DEFAULT_SPLIT_RANGES = split_ranges()
+
+
+def date_range_filename(sort_text, ranges=DEFAULT_SPLIT_RANGES):
+    """Return the fixed range's filename, or "YYYY-MM" for a monthly file."""
+    for end, filename in ranges:
+        if sort_text < end:
+            return filename
+    return sort_text[:7]